@@ -0,0 +1,102 @@
+"""
+Compares per-request latency with a new connection for every request against reusing keep-alive connections from an
+HttpPool, for Drive requests sent over HTTPS to the fake Drive backend on localhost. Runs once as is and once with some
+simulated network latency, since the handshakes a new connection costs are round trips. Run from the root directory:
+
+    python -m benchmarks.bench_connection_reuse
+"""
+import json
+import statistics
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import httplib2
+from google.oauth2.credentials import Credentials
+
+from benchmarks.fake_drive import FakeDriveHttp
+from benchmarks.https_stand_in import HttpsStandIn
+from services.http_pool import HttpPool
+
+REQUESTS = 200
+THREADS = 8
+# seconds
+ROUND_TRIPS = [0.0, 0.01]
+
+
+class NewConnectionPerRequest:
+    """
+    sends every request on a connection of its own, like a client with no keep-alive (or a dropped connection) does
+    """
+
+    def __init__(self, factory):
+        self.factory = factory
+
+    def request(self, uri, **kwargs):
+        http = self.factory()
+        try:
+            return http.request(uri, **kwargs)
+        finally:
+            http.close()
+
+
+def run(stand_in: HttpsStandIn, http, uri: str) -> dict:
+    """
+    sends REQUESTS requests one after another, then REQUESTS more from THREADS threads at once
+    :param stand_in: the server, to count the connections opened
+    :param http: what to send the requests with
+    :param uri: the url to get
+    :return: latency percentiles in milliseconds, the threaded run's wall time and how many connections were opened
+    """
+    connections = stand_in.connections
+
+    def timed_request(_=None) -> float:
+        started = time.perf_counter()
+        response, _ = http.request(uri, headers={"authorization": "Bearer benchmark"})
+        assert response.status == 200, response.status
+        return (time.perf_counter() - started) * 1000
+
+    latencies = sorted(timed_request() for _ in range(REQUESTS))
+    started = time.perf_counter()
+    with ThreadPoolExecutor(THREADS) as executor:
+        list(executor.map(timed_request, range(REQUESTS)))
+    return {
+        "mean_ms": round(statistics.mean(latencies), 2),
+        "p50_ms": round(latencies[len(latencies) // 2], 2),
+        "p95_ms": round(latencies[int(len(latencies) * 0.95)], 2),
+        "threaded_seconds": round(time.perf_counter() - started, 2),
+        "connections": stand_in.connections - connections,
+    }
+
+
+def benchmark(round_trip: float) -> dict:
+    """
+    :param round_trip: simulated network latency in seconds
+    :return: the results without and with connection reuse
+    """
+    fake = FakeDriveHttp()
+    file_id = fake.add_file("benchmark file", fake.add_folder("benchmark root"))
+    with HttpsStandIn(fake, round_trip=round_trip) as stand_in:
+        uri = f"{stand_in.url}/drive/v3/files/{file_id}?fields=id%2Cname"
+
+        def factory():
+            return httplib2.Http(ca_certs=stand_in.certificate, proxy_info=None)
+
+        pool = HttpPool(Credentials(token="benchmark"), size=THREADS, factory=factory)
+        results = {
+            "new_connection_per_request": run(stand_in, NewConnectionPerRequest(factory), uri),
+            "pooled": run(stand_in, pool, uri),
+        }
+        pool.close()
+    return results
+
+
+if __name__ == "__main__":
+    for round_trip in ROUND_TRIPS:
+        results = benchmark(round_trip)
+        print(f"round trip {round_trip * 1000:.0f}ms: {json.dumps(results, indent=4)}")
+        before, after = results["new_connection_per_request"], results["pooled"]
+        print(
+            f"p50 {before['p50_ms']}ms -> {after['p50_ms']}ms, "
+            f"threaded {before['threaded_seconds']}s -> {after['threaded_seconds']}s, "
+            f"{before['connections']} -> {after['connections']} connections"
+        )
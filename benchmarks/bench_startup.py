@@ -0,0 +1,84 @@
+"""
+Measures how long the cli takes to start: importing main (and everything it imports), loading a still valid token.json
+and building the Drive connection for the first request, each in a fresh interpreter. The first request goes to the
+fake Drive backend, so only our side of it is timed. Run from the root directory:
+
+    python -m benchmarks.bench_startup
+"""
+import datetime
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+from google.oauth2.credentials import Credentials
+
+RUNS = 7
+
+# run in the fresh interpreter, from the root directory with the token directory as its argument
+CHILD = """
+import json, os, sys, time
+
+# imports are found from the root directory even after moving to the token directory
+sys.path[0] = os.getcwd()
+started = time.perf_counter()
+import main
+imported = time.perf_counter()
+os.chdir(sys.argv[1])
+credentials = main.google_drive_helpers.get_credentials()
+loaded = time.perf_counter()
+
+# the fake backend isn't part of startup, so importing it isn't counted
+from benchmarks.fake_drive import FakeDriveHttp
+fake = FakeDriveHttp()
+root_id = fake.add_folder("root")
+config = {"copy_exact_filename": True}
+ready = time.perf_counter()
+main.google_drive_helpers.GoogleDrive(credentials, config, http=fake).get_files_and_folders(root_id)
+done = time.perf_counter()
+
+print(json.dumps({
+    "import_ms": (imported - started) * 1000,
+    "credentials_ms": (loaded - imported) * 1000,
+    "first_request_ms": (done - ready) * 1000,
+    "modules": len(sys.modules),
+}))
+"""
+
+
+def write_token(directory: str) -> None:
+    """
+    writes a token.json whose access token is good for another hour, like a run shortly after the last one would find
+    :param directory: where to write it
+    """
+    credentials = Credentials(
+        token="benchmark",
+        refresh_token="benchmark",
+        client_id="benchmark",
+        client_secret="benchmark",
+        expiry=datetime.datetime.now(datetime.UTC).replace(tzinfo=None) + datetime.timedelta(hours=1),
+    )
+    with open(os.path.join(directory, "token.json"), "w") as token:
+        token.write(credentials.to_json())
+
+
+def run_once(directory: str) -> dict:
+    """
+    :param directory: the directory with the token in it
+    :return: the timings from one fresh interpreter
+    """
+    output = subprocess.run([sys.executable, "-c", CHILD, directory], check=True, capture_output=True, text=True)
+    return json.loads(output.stdout.splitlines()[-1])
+
+
+if __name__ == "__main__":
+    with tempfile.TemporaryDirectory() as directory:
+        write_token(directory)
+        # the first run warms the os file cache and the bytecode cache, so it isn't counted
+        run_once(directory)
+        runs = [run_once(directory) for _ in range(RUNS)]
+    results = {key: round(statistics.median(run[key] for run in runs), 1) for key in runs[0]}
+    results["total_ms"] = round(results["import_ms"] + results["credentials_ms"] + results["first_request_ms"], 1)
+    print(json.dumps(results, indent=4))
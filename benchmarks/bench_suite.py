@@ -0,0 +1,193 @@
+"""
+Benchmarks every traversal and copy engine against the fake Drive backend, on synthetic trees of a few different
+shapes, and reports the calls, wall time, throughput and peak memory of each as json, so runs can be kept and compared
+over time. Run from the root directory:
+
+    python -m benchmarks.bench_suite
+    python -m benchmarks.bench_suite --latency 0.02 --scale 2 --shape wide --engine parallel --output results.json
+
+Copies are timed on their own, from an already walked tree, apart from `streaming` which walks and copies at once.
+Peak memory is measured with tracemalloc, which slows everything down a little (but evenly).
+"""
+import datetime
+import json
+import platform
+import subprocess
+import sys
+import time
+import tracemalloc
+
+import click
+
+from benchmarks.fake_drive import FakeDriveHttp, build_tree
+from services.compact_tree import walk_compact_tree
+from services.counting import count_tree
+from services.google_drive_helpers import GoogleDrive
+
+CONFIG = {
+    "copy_exact_filename": True,
+    "traversal_workers": 8,
+    "copy_workers": 8,
+    "rate_limit_qps": 100000,
+    "rate_limit_max_qps": 100000,
+}
+
+
+def build_skewed_tree(fake: FakeDriveHttp, parent_id: str, scale: int) -> None:
+    """
+    lots of tiny folders next to one big, deep one -- the shape that keeps one worker busy while the others sit idle
+    """
+    for index in range(30 * scale):
+        fake.add_file("file", fake.add_folder(f"small folder {index}", parent_id))
+    big_folder_id = fake.add_folder("big folder", parent_id)
+    build_tree(fake, big_folder_id, depth=3, folders_per_folder=3, files_per_folder=10 * scale)
+
+
+def build_huge_folder(fake: FakeDriveHttp, parent_id: str, scale: int) -> None:
+    """
+    one folder with thousands of files in it, too many to page through quickly one page at a time
+    """
+    folder_id = fake.add_folder("huge folder", parent_id)
+    for index in range(2000 * scale):
+        fake.add_file(f"file {index}", folder_id)
+
+
+# shape -> builds it under a folder, for a scale
+SHAPES = {
+    # a few folders with hundreds of files each, so listings take several pages
+    "wide": lambda fake, parent_id, scale: build_tree(fake, parent_id, 1, 4, 250 * scale),
+    # a single chain of folders, which nothing can parallelise
+    "deep": lambda fake, parent_id, scale: build_tree(fake, parent_id, 12 * scale, 1, 4),
+    "balanced": lambda fake, parent_id, scale: build_tree(fake, parent_id, 3, 3, 8 * scale),
+    "skewed": build_skewed_tree,
+    "huge": build_huge_folder,
+}
+
+# engine -> config it needs on top of CONFIG, and how it is run
+WALK_ENGINES = {
+    "recursive": ({}, lambda google_drive, root_id: google_drive.get_nested_objects(root_id)),
+    "concurrent": ({}, lambda google_drive, root_id: google_drive.get_nested_objects_concurrent(root_id)),
+    "concurrent_batched": (
+        {"listing_batch_size": 50},
+        lambda google_drive, root_id: google_drive.get_nested_objects_concurrent(root_id),
+    ),
+    "compact": ({}, lambda google_drive, root_id: walk_compact_tree(google_drive, root_id).totals()),
+    "counting": ({"listing_batch_size": 50}, lambda google_drive, root_id: count_tree(google_drive, root_id).totals()),
+}
+COPY_ENGINES = ["sequential", "batched", "parallel", "streaming"]
+
+
+def run_case(
+    shape: str, kind: str, engine: str, scale: int = 1, latency: float = 0.0, max_page_size: int = 100
+) -> dict:
+    """
+    runs one engine against a fresh fake drive with a tree of the given shape
+    :param shape: one of SHAPES
+    :param kind: "walk" or "copy"
+    :param engine: one of WALK_ENGINES or COPY_ENGINES
+    :param scale: how much bigger than the default to make the tree
+    :param latency: seconds each request takes
+    :param max_page_size: the most files the fake gives back per listing page
+    :return: what was measured, with `ok` saying whether every item was walked or copied
+    """
+    fake = FakeDriveHttp(latency=latency, max_page_size=max_page_size)
+    root_id = fake.add_folder("benchmark root")
+    SHAPES[shape](fake, root_id, scale)
+    items = len(fake.files) - 1
+
+    config = {**CONFIG, **WALK_ENGINES[engine][0]} if kind == "walk" else {**CONFIG, "copy_engine": engine}
+    google_drive = GoogleDrive(None, config, http=fake)
+    drive_data = None
+    if kind == "copy" and engine != "streaming":
+        drive_data, _, _ = google_drive.get_nested_objects_concurrent(root_id)
+    before, files_before = dict(fake.stats), len(fake.files)
+
+    tracemalloc.start()
+    started = time.perf_counter()
+    if kind == "walk":
+        result = WALK_ENGINES[engine][1](google_drive, root_id)
+        ok = sum(result[-2:]) == items
+    elif engine == "streaming":
+        ok = bool(google_drive.copy_nested_items_streaming(root_id))
+    else:
+        ok = bool(google_drive.copy_nested_items(drive_data))
+    seconds = time.perf_counter() - started
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    google_drive.close()
+
+    if kind == "copy":
+        # every item plus the copy of the root folder
+        ok = ok and len(fake.files) - files_before == items + 1
+    return {
+        "shape": shape,
+        "kind": kind,
+        "engine": engine,
+        "items": items,
+        "ok": ok,
+        "seconds": round(seconds, 3),
+        "items_per_second": round(items / seconds, 1) if seconds else None,
+        "calls": fake.stats["calls"] - before["calls"],
+        "http_requests": fake.stats["requests"] - before["requests"],
+        "list_pages": fake.stats["list_pages"] - before["list_pages"],
+        "batches": fake.stats["batches"] - before["batches"],
+        "peak_mb": round(peak / 2**20, 2),
+    }
+
+
+def git_commit() -> str | None:
+    """
+    :return: the commit being benchmarked, if we're in a git checkout
+    """
+    try:
+        output = subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True)
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return output.stdout.strip()
+
+
+@click.command()
+@click.option("--shape", "shapes", multiple=True, type=click.Choice(list(SHAPES)), help="only these tree shapes")
+@click.option(
+    "--engine",
+    "engines",
+    multiple=True,
+    type=click.Choice([*WALK_ENGINES, *COPY_ENGINES]),
+    help="only these walk/copy engines",
+)
+@click.option("--scale", default=1, help="multiplies the size of every tree")
+@click.option("--latency", default=0.005, help="seconds every request to the fake drive takes")
+@click.option("--max-page-size", default=100, help="the most files per listing page")
+@click.option("--output", type=click.Path(dir_okay=False), default=None, help="write the json results here")
+def main(shapes: tuple, engines: tuple, scale: int, latency: float, max_page_size: int, output: str) -> None:
+    parameters = {"scale": scale, "latency": latency, "max_page_size": max_page_size}
+    cases = [("walk", engine) for engine in WALK_ENGINES] + [("copy", engine) for engine in COPY_ENGINES]
+    results = []
+    for shape in shapes or SHAPES:
+        for kind, engine in cases:
+            if engines and engine not in engines:
+                continue
+            result = run_case(shape, kind, engine, **parameters)
+            results.append(result)
+            print(
+                f"{shape:>8} {kind:>4} {engine:<18} {result['items']:>6} items {result['seconds']:>8.3f}s "
+                f"{result['calls']:>6} calls {result['peak_mb']:>8.2f}MB{'' if result['ok'] else '  INCOMPLETE'}",
+                file=sys.stderr,
+            )
+
+    report = {
+        "started_at": datetime.datetime.now(datetime.UTC).isoformat(timespec="seconds"),
+        "git_commit": git_commit(),
+        "python": platform.python_version(),
+        "parameters": parameters,
+        "results": results,
+    }
+    if output:
+        with open(output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=4)
+    else:
+        print(json.dumps(report, indent=4))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,112 @@
+"""
+Compares the memory used by the drive data dicts and by a CompactTree for the same synthetic tree of about a million
+folders and files. Listings are generated directly rather than served by the fake Drive backend, since it's only the
+in-memory representation being measured. Run from the root directory:
+
+    python -m benchmarks.bench_tree_memory
+"""
+import gc
+import json
+import random
+import string
+import time
+import tracemalloc
+
+from services.compact_tree import CompactTree
+from services.google_drive_helpers import file_object, folder_object
+
+# every folder has this many sub folders and files, down to the depth that gets us about a million nodes
+FOLDERS_PER_FOLDER = 8
+FILES_PER_FOLDER = 40
+TARGET_NODES = 1_000_000
+
+
+def drive_id(rng: random.Random) -> str:
+    """
+    :return: something that looks like a Drive id
+    """
+    return "".join(rng.choices(string.ascii_letters + string.digits + "-_", k=33))
+
+
+def synthetic_listings(seed: int = 0):
+    """
+    the listings of a synthetic tree, parents before their children like the traversal hands them over
+    :param seed: seed for the ids, so each run builds the same tree
+    :return: an iterator of listings
+    """
+    rng = random.Random(seed)
+    pending, nodes = [drive_id(rng)], 1
+    while pending:
+        folder_id = pending.pop(0)
+        folders, files = [], []
+        if nodes < TARGET_NODES:
+            folders = [
+                folder_object({"id": drive_id(rng), "name": f"folder {nodes + index}"})
+                for index in range(FOLDERS_PER_FOLDER)
+            ]
+            files = [
+                file_object({"id": drive_id(rng), "name": f"file {nodes + index}.pdf"})
+                for index in range(FILES_PER_FOLDER)
+            ]
+            nodes += len(folders) + len(files)
+            pending.extend(folder["folder_id"] for folder in folders)
+        yield {
+            "folder_id": folder_id,
+            "folders": folders,
+            "files": files,
+            "local_object_count": len(folders) + len(files),
+        }
+
+
+def build_drive_data() -> dict:
+    """
+    assembles the listings into the drive data dicts, like get_nested_objects_concurrent does
+    """
+    folders, drive_data = {}, None
+    for listing in synthetic_listings():
+        if drive_data is None:
+            drive_data = listing
+        else:
+            folders.pop(listing["folder_id"])["child_objects"] = listing
+        folders.update((folder["folder_id"], folder) for folder in listing["folders"])
+    return drive_data
+
+
+def build_compact_tree() -> CompactTree:
+    """
+    adds the listings to a compact tree, like walk_compact_tree does
+    """
+    listings = synthetic_listings()
+    root = next(listings)
+    tree = CompactTree(root["folder_id"])
+    tree.add_listing(root)
+    for listing in listings:
+        tree.add_listing(listing)
+    tree.compute_counts()
+    return tree
+
+
+def measure(build) -> dict:
+    """
+    :param build: builds the tree
+    :return: the memory the built tree holds on to, the peak while building it and how long it took
+    """
+    gc.collect()
+    tracemalloc.start()
+    started = time.perf_counter()
+    tree = build()
+    seconds = time.perf_counter() - started
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del tree
+    return {"retained_mb": round(current / 2**20, 1), "peak_mb": round(peak / 2**20, 1), "seconds": round(seconds, 1)}
+
+
+if __name__ == "__main__":
+    nodes = sum(listing["local_object_count"] for listing in synthetic_listings()) + 1
+    results = {"nodes": nodes, "drive_data": measure(build_drive_data), "compact_tree": measure(build_compact_tree)}
+    print(json.dumps(results, indent=4))
+    print(
+        f"compact tree retains {results['compact_tree']['retained_mb'] / results['drive_data']['retained_mb']:.0%} "
+        f"of the drive data's memory"
+    )
@@ -0,0 +1,585 @@
+"""
+An in-process fake of the parts of the Drive v3 REST API we use. It stands in for the `httplib2.Http` object a
+googleapiclient connection talks through, so the real request building, pagination and field masks are exercised
+without touching Google Drive:
+
+    fake = FakeDriveHttp()
+    root_id = fake.add_folder("root folder")
+    google_drive = GoogleDrive(None, config, http=fake)
+"""
+import asyncio
+import functools
+import itertools
+import json
+import operator
+import random
+import re
+import threading
+import time
+import uuid
+from email.parser import Parser
+from http.client import responses as reasons
+from urllib.parse import parse_qs, urlsplit
+
+import httplib2
+
+TYPE_FOLDER = "application/vnd.google-apps.folder"
+# what Drive sends back for a file resource when no `fields` mask is given
+DEFAULT_FILE_FIELDS = "kind,id,name,mimeType"
+DEFAULT_LIST_FIELDS = f"kind,nextPageToken,incompleteSearch,files({DEFAULT_FILE_FIELDS})"
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+
+
+def parse_fields(fields: str) -> dict:
+    """
+    parses a partial response mask like `nextPageToken, files(id,name)` into {"nextPageToken": None, "files": {...}}
+    :param fields: the fields mask
+    :return: a dict of field name -> nested mask (or None for the whole field)
+    """
+    mask, depth, start = {}, 0, 0
+    for index, character in enumerate(fields + ","):
+        if character == "(":
+            depth += 1
+        elif character == ")":
+            depth -= 1
+        elif character == "," and depth == 0:
+            token = fields[start:index].strip()
+            start = index + 1
+            if not token:
+                continue
+            if "(" in token:
+                name, nested = token.split("(", 1)
+                mask[name.strip()] = parse_fields(nested[:-1])
+            else:
+                mask[token] = None
+    return mask
+
+
+def apply_fields(resource: dict, mask: dict) -> dict:
+    """
+    trims a resource down to a parsed fields mask
+    :param resource: the full resource
+    :param mask: the parsed mask from parse_fields
+    :return:
+    """
+    if "*" in mask:
+        return resource
+    trimmed = {}
+    for name, nested in mask.items():
+        if name not in resource:
+            continue
+        value = resource[name]
+        if nested is not None and isinstance(value, list):
+            value = [apply_fields(item, nested) for item in value]
+        elif nested is not None and isinstance(value, dict):
+            value = apply_fields(value, nested)
+        trimmed[name] = value
+    return trimmed
+
+
+# query language comparison -> how to make it
+OPERATORS = {
+    "=": operator.eq,
+    "!=": operator.ne,
+    "<": operator.lt,
+    "<=": operator.le,
+    ">": operator.gt,
+    ">=": operator.ge,
+}
+_CONDITION = re.compile(r"^(?:'(?P<parent>[^']*)' in parents|(?P<field>\w+) (?P<op>=|!=|<=|>=|<|>) (?P<value>.+))$")
+
+
+@functools.lru_cache(maxsize=1024)
+def _parse_condition(condition: str) -> tuple:
+    """
+    :param condition: ie `'abc' in parents` or `mimeType != 'application/vnd.google-apps.folder'`
+    :return: (parent id, None, None, None) for a parents condition, otherwise (None, field, operator, value)
+    """
+    match = _CONDITION.match(condition.strip())
+    if not match:
+        raise ValueError(f"fake drive does not understand query condition: {condition}")
+    if match["parent"] is not None:
+        return match["parent"], None, None, None
+    value = match["value"].strip()
+    value = value[1:-1] if value.startswith("'") else json.loads(value)
+    return None, match["field"], match["op"], value
+
+
+def _matches_condition(resource: dict, condition: str) -> bool:
+    """
+    evaluates a single query condition against a resource
+    :param resource: the file resource
+    :param condition: ie `'abc' in parents` or `mimeType != 'application/vnd.google-apps.folder'`
+    :return:
+    """
+    parent, field, op, value = _parse_condition(condition)
+    if parent is not None:
+        return parent in resource["parents"]
+    return OPERATORS[op](resource.get(field), value)
+
+
+@functools.lru_cache(maxsize=1024)
+def _parse_query(query: str) -> tuple:
+    """
+    :param query: the `q` parameter of a files list call
+    :return: the `and` of terms, each term being the `or` of its conditions
+    """
+    terms = []
+    for term in re.split(r" and (?![^(]*\))", query):
+        term = term.strip()
+        if term.startswith("(") and term.endswith(")"):
+            term = term[1:-1]
+        terms.append(tuple(term.split(" or ")))
+    return tuple(terms)
+
+
+def matches_query(resource: dict, query: str) -> bool:
+    """
+    evaluates the small subset of the Drive query language we use: `and` of terms, where a term is a single condition
+    or a parenthesised `or` of conditions
+    :param resource: the file resource
+    :param query: the `q` parameter of a files list call
+    :return:
+    """
+    return all(
+        any(_matches_condition(resource, condition) for condition in term) for term in _parse_query(query)
+    )
+
+
+def timestamp(tick: int) -> str:
+    """
+    an RFC 3339 modifiedTime for the fake drive's logical clock, so every change gets a later time than the last
+    :param tick: how many changes the drive has seen
+    :return:
+    """
+    return time.strftime("%Y-%m-%dT%H:%M:%S.000Z", time.gmtime(1704067200 + tick))
+
+
+class FakeDriveHttp:
+    """
+    a thread safe stand in for httplib2.Http that answers Drive v3 requests from an in memory set of files
+    :param error_rate: the chance any single request fails with a 429 or 503
+    :param quota_per_second: if set, requests past this many in the same second get a 403 userRateLimitExceeded
+    :param seed: seed for the error injection, for repeatable runs
+    :param latency: seconds every http request (a whole batch counts as one) takes, like a network round trip
+    :param max_page_size: the most files a listing page can have, whatever pageSize asks for
+    :param incomplete_search_over: if set, listings matching more files than this come back with incompleteSearch set
+    (still with their files), like Drive does for queries it gives up on
+    """
+
+    def __init__(
+        self,
+        error_rate: float = 0.0,
+        quota_per_second: int = None,
+        seed: int = None,
+        latency: float = 0.0,
+        max_page_size: int = MAX_PAGE_SIZE,
+        incomplete_search_over: int = None,
+    ):
+        self.error_rate = error_rate
+        self.quota_per_second = quota_per_second
+        self.latency = latency
+        self.max_page_size = max_page_size
+        self.incomplete_search_over = incomplete_search_over
+        self.random = random.Random(seed)
+        self.quota_window = (0, 0)
+        self.files = {}
+        # parent id -> ids of the files in it, so listings don't have to scan the whole drive
+        self.by_parent = {}
+        # ids of changed files in the order they changed, for the changes api (a page token is an index into this)
+        self.change_log = []
+        # (query, order by) -> (how long the change log was, the files it matched), so pages don't rerun queries
+        self.query_results = {}
+        self.lock = threading.Lock()
+        self._ids = itertools.count()
+        # running totals of what we have served
+        # (`calls` counts each sub-request of a batch, `requests` the http requests themselves)
+        self.stats = {"calls": 0, "requests": 0, "batches": 0, "list_pages": 0, "bytes": 0, "errors": 0}
+
+    def new_id(self) -> str:
+        """
+        :return: a fresh, unique file id
+        """
+        return f"fake-{next(self._ids):08d}"
+
+    def add_file(self, name: str, parent_id: str = None, mime_type: str = "text/plain", **extra) -> str:
+        """
+        adds a file to the fake drive
+        :param name: name of the file
+        :param parent_id: the folder to put it in (top of the drive if not provided)
+        :param mime_type: its mime type
+        :param extra: any other file resource fields (ie size, md5Checksum)
+        :return: the new file id
+        """
+        with self.lock:
+            file_id = self.new_id()
+            self.files[file_id] = {
+                "kind": "drive#file",
+                "id": file_id,
+                "name": name,
+                "mimeType": mime_type,
+                "parents": [parent_id] if parent_id else [],
+                "trashed": False,
+                "modifiedTime": timestamp(len(self.change_log)),
+                **extra,
+            }
+            for parent in self.files[file_id]["parents"]:
+                self.by_parent.setdefault(parent, []).append(file_id)
+            self.change_log.append(file_id)
+            return file_id
+
+    def add_folder(self, name: str, parent_id: str = None) -> str:
+        """
+        adds a folder to the fake drive
+        :param name: name of the folder
+        :param parent_id: the folder to put it in (top of the drive if not provided)
+        :return: the new folder id
+        """
+        return self.add_file(name, parent_id, TYPE_FOLDER)
+
+    def update_file(self, file_id: str, add_parents: list = (), remove_parents: list = (), **fields) -> None:
+        """
+        changes a file in place, ie renaming, trashing or moving it
+        :param file_id: the file to change
+        :param add_parents: folders to add the file to
+        :param remove_parents: folders to take the file out of
+        :param fields: file resource fields to overwrite (ie name, trashed)
+        :return:
+        """
+        with self.lock:
+            resource = self.files[file_id]
+            resource["modifiedTime"] = timestamp(len(self.change_log))
+            resource.update(fields)
+            for parent in remove_parents:
+                resource["parents"].remove(parent)
+                self.by_parent[parent].remove(file_id)
+            for parent in add_parents:
+                resource["parents"].append(parent)
+                self.by_parent.setdefault(parent, []).append(file_id)
+            self.change_log.append(file_id)
+
+    def children(self, folder_id: str) -> list:
+        """
+        :param folder_id: the folder id
+        :return: the resources directly inside a folder
+        """
+        with self.lock:
+            return [self.files[file_id] for file_id in self.by_parent.get(folder_id, [])]
+
+    def request(self, uri, method="GET", body=None, headers=None, redirections=None, connection_type=None):
+        """
+        the httplib2.Http request interface googleapiclient calls into
+        :return: a (response, content) tuple
+        """
+        if self.latency:
+            # outside the lock, so concurrent requests wait out their latency together like they would on the network
+            time.sleep(self.latency)
+        status, content_type, content = self.respond(uri, method, body, headers)
+        response = httplib2.Response({"status": status, "content-type": content_type})
+        return response, content
+
+    def respond(self, uri: str, method: str = "GET", body=None, headers: dict = None) -> tuple[int, str, bytes]:
+        """
+        answers a request straight away, whatever the latency
+        :return: the status, content type and content of the response
+        """
+        url = urlsplit(uri)
+        if isinstance(body, bytes):
+            body = body.decode("utf-8")
+        if url.path.startswith("/batch/"):
+            content_type, content = self.handle_batch(headers or {}, body)
+            status = 200
+        else:
+            params = {key: values[-1] for key, values in parse_qs(url.query).items()}
+            status, payload = self.handle(method, url.path, params, json.loads(body) if body else {})
+            content_type, content = "application/json; charset=UTF-8", json.dumps(payload).encode("utf-8")
+        with self.lock:
+            self.stats["requests"] += 1
+            self.stats["bytes"] += len(content)
+        return status, content_type, content
+
+    def close(self) -> None:
+        """
+        httplib2.Http.close -- there are no connections to close
+        """
+
+    def handle_batch(self, headers: dict, body: str) -> tuple[str, bytes]:
+        """
+        answers a multipart/mixed batch request by running each sub-request in turn
+        :param headers: the batch request headers
+        :param body: the multipart batch body
+        :return: the content type and multipart body of the batch response
+        """
+        with self.lock:
+            self.stats["batches"] += 1
+        message = Parser().parsestr(f"content-type: {headers['content-type']}\r\n\r\n{body}")
+        boundary = uuid.uuid4().hex
+        parts = []
+        for part in message.get_payload():
+            request_line, sub_request = part.get_payload().split("\n", 1)
+            sub_method, sub_uri, _ = request_line.split(" ")
+            sub_message = Parser().parsestr(sub_request)
+            sub_body = sub_message.get_payload()
+            url = urlsplit(sub_uri)
+            params = {key: values[-1] for key, values in parse_qs(url.query).items()}
+            status, payload = self.handle(sub_method, url.path, params, json.loads(sub_body) if sub_body else {})
+            # the client matches responses back up to its requests by the Content-ID
+            content_id = part["Content-ID"].replace("<", "<response-", 1)
+            parts.append(
+                f"--{boundary}\r\nContent-Type: application/http\r\nContent-ID: {content_id}\r\n\r\n"
+                f"HTTP/1.1 {status} {reasons.get(status, '')}\r\nContent-Type: application/json; charset=UTF-8\r\n\r\n"
+                f"{json.dumps(payload)}\r\n"
+            )
+        content = "".join(parts) + f"--{boundary}--\r\n"
+        return f"multipart/mixed; boundary={boundary}", content.encode("utf-8")
+
+    def handle(self, method: str, path: str, params: dict, body: dict) -> tuple[int, dict]:
+        """
+        routes a request to the matching fake endpoint
+        :param method: the http method
+        :param path: the url path
+        :param params: the query parameters
+        :param body: the decoded json body
+        :return: a status code and json payload
+        """
+        with self.lock:
+            self.stats["calls"] += 1
+            injected = self.inject_error()
+        if injected:
+            return injected
+        parts = path.strip("/").split("/")
+        if parts[:3] == ["drive", "v3", "changes"]:
+            return self.list_changes(params) if len(parts) == 3 else self.get_start_page_token()
+        if parts[:2] != ["drive", "v3"] or len(parts) < 3 or parts[2] != "files":
+            return error(404, "notFound", f"fake drive has no endpoint for {method} {path}")
+        file_id = parts[3] if len(parts) > 3 else None
+        action = parts[4] if len(parts) > 4 else None
+
+        if method == "GET" and not file_id:
+            return self.list_files(params)
+        if method == "GET":
+            return self.get_file(file_id, params)
+        if method == "POST" and action == "copy":
+            return self.copy_file(file_id, params, body)
+        if method == "POST" and not file_id:
+            return self.create_file(params, body)
+        if method == "PATCH" and file_id:
+            return self.patch_file(file_id, params, body)
+        return error(404, "notFound", f"fake drive has no endpoint for {method} {path}")
+
+    def inject_error(self) -> tuple[int, dict] | None:
+        """
+        decides whether the current request should be throttled or fail (called with the lock held)
+        :return: an error response, or None to let the request through
+        """
+        if self.quota_per_second:
+            second, count = self.quota_window
+            now = int(time.monotonic())
+            count = count + 1 if now == second else 1
+            self.quota_window = (now, count)
+            if count > self.quota_per_second:
+                self.stats["errors"] += 1
+                return error(403, "userRateLimitExceeded", "User Rate Limit Exceeded.")
+        if self.error_rate and self.random.random() < self.error_rate:
+            self.stats["errors"] += 1
+            if self.random.random() < 0.5:
+                return error(429, "rateLimitExceeded", "Rate Limit Exceeded.")
+            return error(503, "backendError", "Backend Error.")
+        return None
+
+    def list_files(self, params: dict) -> tuple[int, dict]:
+        """
+        files().list -- paginated, with `pageToken` being the offset into the matching files
+        """
+        query = params.get("q", "")
+        page_size = min(int(params.get("pageSize", DEFAULT_PAGE_SIZE)), self.max_page_size)
+        offset = int(params.get("pageToken", 0))
+        order_by = params.get("orderBy", "")
+        with self.lock:
+            self.stats["list_pages"] += 1
+            # the query is only run again for the next page if something has changed since, like Drive's own cursors
+            version, matching = self.query_results.get((query, order_by), (None, None))
+            if version != len(self.change_log):
+                matching = self.run_query(query, order_by)
+                if len(self.query_results) >= 256:
+                    self.query_results.clear()
+                self.query_results[(query, order_by)] = (len(self.change_log), matching)
+        incomplete = self.incomplete_search_over is not None and len(matching) > self.incomplete_search_over
+        payload = {
+            "kind": "drive#fileList",
+            "incompleteSearch": incomplete,
+            "files": matching[offset:offset + page_size],
+        }
+        if offset + page_size < len(matching):
+            payload["nextPageToken"] = str(offset + page_size)
+        return 200, apply_fields(payload, parse_fields(params.get("fields", DEFAULT_LIST_FIELDS)))
+
+    def run_query(self, query: str, order_by: str = "") -> list:
+        """
+        everything a files list query matches, called with the lock held
+        :param query: the `q` parameter
+        :param order_by: the `orderBy` parameter -- only a single field is supported, ie `modifiedTime desc`
+        :return: the matching resources, in order
+        """
+        parent_ids = re.findall(r"'([^']*)' in parents", query)
+        if parent_ids:
+            # every parents query we send is an `or` of parents, so only those folders' children can match
+            candidate_ids = sorted({file_id for parent in parent_ids for file_id in self.by_parent.get(parent, [])})
+            candidates = [self.files[file_id] for file_id in candidate_ids]
+        else:
+            candidates = list(self.files.values())
+        matching = [resource for resource in candidates if not query or matches_query(resource, query)]
+        if order_by:
+            field, _, direction = order_by.partition(" ")
+            matching.sort(key=lambda resource: resource.get(field, ""), reverse=direction == "desc")
+        return matching
+
+    def get_file(self, file_id: str, params: dict) -> tuple[int, dict]:
+        """
+        files().get
+        """
+        with self.lock:
+            resource = self.files.get(file_id)
+        if resource is None:
+            return error(404, "notFound", f"File not found: {file_id}.")
+        return 200, apply_fields(resource, parse_fields(params.get("fields", DEFAULT_FILE_FIELDS)))
+
+    def copy_file(self, file_id: str, params: dict, body: dict) -> tuple[int, dict]:
+        """
+        files().copy
+        """
+        with self.lock:
+            source = self.files.get(file_id)
+        if source is None:
+            return error(404, "notFound", f"File not found: {file_id}.")
+        if source["mimeType"] == TYPE_FOLDER:
+            return error(403, "fileNotCopyable", "Folders cannot be copied.")
+        # a copy is a new file, so it gets a modified time of its own unless one is asked for
+        skipped = ("kind", "id", "name", "mimeType", "parents", "modifiedTime")
+        extra = {key: value for key, value in source.items() if key not in skipped}
+        extra.update({key: value for key, value in body.items() if key not in ("name", "parents")})
+        new_id = self.add_file(
+            body.get("name", f"Copy of {source['name']}"),
+            (body.get("parents") or [None])[0],
+            source["mimeType"],
+            **extra,
+        )
+        return self.get_file(new_id, params)
+
+    def create_file(self, params: dict, body: dict) -> tuple[int, dict]:
+        """
+        files().create (metadata only)
+        """
+        extra = {key: value for key, value in body.items() if key not in ("name", "parents", "mimeType")}
+        new_id = self.add_file(
+            body.get("name", "Untitled"),
+            (body.get("parents") or [None])[0],
+            body.get("mimeType", "application/octet-stream"),
+            **extra,
+        )
+        return self.get_file(new_id, params)
+
+
+    def patch_file(self, file_id: str, params: dict, body: dict) -> tuple[int, dict]:
+        """
+        files().update (metadata only)
+        """
+        if file_id not in self.files:
+            return error(404, "notFound", f"File not found: {file_id}.")
+        self.update_file(
+            file_id,
+            [parent for parent in params.get("addParents", "").split(",") if parent],
+            [parent for parent in params.get("removeParents", "").split(",") if parent],
+            **body,
+        )
+        return self.get_file(file_id, params)
+
+    def get_start_page_token(self) -> tuple[int, dict]:
+        """
+        changes().getStartPageToken
+        """
+        with self.lock:
+            return 200, {"kind": "drive#startPageToken", "startPageToken": str(len(self.change_log))}
+
+    def list_changes(self, params: dict) -> tuple[int, dict]:
+        """
+        changes().list -- every change from the page token onwards, with the file as it is now
+        """
+        offset = int(params["pageToken"])
+        page_size = min(int(params.get("pageSize", DEFAULT_PAGE_SIZE)), self.max_page_size)
+        with self.lock:
+            changed_ids = self.change_log[offset:offset + page_size]
+            changes = [
+                {"kind": "drive#change", "changeType": "file", "fileId": file_id, "removed": False,
+                 "file": self.files[file_id]}
+                for file_id in changed_ids
+            ]
+            payload = {"kind": "drive#changeList", "changes": changes}
+            if offset + page_size < len(self.change_log):
+                payload["nextPageToken"] = str(offset + page_size)
+            else:
+                payload["newStartPageToken"] = str(len(self.change_log))
+        return 200, apply_fields(payload, parse_fields(params.get("fields", "*")))
+
+
+class AsyncFakeDriveHttp:
+    """
+    the async transport interface AsyncGoogleDrive sends its requests through, answered by a FakeDriveHttp. latency is
+    waited out with asyncio.sleep, so requests on one event loop overlap like they would on the network
+    :param fake: the fake drive to answer requests from
+    """
+
+    def __init__(self, fake: FakeDriveHttp):
+        self.fake = fake
+
+    async def request(self, uri: str, method: str = "GET", body: bytes = None, headers: dict = None):
+        """
+        :return: the status, headers and content of the response
+        """
+        if self.fake.latency:
+            await asyncio.sleep(self.fake.latency)
+        status, content_type, content = self.fake.respond(uri, method, body, headers)
+        return status, {"content-type": content_type}, content
+
+    async def close(self) -> None:
+        """
+        there are no connections to close
+        """
+
+
+def error(status: int, reason: str, message: str) -> tuple[int, dict]:
+    """
+    a Drive style json error payload
+    :param status: the http status
+    :param reason: the error reason (ie notFound, rateLimitExceeded)
+    :param message: a human readable message
+    :return:
+    """
+    return status, {
+        "error": {
+            "code": status,
+            "message": message,
+            "errors": [{"domain": "usageLimits" if status in (403, 429) else "global", "reason": reason,
+                        "message": message}],
+        }
+    }
+
+
+def build_tree(fake: FakeDriveHttp, parent_id: str, depth: int, folders_per_folder: int, files_per_folder: int) -> None:
+    """
+    fills a fake drive with a regular synthetic tree under a folder
+    :param fake: the fake drive
+    :param parent_id: the folder to build under
+    :param depth: how many levels of folders to create below the parent
+    :param folders_per_folder: how many subfolders each folder gets
+    :param files_per_folder: how many files each folder gets
+    :return:
+    """
+    for index in range(files_per_folder):
+        fake.add_file(f"file {index}", parent_id, "application/vnd.google-apps.spreadsheet")
+    if depth == 0:
+        return
+    for index in range(folders_per_folder):
+        folder_id = fake.add_folder(f"folder {depth}-{index}", parent_id)
+        build_tree(fake, folder_id, depth - 1, folders_per_folder, files_per_folder)
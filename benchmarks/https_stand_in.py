@@ -0,0 +1,107 @@
+"""
+Serves the fake Drive backend over real HTTPS on localhost, for measuring what happens underneath googleapiclient
+(connections, TLS handshakes, keep-alive) that the in-process fake skips:
+
+    with HttpsStandIn(fake) as stand_in:
+        httplib2.Http(ca_certs=stand_in.certificate).request(f"{stand_in.url}/drive/v3/files/{file_id}")
+
+A self signed certificate for localhost is made with the `openssl` command line tool.
+"""
+import os
+import ssl
+import subprocess
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from benchmarks.fake_drive import FakeDriveHttp
+
+
+def self_signed_certificate(directory: str) -> tuple[str, str]:
+    """
+    :param directory: where to write the certificate and its key
+    :return: the certificate and key paths
+    """
+    certificate, key = os.path.join(directory, "cert.pem"), os.path.join(directory, "key.pem")
+    subprocess.run(
+        [
+            "openssl", "req", "-x509", "-newkey", "rsa:2048", "-nodes", "-days", "1", "-subj", "/CN=localhost",
+            "-addext", "subjectAltName=DNS:localhost", "-keyout", key, "-out", certificate,
+        ],
+        check=True,
+        capture_output=True,
+    )
+    return certificate, key
+
+
+class _Handler(BaseHTTPRequestHandler):
+    # HTTP/1.1 so connections are kept alive between requests
+    protocol_version = "HTTP/1.1"
+    # the headers and body are written separately, which Nagle's algorithm would hold up waiting on an ack
+    disable_nagle_algorithm = True
+
+    def setup(self):
+        super().setup()
+        stand_in = self.server.stand_in
+        with stand_in.lock:
+            stand_in.connections += 1
+        # TCP and then TLS each take a round trip before the first request can be sent
+        time.sleep(2 * stand_in.round_trip)
+
+    def forward(self):
+        stand_in = self.server.stand_in
+        length = int(self.headers.get("Content-Length", 0))
+        body = self.rfile.read(length) if length else None
+        time.sleep(stand_in.round_trip)
+        headers = {key.lower(): value for key, value in self.headers.items()}
+        response, content = stand_in.fake.request(
+            f"https://www.googleapis.com{self.path}", self.command, body=body, headers=headers
+        )
+        self.send_response(response.status)
+        self.send_header("Content-Type", response["content-type"])
+        self.send_header("Content-Length", str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    do_GET = do_POST = do_PATCH = forward
+
+    def log_message(self, format, *args):
+        pass
+
+
+class HttpsStandIn:
+    """
+    A threaded HTTPS server on localhost answering every request from a FakeDriveHttp
+    :param fake: the fake Drive backend to serve
+    :param round_trip: seconds of simulated network latency added to every request, and twice over to every new
+    connection for the TCP and TLS handshakes
+    """
+
+    def __init__(self, fake: FakeDriveHttp, round_trip: float = 0.0):
+        self.fake = fake
+        self.round_trip = round_trip
+        self.lock = threading.Lock()
+        # how many connections clients have opened
+        self.connections = 0
+        self._directory = tempfile.TemporaryDirectory()
+        self.certificate, key = self_signed_certificate(self._directory.name)
+        context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+        context.load_cert_chain(self.certificate, key)
+
+        self.server = ThreadingHTTPServer(("localhost", 0), _Handler)
+        self.server.daemon_threads = True
+        # handshakes happen on the connection's own thread rather than holding up accepting the next one
+        self.server.socket = context.wrap_socket(self.server.socket, server_side=True, do_handshake_on_connect=False)
+        self.server.stand_in = self
+        self.url = f"https://localhost:{self.server.server_address[1]}"
+        self._thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    def __enter__(self) -> "HttpsStandIn":
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.server.shutdown()
+        self.server.server_close()
+        self._directory.cleanup()
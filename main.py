@@ -4,6 +4,10 @@ import yaml
 
 import services.assessments as assessments
 import services.google_drive_helpers as google_drive_helpers
+import services.jobs as jobs
+import services.sharding as sharding
+
+logger = logging.getLogger(__name__)
 
 
 @click.command()
@@ -12,40 +16,131 @@ import services.google_drive_helpers as google_drive_helpers
 )
 @click.argument("file_id", type=str, default="")
 @click.argument("destination_file_id", type=str, default="")
-def main(assessment: str, file_id: None, destination_file_id: None) -> None:
+@click.option(
+    "--copy-engine",
+    type=click.Choice(["sequential", "batched", "parallel", "streaming", "async"]),
+    default=None,
+    help="how assessment three copies, overrides copy_engine in config.yaml",
+)
+@click.option(
+    "--copy-strategy",
+    type=click.Choice(["full", "shortcut", "hybrid"]),
+    default=None,
+    help="whether assessment three copies files, links them with shortcuts, or links only the large binary ones, "
+    "overrides copy_strategy in config.yaml",
+)
+@click.option(
+    "--resume",
+    is_flag=True,
+    default=False,
+    help="resume an interrupted assessment three copy from its journal instead of starting over",
+)
+@click.option(
+    "--incremental",
+    is_flag=True,
+    default=False,
+    help="only copy what changed in the source since the last assessment two/three run, using the changes api",
+)
+@click.option(
+    "--diff",
+    is_flag=True,
+    default=False,
+    help="only copy what is missing or changed in an existing destination, overrides diff_copy in config.yaml",
+)
+@click.option(
+    "--jobs",
+    "job_file",
+    type=click.Path(exists=True, dir_okay=False),
+    default=None,
+    help="copy every source -> destination pair in a yaml or csv job file on one shared worker pool, instead of "
+    "running the assessments",
+)
+@click.option(
+    "--shard-workers",
+    type=int,
+    default=None,
+    help="copy assessment three with this many worker processes, overrides shard_workers in config.yaml",
+)
+@click.option(
+    "--shard-worker",
+    "shard_worker_number",
+    type=int,
+    default=None,
+    help="join a sharded copy queued in shard_queue as this worker number (picking its credentials from "
+    "shard_credentials), instead of running the assessments",
+)
+def main(
+    assessment: str,
+    file_id: None,
+    destination_file_id: None,
+    copy_engine: str,
+    copy_strategy: str,
+    resume: bool,
+    incremental: bool,
+    diff: bool,
+    job_file: str,
+    shard_workers: int,
+    shard_worker_number: int,
+) -> None:
     # load config
     config = yaml.safe_load(open("config.yaml"))
+    if copy_engine:
+        config["copy_engine"] = copy_engine
+    if copy_strategy:
+        config["copy_strategy"] = copy_strategy
+    if diff:
+        config["diff_copy"] = True
+    if shard_workers is not None:
+        config["shard_workers"] = shard_workers
+    # an extra worker only copies shards, with its own credentials
+    if shard_worker_number is not None:
+        sharding.shard_process(config, shard_worker_number)
+        return
     # if not provided a source file ID from cli -- default to the one stored in the config
     if not file_id:
         file_id = config["parent_file_id"]
 
-    # get credentials and instantiate Google Drive connection and object
-    credentials = google_drive_helpers.get_credentials()
-    if not credentials:
+    # get credentials (kept fresh for the whole run) and instantiate Google Drive connection and object
+    credential_manager = google_drive_helpers.get_credential_manager(config)
+    if not credential_manager:
         return
-    google_drive = google_drive_helpers.GoogleDrive(credentials, config)
-
-    # run assessments
-    match assessment:
-        case "one":
-            assessments.assessment_one(google_drive, file_id)
-        case "two":
-            assessments.assessment_two(google_drive, file_id)
-        case "three":
-            if not destination_file_id:
-                assessments.assessment_three(google_drive, file_id)
-            else:
-                assessments.assessment_three(google_drive, file_id, destination_file_id)
-        case "all":
-            assessments.assessment_one(google_drive, file_id)
-            assessments.assessment_two(google_drive, file_id)
-            if not destination_file_id:
-                assessments.assessment_three(google_drive, file_id)
-            else:
-                assessments.assessment_three(google_drive, file_id, destination_file_id)
-
-    # close connection to Google Drive
-    google_drive.connection.close()
+    google_drive = google_drive_helpers.GoogleDrive(
+        credential_manager.credentials, config, credential_manager=credential_manager
+    )
+
+    # run every job in the job file, or the assessments
+    if job_file:
+        jobs.run_jobs(google_drive, jobs.load_jobs(job_file), resume=resume)
+    else:
+        match assessment:
+            case "one":
+                assessments.assessment_one(google_drive, file_id)
+            case "two":
+                assessments.assessment_two(google_drive, file_id)
+            case "three":
+                if not destination_file_id:
+                    assessments.assessment_three(
+                        google_drive, file_id, resume=resume, incremental=incremental
+                    )
+                else:
+                    assessments.assessment_three(
+                        google_drive, file_id, destination_file_id, resume=resume, incremental=incremental
+                    )
+            case "all":
+                assessments.assessment_one(google_drive, file_id)
+                assessments.assessment_two(google_drive, file_id)
+                if not destination_file_id:
+                    assessments.assessment_three(
+                        google_drive, file_id, resume=resume, incremental=incremental
+                    )
+                else:
+                    assessments.assessment_three(
+                        google_drive, file_id, destination_file_id, resume=resume, incremental=incremental
+                    )
+
+    logger.info(f"rate limiter stats: {google_drive.rate_limiter.stats()}")
+    # close connections to Google Drive
+    google_drive.close()
 
 
 if __name__ == "__main__":
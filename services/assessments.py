@@ -1,12 +1,32 @@
 import json
 import logging
-import os
 
+from services.copy_journal import CopyJournal
+from services.counting import FolderCounts, count_tree
+from services.diff_copy import prepare_diff_copy
 from services.google_drive_helpers import GoogleDrive
+from services.incremental_sync import sync_drive_data
+from services.sharding import copy_sharded
+from services.tree_store import TreeStore
 
 logger = logging.getLogger(__name__)
 
 
+def _report_metrics(google_drive: GoogleDrive, number: int) -> None:
+    """
+    logs what an assessment's requests cost and where it spent its time, writes it next to the assessment's report if
+    metrics_format is set, then starts afresh for the next assessment
+    :param google_drive: Google Drive resource
+    :param number: the assessment number
+    :return:
+    """
+    logger.info(f"assessment {number} metrics:\n{google_drive.metrics.summary()}")
+    if google_drive.metrics_format:
+        path = google_drive.metrics.write(f"reports/assessment_{number}_metrics", google_drive.metrics_format)
+        logger.info(f"wrote assessment {number} metrics to {path}")
+    google_drive.metrics.reset()
+
+
 def assessment_one(google_drive: GoogleDrive, file_id: str) -> None:
     """
     Assessment one: Write a script to generate a report that shows the number of files and folders in total at the root
@@ -15,22 +35,111 @@ def assessment_one(google_drive: GoogleDrive, file_id: str) -> None:
     :param google_drive: Google Drive resource
     :return:
     """
-    file_data = google_drive.get_files_and_folders(file_id)
+    if google_drive.count_engine == "counting":
+        counts = count_tree(google_drive, file_id, recursive=False) or FolderCounts(file_id)
+        num_folders, num_files = counts.folders[FolderCounts.ROOT], counts.files[FolderCounts.ROOT]
+    else:
+        file_data = google_drive.get_files_and_folders(file_id)
+        num_folders, num_files = len(file_data["folders"]), len(file_data["files"])
 
     report_data = {
-        "num_folders": len(file_data["folders"]),
-        "num_files": len(file_data["files"]),
-        "total_objects": file_data["local_object_count"],
+        "num_folders": num_folders,
+        "num_files": num_files,
+        "total_objects": num_folders + num_files,
     }
 
     print(f"number folders {report_data['num_folders']}")
     print(f"number files {report_data['num_files']}")
     print(
-        f"total objects in {file_data["folder_id"]}: {report_data['total_objects']}"
+        f"total objects in {file_id}: {report_data['total_objects']}"
     )
 
     with open("reports/assessment_1_report.json", "w", encoding="utf-8") as f:
         json.dump(report_data, f, ensure_ascii=False, indent=4)
+    _report_metrics(google_drive, 1)
+
+
+def _count_by_listing(google_drive: GoogleDrive, file_id: str) -> tuple[int, int, list]:
+    """
+    counts assessment two's nested objects from full listings of the source, storing them in the tree store as they
+    come in so assessment three can copy from them
+    :param google_drive: Google Drive resource
+    :param file_id: the source file id we're running against
+    :return: the total nested folders and files, and (name, nested object count) of every top level folder
+    """
+    # note where the changes api is at before we start walking, so a later incremental sync can't miss anything that
+    # changes while we walk
+    start_page_token = google_drive.get_start_page_token()
+    tree_store = TreeStore(google_drive.tree_store_path)
+    # the counts are added up as the listings come in rather than from a finished tree. everything is counted towards
+    # the top level folder it is under, which only needs remembering for the folders still waiting to be listed
+    total_folder_count, total_files = 0, 0
+    top_level, nested_counts, top_level_folders = [], {}, {}
+    for folder, listing in google_drive.iter_listings(file_id):
+        tree_store.write_listing(listing)
+        total_folder_count += len(listing["folders"])
+        total_files += len(listing["files"])
+        if folder is None:
+            top_level = listing["folders"]
+            for top_level_folder in top_level:
+                nested_counts[top_level_folder["folder_id"]] = 0
+                top_level_folders.setdefault(top_level_folder["folder_id"], []).append(top_level_folder["folder_id"])
+            continue
+        # with multi_parent_policy copy_per_parent, a folder with more than one parent is handed back once for each
+        waiting = top_level_folders[folder["folder_id"]]
+        top_level_folder_id = waiting.pop(0)
+        if not waiting:
+            del top_level_folders[folder["folder_id"]]
+        nested_counts[top_level_folder_id] += len(listing["folders"]) + len(listing["files"])
+        for child in listing["folders"]:
+            top_level_folders.setdefault(child["folder_id"], []).append(top_level_folder_id)
+    tree_store.finish_source(
+        file_id, start_page_token, google_drive.listing_fields, google_drive.multi_parent_policy
+    )
+    tree_store.close()
+    return total_folder_count, total_files, [
+        (folder["folder_name"], nested_counts[folder["folder_id"]]) for folder in top_level
+    ]
+
+
+def _count_by_counting(google_drive: GoogleDrive, file_id: str) -> tuple[int, int, list]:
+    """
+    counts assessment two's nested objects with the counting engine, which only lists ids, types and parents and never
+    builds the tree (nor stores it for assessment three)
+    :param google_drive: Google Drive resource
+    :param file_id: the source file id we're running against
+    :return: the total nested folders and files, and (name, nested object count) of every top level folder
+    """
+    counts = count_tree(google_drive, file_id)
+    if counts is None:
+        return 0, 0, []
+    nested_counts = counts.nested_counts()
+    total_folder_count, total_files = counts.totals()
+    return total_folder_count, total_files, [(name, nested_counts[row]) for name, row in counts.top_level]
+
+
+def _count_from_store(google_drive: GoogleDrive, file_id: str) -> tuple[int, int, list] | None:
+    """
+    counts assessment two's nested objects from the tree store, if it has a tree of the source that is no older than
+    tree_cache_max_age, without listing anything
+    :param google_drive: Google Drive resource
+    :param file_id: the source file id we're running against
+    :return: the total nested folders and files, and (name, nested object count) of every top level folder, or None if
+    there is no fresh enough tree
+    """
+    tree_store = TreeStore(google_drive.tree_store_path)
+    try:
+        # the report only needs names, so a tree listed with any extra fields will do
+        if not tree_store.get_source(file_id, google_drive.tree_cache_max_age, (), google_drive.multi_parent_policy):
+            return None
+        tree = tree_store.load_compact_tree(file_id)
+    finally:
+        tree_store.close()
+    logger.info(f"counting {file_id} from the tree store")
+    total_folder_count, total_files = tree.totals()
+    return total_folder_count, total_files, [
+        (tree.node_name(node), tree.nested_object_count[node]) for node in tree.children() if tree.is_folder[node]
+    ]
 
 
 def assessment_two(google_drive: GoogleDrive, file_id: str) -> None:
@@ -41,7 +150,12 @@ def assessment_two(google_drive: GoogleDrive, file_id: str) -> None:
     :param google_drive: Google Drive resource
     :return:
     """
-    drive_data, total_folder_count, total_files = google_drive.get_nested_objects(file_id)
+    if counts := _count_from_store(google_drive, file_id):
+        total_folder_count, total_files, top_level_counts = counts
+    elif google_drive.count_engine == "counting" and google_drive.multi_parent_policy == "copy_once":
+        total_folder_count, total_files, top_level_counts = _count_by_counting(google_drive, file_id)
+    else:
+        total_folder_count, total_files, top_level_counts = _count_by_listing(google_drive, file_id)
 
     report_data = {
         "total_nested_files": total_files,
@@ -54,43 +168,127 @@ def assessment_two(google_drive: GoogleDrive, file_id: str) -> None:
         f"total number of nested folders for source {file_id}: {total_folder_count}\n"
     )
 
-    for folder in drive_data["folders"]:
-        report_data["nested_object_counts_by_folder"][folder['folder_name']] = folder['nested_object_count']
+    for folder_name, nested_object_count in top_level_counts:
+        report_data["nested_object_counts_by_folder"][folder_name] = nested_object_count
         print(
-            f"total child nested count for top level folder {folder['folder_name']}: {folder['nested_object_count']}"
-        )
-
-    with open("drive_data.json", "w", encoding="utf-8") as f:
-        json.dump(
-            drive_data, f, ensure_ascii=False, indent=4
+            f"total child nested count for top level folder {folder_name}: {nested_object_count}"
         )
 
     with open("reports/assessment_2_report.json", "w", encoding="utf-8") as f:
         json.dump(
             report_data, f, ensure_ascii=False, indent=4
         )
+    _report_metrics(google_drive, 2)
 
 
-def assessment_three(google_drive: GoogleDrive, file_id: str, destination_file_id: str = None) -> None:
+def _source_data(
+    google_drive: GoogleDrive,
+    tree_store: TreeStore,
+    journal: CopyJournal,
+    file_id: str,
+    cached: dict | None,
+    incremental: bool,
+) -> dict:
+    """
+    gets the drive data for assessment three to copy, from the tree store or by walking the source
+    :param google_drive: Google Drive resource
+    :param tree_store: the tree store
+    :param journal: the copy journal
+    :param file_id: the source file id we're running against
+    :param cached: the tree store's record of the source, if it has an up to date one
+    :param incremental: bring the drive data up to date from the changes api, forgetting (and trashing) the earlier
+    copies of anything that changed
+    :return: the Google Drive data
+    """
+    if cached:
+        # the incremental sync edits the tree in place, so it needs it as plain drive data
+        source_data = tree_store.load_tree(file_id, compact=not incremental)
+    else:
+        start_page_token = google_drive.get_start_page_token()
+        source_data, _, _ = google_drive.get_nested_objects_concurrent(file_id, on_listing=tree_store.write_listing)
+        tree_store.finish_source(
+            file_id, start_page_token, google_drive.listing_fields, google_drive.multi_parent_policy
+        )
+        source_data["start_page_token"] = start_page_token
+
+    if incremental and "start_page_token" not in source_data:
+        logger.warning("cached drive data has no changes page token, copying anything not already copied instead")
+    elif incremental:
+        renamed = {}
+        changed_files = sync_drive_data(google_drive, source_data, renamed)
+        if changed_files is None:
+            logger.warning("incremental sync failed, copying anything not already copied instead")
+            return source_data
+        # the earlier copies of anything that changed get replaced rather than left next to the new copies
+        for destination_id in journal.forget(changed_files):
+            google_drive.trash_file(destination_id)
+        # and anything that was only renamed has its copies renamed to match
+        for source_id, name in renamed.items():
+            for destination_id in journal.copies(source_id):
+                google_drive.rename_file(destination_id, name)
+        tree_store.save_tree(source_data, google_drive.listing_fields, google_drive.multi_parent_policy)
+    return source_data
+
+
+def assessment_three(
+    google_drive: GoogleDrive,
+    file_id: str,
+    destination_file_id: str = None,
+    resume: bool = False,
+    incremental: bool = False,
+) -> None:
     """
     Write a script to copy the content (nested files/folders) of the source folder to the destination folder.
     :param google_drive: Google Drive resource
     :param file_id: the source file id we're running against
     :param destination_file_id: the destination file id we want to copy to(optional)
+    :param resume: pick up where an interrupted copy left off instead of starting a new one
+    :param incremental: bring the cached drive data up to date from the changes api and only copy what is new or
+    changed since the last copy
     :return:
     """
-    source_data = {}
-    pull_data = True
-    if os.path.exists("drive_data.json"):
-        with open("drive_data.json", "r") as f:
-            source_data = json.load(f)
-            if source_data["folder_id"] == file_id:
-                pull_data = False
+    # everything we copy is written to the journal as we go, so an interrupted copy can be resumed
+    journal = CopyJournal(google_drive.copy_journal_path)
+    if resume:
+        logger.info(f"resuming copy with {len(journal.entries)} items already copied")
+    elif not incremental:
+        journal.clear()
 
-    if pull_data:
-        source_data, _, _ = google_drive.get_nested_objects(file_id)
-
-    copy_source_id = google_drive.copy_nested_items(source_data, destination_file_id)
+    # the tree store keeps the source tree from assessment two (or an earlier copy). resuming and incremental syncs
+    # use it whatever its age, since they need the tree the earlier copy was working from
+    tree_store = TreeStore(google_drive.tree_store_path)
+    max_age = None if resume or incremental else google_drive.tree_cache_max_age
+    cached = tree_store.get_source(file_id, max_age, google_drive.listing_fields, google_drive.multi_parent_policy)
+    # a diff copy needs both trees in hand to compare them
+    diff_copy = google_drive.diff_copy and destination_file_id
+    google_drive.journal = journal
+    try:
+        streaming = google_drive.copy_engine == "streaming" and not google_drive.shard_workers
+        if not cached and not incremental and not diff_copy and streaming:
+            # nothing to copy from yet, so copy as we walk (and keep the tree for next time while we're at it)
+            start_page_token = google_drive.get_start_page_token()
+            copy_source_id = google_drive.copy_nested_items_streaming(
+                file_id, destination_file_id, on_listing=tree_store.write_listing
+            )
+            if copy_source_id:
+                tree_store.finish_source(
+                    file_id, start_page_token, google_drive.listing_fields, google_drive.multi_parent_policy
+                )
+        else:
+            source_data = _source_data(google_drive, tree_store, journal, file_id, cached, incremental)
+            if diff_copy:
+                prepare_diff_copy(google_drive, source_data, destination_file_id, journal)
+            if google_drive.shard_workers:
+                # worker processes copy the shards of the source into the destination we create here
+                copy_source_id = google_drive.copy_root(file_id, destination_file_id)
+                if copy_source_id:
+                    copy_sharded(google_drive, source_data, copy_source_id, resume=resume)
+            else:
+                copy_source_id = google_drive.copy_nested_items(source_data, destination_file_id)
+    finally:
+        google_drive.journal = None
+        journal.close()
+        tree_store.close()
 
     print(f"copy source folder id: {copy_source_id}")
 
@@ -102,4 +300,4 @@ def assessment_three(google_drive: GoogleDrive, file_id: str, destination_file_i
         json.dump(
             report_data, f, ensure_ascii=False, indent=4
         )
-
+    _report_metrics(google_drive, 3)
@@ -0,0 +1,524 @@
+"""
+an asyncio counterpart to GoogleDrive. requests go straight to the Drive REST API through an async transport (aiohttp,
+with one pool of keep-alive connections) instead of googleapiclient and httplib2, so a single event loop can keep
+hundreds of listing and copy requests in flight without a thread for each. how many are in flight at once is bounded
+by a semaphore (async_concurrency), and every request still goes through the shared rate limiter, retries and metrics
+"""
+import asyncio
+import json
+import logging
+import time
+from collections import deque
+from urllib.parse import urlencode
+
+import httplib2
+from googleapiclient.errors import HttpError
+
+from services.google_drive_helpers import (
+    FILE_METADATA_FIELDS,
+    TYPE_FOLDER,
+    TYPE_SHORTCUT,
+    add_to_listing,
+    count_nested_objects,
+    empty_listing,
+    links_file,
+    parents_query,
+)
+from services.metrics import Metrics, operation_name
+from services.partitions import parse_time, partition_query, split_partition, time_partitions
+from services.rate_limiter import RateLimiter, backoff_delay, is_retryable_response
+from services.request_options import request_options
+from services.traversal import VisitedIndex
+
+DRIVE_URL = "https://www.googleapis.com/drive/v3/"
+
+logger = logging.getLogger(__name__)
+
+
+class AiohttpTransport:
+    """
+    Sends requests with aiohttp, over a pool of up to `pool_size` keep-alive connections, authorized with (and
+    refreshing when needed) the given credentials. aiohttp is only imported when the first request is sent, so it is
+    only needed by the async client.
+    :param credentials: the token credentials for our api connection
+    :param pool_size: the most connections open at once
+    :param credential_manager: a CredentialManager to refresh the credentials through, shared with the sync client
+    (optional)
+    """
+
+    def __init__(self, credentials, pool_size: int = 100, credential_manager=None):
+        self.credentials = credentials
+        self.credential_manager = credential_manager
+        self.pool_size = pool_size
+        self.session = None
+        self._refresh_lock = asyncio.Lock()
+
+    async def request(self, uri: str, method: str = "GET", body: bytes = None, headers: dict = None):
+        """
+        :return: the status, headers (with lower case names) and content of the response
+        """
+        if self.session is None:
+            try:
+                import aiohttp
+            except ImportError as e:
+                raise ImportError("the async client needs aiohttp, install it with `pip install aiohttp`") from e
+            self.session = aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=self.pool_size))
+
+        headers = dict(headers or {})
+        async with self._refresh_lock:
+            # refreshing is a blocking request of its own, so it is done on a thread
+            if not self.credentials.valid and self.credential_manager is not None:
+                await asyncio.to_thread(self.credential_manager.refresh, self.credentials.token)
+            elif not self.credentials.valid:
+                from google.auth.transport.requests import Request
+
+                await asyncio.to_thread(self.credentials.refresh, Request())
+        self.credentials.apply(headers)
+        async with self.session.request(method, uri, data=body, headers=headers) as response:
+            content = await response.read()
+            return response.status, {name.lower(): value for name, value in response.headers.items()}, content
+
+    async def close(self) -> None:
+        """
+        closes every pooled connection
+        :return:
+        """
+        if self.session is not None:
+            await self.session.close()
+            self.session = None
+
+
+class AsyncGoogleDrive:
+    """
+    An asyncio version of GoogleDrive, with the same methods as coroutines
+    :param credentials: the token credentials for our api connection
+    :param config: the loaded config.yaml
+    :param transport: optional async transport to send requests through instead of aiohttp (ie a fake Drive backend),
+    with `async request(uri, method, body, headers) -> (status, headers, content)` and `async close()`
+    :param credential_manager: a CredentialManager to refresh the credentials through (optional)
+    """
+
+    def __init__(self, credentials, config: dict, transport=None, credential_manager=None):
+        self.credentials = credentials
+        self.config = config
+        self.type_folder = TYPE_FOLDER
+        self.copy_exact_filename = config["copy_exact_filename"]
+        self.multi_parent_policy = config.get("multi_parent_policy", "copy_once")
+        self.copy_strategy = config.get("copy_strategy", "full")
+        self.shortcut_min_size = config.get("shortcut_min_size", 100 * 1024 * 1024)
+        self.diff_copy = config.get("diff_copy", False)
+        self.listing_fields = list(FILE_METADATA_FIELDS) if self.diff_copy or self.copy_strategy == "hybrid" else []
+        self.skip_trashed = self.diff_copy
+        self.prefetch_pages = config.get("prefetch_pages", True)
+        self.partition_after_pages = config.get("partition_after_pages", 10)
+        self.listing_partitions = config.get("listing_partitions", 8)
+        # a CopyJournal to record (and skip) completed copies in
+        self.journal = None
+        # how many requests can be in flight at once, which is also how many connections the pool keeps open
+        self.concurrency = config.get("async_concurrency", 100)
+        self.semaphore = asyncio.Semaphore(self.concurrency)
+        self.rate_limiter = RateLimiter(config.get("rate_limit_qps", 20), config.get("rate_limit_max_qps", 200))
+        self.max_request_attempts = config.get("max_request_attempts", 6)
+        self.metrics = Metrics()
+        self.transport = transport or AiohttpTransport(credentials, self.concurrency, credential_manager)
+
+    async def close(self) -> None:
+        """
+        closes the transport, and with it every pooled connection
+        :return:
+        """
+        await self.transport.close()
+
+    async def request(self, method: str, path: str, params: dict = None, body: dict = None) -> dict:
+        """
+        sends a Drive request once the semaphore and the rate limiter let it through, retrying rate limited and server
+        side failures with backoff like ThrottledHttp
+        :param method: the http method
+        :param path: the path under the Drive v3 url, ie `files` or `files/<id>/copy`
+        :param params: the query parameters
+        :param body: the json body
+        :return: the decoded response
+        :raises HttpError: if the request failed, like googleapiclient requests do
+        """
+        uri = DRIVE_URL + path + (f"?{urlencode(params)}" if params else "")
+        data = json.dumps(body).encode("utf-8") if body is not None else None
+        headers = {"content-type": "application/json"} if data else {}
+        started = time.perf_counter()
+        async with self.semaphore:
+            for attempt in range(self.max_request_attempts):
+                wait = self.rate_limiter.reserve()
+                if wait:
+                    await asyncio.sleep(wait)
+                status, response_headers, content = await self.transport.request(uri, method, data, headers)
+                if not is_retryable_response(status, content):
+                    self.rate_limiter.on_success()
+                    break
+                if status in (403, 429):
+                    self.rate_limiter.on_throttle()
+                if attempt + 1 == self.max_request_attempts:
+                    self.rate_limiter.record("failures")
+                    logger.error(f"giving up on {method} {uri} after {self.max_request_attempts} attempts ({status})")
+                    break
+                self.rate_limiter.record("retries")
+                retry_after = response_headers.get("retry-after", "")
+                await asyncio.sleep(float(retry_after) if retry_after.isdigit() else backoff_delay(attempt))
+        self.metrics.record_request(
+            operation_name(method, uri),
+            time.perf_counter() - started,
+            status,
+            retries=attempt,
+            bytes_sent=len(data) if data else 0,
+            bytes_received=len(content) if content else 0,
+        )
+        if status >= 400:
+            raise HttpError(httplib2.Response({"status": status}), content, uri=uri)
+        return json.loads(content) if content else {}
+
+    async def iter_pages(self, params: dict):
+        """
+        lazily goes through the pages of a files list request, like google_drive_helpers.iter_pages, fetching the next
+        page as its own task while the current one is worked through when prefetch_pages is on. a page fetched ahead
+        for a caller that stops early is cancelled when the generator is closed
+        :param params: the files list query parameters
+        :return: an async generator of list files responses
+        """
+        response = await self.request("GET", "files", params)
+        while True:
+            page_token, upcoming = response.get("nextPageToken"), None
+            if page_token and self.prefetch_pages:
+                upcoming = asyncio.create_task(self.request("GET", "files", {**params, "pageToken": page_token}))
+            try:
+                yield response
+            except GeneratorExit:
+                if upcoming is not None:
+                    upcoming.cancel()
+                raise
+            if page_token is None:
+                return
+            response = await (upcoming or self.request("GET", "files", {**params, "pageToken": page_token}))
+
+    async def get_files_and_folders(self, folder_id) -> dict:
+        """
+        gets the files and folders given a folder ID. like GoogleDrive's, a folder that is still going after
+        partition_after_pages pages, or that Drive gives up listing (`incompleteSearch`), is listed in partitions
+        instead (see list_partitioned)
+        :param folder_id: the folder id to pull from
+        :return:
+        """
+        params = {"q": parents_query([folder_id], self.skip_trashed), **request_options("list", self.listing_fields)}
+        with self.metrics.span("listing"):
+            listing, pages = empty_listing(folder_id), 0
+            try:
+                pages_iterator = self.iter_pages(params)
+                # each page is sorted into folders and files as it comes in, then dropped
+                async for response in pages_iterator:
+                    for file_item in response["files"]:
+                        add_to_listing(listing, file_item)
+                    pages += 1
+                    if response.get("incompleteSearch") or "nextPageToken" not in response:
+                        break
+                    if self.partition_after_pages and pages >= self.partition_after_pages:
+                        break
+                await pages_iterator.aclose()
+                if response.get("incompleteSearch") or "nextPageToken" in response:
+                    reason = "was incomplete" if response.get("incompleteSearch") else f"has more than {pages} pages"
+                    logger.info(f"listing of folder {folder_id} {reason}, listing it in partitions")
+                    # whatever the pages we have got, the partitions cover everything
+                    listing = empty_listing(folder_id)
+                    for file_item in await self.list_partitioned(folder_id):
+                        add_to_listing(listing, file_item)
+            except HttpError as httpError:
+                logger.error(f"get files and folders failed with HttpError: {httpError}")
+                return None
+        return listing
+
+    async def list_pages(self, query: str, extra_fields: list = ()) -> tuple[list, bool]:
+        """
+        lists everything a query matches, page after page
+        :param query: the files list query
+        :param extra_fields: file resource fields to list on top of the defaults
+        :return: the file items, and whether Drive said any of the pages were incomplete
+        """
+        items, incomplete = [], False
+        async for response in self.iter_pages({"q": query, **request_options("list", list(extra_fields))}):
+            items += response["files"]
+            incomplete = incomplete or response.get("incompleteSearch", False)
+        return items, incomplete
+
+    async def modified_time_bounds(self, folder_id: str) -> tuple[float, float] | None:
+        """
+        :param folder_id: the folder id
+        :return: the oldest and newest modified times of the items in a folder, None if it is empty
+        """
+        bounds = []
+        for order in ("modifiedTime", "modifiedTime desc"):
+            params = {
+                "q": parents_query([folder_id], self.skip_trashed),
+                "orderBy": order,
+                "pageSize": 1,
+                "fields": "files(modifiedTime)",
+            }
+            response = await self.request("GET", "files", params)
+            if not response["files"]:
+                return None
+            bounds.append(parse_time(response["files"][0]["modifiedTime"]))
+        return bounds[0], bounds[1]
+
+    async def list_partitioned(self, folder_id: str) -> list:
+        """
+        lists a folder in partitions like GoogleDrive.list_partitioned, with every partition as its own task rather
+        than on a pool of threads
+        :param folder_id: the folder id to pull from
+        :return: the file items in the folder
+        """
+        bounds = await self.modified_time_bounds(folder_id)
+        if bounds is None:
+            return []
+        partitions = time_partitions(f"mimeType = '{self.type_folder}'", *bounds, 1) + time_partitions(
+            f"mimeType != '{self.type_folder}'", *bounds, self.listing_partitions
+        )
+        base_query = parents_query([folder_id], self.skip_trashed)
+        items = {}
+        in_flight = {
+            asyncio.create_task(self.list_pages(partition_query(base_query, partition), self.listing_fields)):
+            partition for partition in partitions
+        }
+        try:
+            while in_flight:
+                done, _ = await asyncio.wait(in_flight, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    partition = in_flight.pop(task)
+                    partition_items, incomplete = task.result()
+                    # an item modified while we're listing can turn up in two partitions
+                    items.update((item["id"], item) for item in partition_items)
+                    if not incomplete:
+                        continue
+                    halves = split_partition(partition, *bounds)
+                    if not halves:
+                        logger.error(f"folder {folder_id} is still incomplete after partitioning, items are missing")
+                    for half in halves:
+                        query = partition_query(base_query, half)
+                        in_flight[asyncio.create_task(self.list_pages(query, self.listing_fields))] = half
+        finally:
+            # a failed partition fails the whole listing, so the rest aren't left running
+            for task in in_flight:
+                task.cancel()
+        return list(items.values())
+
+    async def get_nested_objects(self, file_id) -> tuple[dict, int, int]:
+        """
+        walks the source tree, listing every folder as soon as it is found -- the semaphore, not a pool of threads,
+        bounds how many listings are in flight. anything found under more than one parent is handled by the
+        multi_parent_policy (see VisitedIndex)
+        :param file_id: the file id to pull from
+        :return: the Google Drive data tree, and its total nested folders and files, like GoogleDrive's
+        """
+        index = VisitedIndex(file_id, self.multi_parent_policy, self.metrics)
+        ready = deque(index.listed(None, (file_id, None), await self.get_files_and_folders(file_id)))
+        if not ready:
+            logger.error(f"could not list source folder {file_id}")
+            return {}, 0, 0
+
+        files_and_folders, total_nested_folders, total_nested_files = {}, 0, 0
+        listed_folders, in_flight = [], {}
+        while ready or in_flight:
+            while ready:
+                folder, node, child_objects = ready.popleft()
+                child_objects, to_list, listed = index.visit(node, child_objects)
+                if folder is None:
+                    files_and_folders = child_objects
+                else:
+                    folder["child_objects"] = child_objects
+                    listed_folders.append(folder)
+                total_nested_folders += len(child_objects["folders"])
+                total_nested_files += len(child_objects["files"])
+                for child, child_node in to_list:
+                    in_flight[asyncio.create_task(self.get_files_and_folders(child["folder_id"]))] = child, child_node
+                ready.extend(listed)
+            if not in_flight:
+                break
+
+            done, _ = await asyncio.wait(in_flight, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                child, child_node = in_flight.pop(task)
+                listing = task.result()
+                if not listing:
+                    logger.error(f"could not list folder {child['folder_id']}, skipping its nested objects")
+                ready.extend(index.listed(child, child_node, listing))
+
+        count_nested_objects(listed_folders)
+        return files_and_folders, total_nested_folders, total_nested_files
+
+    async def copy_file(self, file_id, file_name=None, destination_folder_id=None, modified_time=None) -> str:
+        """
+        Copies a file given an id
+        :param file_id: the file id to copy
+        :param file_name: name of the new file (optional, if not provided the name will be 'Copy "original file name"')
+        :param destination_folder_id: the parent id to copy the file to
+        :param modified_time: the source's modified time, to give the copy the same one
+        :return: the id of the new file
+        """
+        file_configuration = {}
+        if file_name:
+            file_configuration["name"] = file_name
+        if destination_folder_id:
+            file_configuration["parents"] = [destination_folder_id]
+        if modified_time:
+            file_configuration["modifiedTime"] = modified_time
+        with self.metrics.span("file_copy"):
+            try:
+                file = await self.request("POST", f"files/{file_id}/copy", request_options("copy"), file_configuration)
+                return file["id"]
+            except HttpError as httpError:
+                logger.error(f"copy file failed with HttpError: {httpError}")
+
+    async def create_shortcut(self, target_id: str, name: str, destination_folder_id: str) -> str:
+        """
+        Creates a shortcut to a file or folder
+        :param target_id: the id of the file or folder the shortcut points to
+        :param name: name of the shortcut
+        :param destination_folder_id: the folder to put the shortcut in
+        :return: the id of the new shortcut
+        """
+        shortcut_configuration = {
+            "name": name,
+            "mimeType": TYPE_SHORTCUT,
+            "parents": [destination_folder_id],
+            "shortcutDetails": {"targetId": target_id},
+        }
+        with self.metrics.span("file_copy"):
+            try:
+                shortcut = await self.request("POST", "files", request_options("create"), shortcut_configuration)
+                return shortcut["id"]
+            except HttpError as httpError:
+                logger.error(f"create shortcut failed with HttpError: {httpError}")
+
+    async def copy_file_object(self, file: dict, destination_folder_id: str) -> str:
+        """
+        Copies a file from the drive data, or creates a new shortcut to the same item when it is a shortcut or the
+        copy_strategy links it
+        :param file: the file object
+        :param destination_folder_id: the folder to copy it to
+        :return: the id of the new file
+        """
+        if links_file(file, self.copy_strategy, self.shortcut_min_size):
+            return await self.create_shortcut(file["file_id"], file["file_name"], destination_folder_id)
+        file_name = file["file_name"] if self.copy_exact_filename else None
+        return await self.copy_file(file["file_id"], file_name, destination_folder_id, file.get("modified_time"))
+
+    async def copy_folder(self, folder_name: str, destination_folder_id: str = None) -> str:
+        """
+        Creates a "copy" of a folder, a new folder with the existing name in a given destination
+        :param folder_name: name of the folder we're copying
+        :param destination_folder_id: the destination id for the copy of the folder
+        :return:
+        """
+        folder_configuration = {"name": folder_name, "mimeType": self.type_folder}
+        if destination_folder_id:
+            folder_configuration["parents"] = [destination_folder_id]
+        with self.metrics.span("folder_creation"):
+            try:
+                folder = await self.request("POST", "files", request_options("create"), folder_configuration)
+                return folder["id"]
+            except HttpError as httpError:
+                logger.error(f"create/copy folder failed with HttpError: {httpError}")
+
+    async def copy_root(self, source_id: str, destination_folder_id: str = None) -> str:
+        """
+        works out where a copy goes, like GoogleDrive.copy_root
+        :param source_id: the source folder id
+        :param destination_folder_id: where we're copying to, if not specified we create a place
+        :return: the destination folder id, or "" if there is nothing more to copy
+        """
+        if not destination_folder_id and self.journal:
+            destination_folder_id = self.journal.get(source_id)
+            if destination_folder_id:
+                logger.info(f"resuming copy of {source_id} into {destination_folder_id}")
+        if destination_folder_id:
+            return destination_folder_id
+
+        try:
+            source_file_info = await self.request("GET", f"files/{source_id}", request_options("get"))
+        except HttpError as err:
+            logger.error(f"get source file info failed with HttpError: {err}")
+            return ""
+        if source_file_info["mimeType"] != self.type_folder:
+            await self.copy_file(source_id, source_file_info["name"])
+            logger.warning("Source id of drive data is not folder type, copied file.")
+            return ""
+        destination_folder_id = await self.copy_folder(source_file_info["name"])
+        if self.journal and destination_folder_id:
+            self.journal.record(source_id, None, destination_folder_id, "root")
+        return destination_folder_id or ""
+
+    async def copy_nested_items(self, drive_data: dict, destination_folder_id: str = None) -> str:
+        """
+        create folders and copy files given the Google Drive data, every folder's contents starting as soon as the
+        folder exists, with as many requests in flight as the semaphore allows
+        :param drive_data: the Google Drive data we're copying
+        :param destination_folder_id: where we're copying to, if not specified we create a place
+        :return:
+        """
+        destination_folder_id = await self.copy_root(drive_data["folder_id"], destination_folder_id)
+        if not destination_folder_id:
+            return ""
+
+        # task -> (is folder, folder/file object, destination folder id)
+        in_flight = {}
+
+        def schedule(data, parent_id):
+            for folder in data["folders"]:
+                new_folder_id = self.journal.get(folder["folder_id"], parent_id) if self.journal else None
+                if new_folder_id:
+                    if folder["nested_object_count"] != 0:
+                        schedule(folder["child_objects"], new_folder_id)
+                    continue
+                in_flight[asyncio.create_task(self.copy_folder(folder["folder_name"], parent_id))] = (
+                    True, folder, parent_id
+                )
+            for file in data["files"]:
+                if self.journal and self.journal.get(file["file_id"], parent_id):
+                    continue
+                in_flight[asyncio.create_task(self.copy_file_object(file, parent_id))] = (False, file, parent_id)
+
+        schedule(drive_data, destination_folder_id)
+        while in_flight:
+            done, _ = await asyncio.wait(in_flight, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                is_folder, item, parent_id = in_flight.pop(task)
+                new_id = task.result()
+                if not is_folder:
+                    if new_id:
+                        logger.info(f"copied file {item['file_name']} to {parent_id}")
+                        if self.journal:
+                            self.journal.record(item["file_id"], parent_id, new_id, "file")
+                    continue
+                if not new_id:
+                    logger.error(f"could not copy folder {item['folder_name']}, skipping its nested objects")
+                    continue
+                logger.info(f"copied folder {item['folder_name']} to {parent_id} with new id {new_id}")
+                if self.journal:
+                    self.journal.record(item["folder_id"], parent_id, new_id, "folder")
+                if item["nested_object_count"] != 0:
+                    schedule(item["child_objects"], new_id)
+        return destination_folder_id
+
+
+async def copy_with_async_drive(google_drive, drive_data: dict, destination_folder_id: str = None) -> str:
+    """
+    the "async" copy engine -- copies the Google Drive data with an AsyncGoogleDrive on the running event loop, sharing
+    the GoogleDrive's credentials, rate limiter, metrics and journal
+    :param google_drive: the GoogleDrive the copy was asked of
+    :param drive_data: the Google Drive data we're copying
+    :param destination_folder_id: where we're copying to, if not specified we create a place
+    :return: the destination folder id
+    """
+    async_drive = AsyncGoogleDrive(
+        google_drive.credentials, google_drive.config, google_drive.async_transport, google_drive.credential_manager
+    )
+    async_drive.rate_limiter, async_drive.metrics = google_drive.rate_limiter, google_drive.metrics
+    async_drive.journal = google_drive.journal
+    try:
+        return await async_drive.copy_nested_items(drive_data, destination_folder_id)
+    finally:
+        await async_drive.close()
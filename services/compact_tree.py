@@ -0,0 +1,278 @@
+"""
+a memory compact version of the drive data tree. instead of a dict per folder/file (plus a dict and two lists per
+listing), every node is a row across a handful of flat arrays and every id and name is packed into one shared buffer,
+so a tree with millions of items fits in a fraction of the memory
+"""
+from array import array
+
+from services.google_drive_helpers import FILE_METADATA_FIELDS, GoogleDrive
+
+# the drive data file keys kept for each file (see FILE_METADATA_FIELDS), packed into one string along with whether it
+# is a shortcut
+FILE_METADATA_KEYS = tuple(FILE_METADATA_FIELDS.values())
+_SEPARATOR = "\x1f"
+
+
+def _pack_file(file: dict) -> str:
+    # nothing at all for a file without any metadata, which is most of them unless diff copies are on
+    values = [file.get(key) or "" for key in FILE_METADATA_KEYS] + ["1" if file.get("shortcut") else ""]
+    return _SEPARATOR.join(values) if any(values) else ""
+
+
+class _StringTable:
+    """
+    strings packed end to end into one utf-8 buffer, with the offset each one ends at -- a few bytes of overhead per
+    string rather than a whole python object
+    """
+
+    __slots__ = ("data", "offsets")
+
+    def __init__(self):
+        self.data = bytearray()
+        self.offsets = array("Q", [0])
+
+    def append(self, value: str) -> None:
+        self.data += value.encode()
+        self.offsets.append(len(self.data))
+
+    def __getitem__(self, index: int) -> str:
+        return self.data[self.offsets[index]:self.offsets[index + 1]].decode()
+
+
+class _CompactFolder(dict):
+    """
+    a drive data folder object whose `child_objects` are built from a compact tree every time they are used. they are
+    never kept, so a copy working through the tree only ever holds the folders it is still working on
+    """
+
+    def __init__(self, tree, node: int, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.tree = tree
+        self.node = node
+
+    def __missing__(self, key):
+        if key != "child_objects":
+            raise KeyError(key)
+        return self.tree.drive_data(self.node)
+
+
+class CompactTree:
+    """
+    A folder tree stored as flat arrays indexed by node number. Node 0 is the source folder, and a folder's children
+    are added together when its listing comes in, so they sit next to each other (from `first_child`, `child_count`
+    of them) and always after their parent. Nodes are read through the iterator methods and accessors, copied from
+    through drive_data, or the whole tree can be turned back into drive data with to_drive_data.
+    :param root_id: the source folder id
+    """
+
+    ROOT = 0
+
+    def __init__(self, root_id: str):
+        self.ids = _StringTable()
+        self.names = _StringTable()
+        # each file's metadata (see _pack_file), empty for folders
+        self.extras = _StringTable()
+        # 32 bits per node is plenty, with the source folder's parent being -1
+        self.parents = array("i")
+        self.is_folder = bytearray()
+        self.listed = bytearray()
+        self.first_child = array("I")
+        self.child_count = array("I")
+        self.nested_object_count = array("I")
+        # folder id -> the nodes for that folder that haven't been listed yet (more than one if it has several parents)
+        self.unlisted = {}
+        self._add(-1, root_id, "", True)
+
+    def _add(self, parent: int, node_id: str, name: str, is_folder: bool, extra: str = "") -> None:
+        node = len(self.parents)
+        self.ids.append(node_id)
+        self.names.append(name)
+        self.extras.append(extra)
+        self.parents.append(parent)
+        self.is_folder.append(is_folder)
+        self.listed.append(False)
+        self.first_child.append(0)
+        self.child_count.append(0)
+        self.nested_object_count.append(0)
+        if is_folder:
+            self.unlisted.setdefault(node_id, []).append(node)
+
+    def __len__(self) -> int:
+        return len(self.parents)
+
+    def add_listing(self, listing: dict) -> None:
+        """
+        adds a folder's contents to the tree -- meant to be handed to the traversal as it goes
+        :param listing: the files and folders data for a folder already in the tree, as get_files_and_folders returns it
+        :return:
+        """
+        nodes = self.unlisted.get(listing["folder_id"])
+        if not nodes:
+            raise KeyError(f"folder {listing['folder_id']} is not in the tree or has already been listed")
+        node = nodes.pop(0)
+        if not nodes:
+            del self.unlisted[listing["folder_id"]]
+
+        self.listed[node] = True
+        self.first_child[node] = len(self.parents)
+        self.child_count[node] = len(listing["folders"]) + len(listing["files"])
+        for folder in listing["folders"]:
+            self._add(node, folder["folder_id"], folder["folder_name"], True)
+        for file in listing["files"]:
+            self._add(node, file["file_id"], file["file_name"], False, _pack_file(file))
+
+    def compute_counts(self) -> None:
+        """
+        works out every folder's nested object count, once all of the listings are in
+        :return:
+        """
+        counts = self.nested_object_count
+        for node in range(len(counts)):
+            counts[node] = 0
+        # children always come after their parent, so walking backwards counts every child before its parent
+        for node in range(len(counts) - 1, self.ROOT, -1):
+            counts[self.parents[node]] += 1 + counts[node]
+
+    def totals(self) -> tuple[int, int]:
+        """
+        :return: the total nested folders and files, like get_nested_objects
+        """
+        total_folders = sum(self.is_folder) - 1
+        return total_folders, len(self) - 1 - total_folders
+
+    def node_id(self, node: int) -> str:
+        return self.ids[node]
+
+    def node_name(self, node: int) -> str:
+        return self.names[node]
+
+    def children(self, node: int = ROOT) -> range:
+        """
+        :param node: a folder node
+        :return: the folder's child nodes, folders first then files, in listing order
+        """
+        return range(self.first_child[node], self.first_child[node] + self.child_count[node])
+
+    def walk(self, node: int = ROOT):
+        """
+        every node under a folder, depth first with each folder before its contents
+        :param node: the folder node to start from
+        :return: an iterator of (parent node, node)
+        """
+        stack = [node]
+        while stack:
+            parent = stack.pop()
+            for child in self.children(parent):
+                yield parent, child
+                if self.is_folder[child]:
+                    stack.append(child)
+
+    def folder_counts(self):
+        """
+        :return: an iterator of (parent id, folder id, nested object count) for every folder under the source
+        """
+        for parent, node in self.walk():
+            if self.is_folder[node]:
+                yield self.ids[parent], self.ids[node], self.nested_object_count[node]
+
+    def to_drive_data(self, node: int = ROOT) -> dict:
+        """
+        converts (part of) the tree back into the drive data dict that get_nested_objects returns
+        :param node: the folder node to convert from
+        :return: the Google Drive data, or {} if the folder was never listed
+        """
+        if not self.listed[node]:
+            return {}
+        drive_data = self._listing(node)
+        stack = [(node, drive_data)]
+        while stack:
+            parent, listing = stack.pop()
+            for child in self.children(parent):
+                if not self.is_folder[child]:
+                    listing["files"].append(self._file(child))
+                    continue
+                folder = {
+                    "folder_id": self.ids[child],
+                    "folder_name": self.names[child],
+                    "child_objects": {},
+                    "nested_object_count": self.nested_object_count[child],
+                }
+                listing["folders"].append(folder)
+                if self.listed[child]:
+                    folder["child_objects"] = self._listing(child)
+                    stack.append((child, folder["child_objects"]))
+        return drive_data
+
+    def drive_data(self, node: int = ROOT) -> dict:
+        """
+        a folder's listing as drive data, for the copy engines to copy from like the dicts get_nested_objects returns.
+        its folders' contents are built from the tree when they are used rather than all at once (see _CompactFolder)
+        :param node: the folder node
+        :return: the files and folders data for the folder, or {} if it was never listed
+        """
+        if not self.listed[node]:
+            return {}
+        listing = self._listing(node)
+        for child in self.children(node):
+            if not self.is_folder[child]:
+                listing["files"].append(self._file(child))
+                continue
+            listing["folders"].append(
+                _CompactFolder(
+                    self,
+                    child,
+                    folder_id=self.ids[child],
+                    folder_name=self.names[child],
+                    nested_object_count=self.nested_object_count[child],
+                )
+            )
+        return listing
+
+    def _listing(self, node: int) -> dict:
+        return {"folder_id": self.ids[node], "folders": [], "files": [], "local_object_count": self.child_count[node]}
+
+    def _file(self, node: int) -> dict:
+        file = {"file_id": self.ids[node], "file_name": self.names[node]}
+        extra = self.extras[node]
+        if extra:
+            *metadata, shortcut = extra.split(_SEPARATOR)
+            file.update((key, value) for key, value in zip(FILE_METADATA_KEYS, metadata) if value)
+            if shortcut:
+                file["shortcut"] = True
+        return file
+
+    @classmethod
+    def from_drive_data(cls, drive_data: dict) -> "CompactTree":
+        """
+        converts drive data into a compact tree
+        :param drive_data: the Google Drive data
+        :return:
+        """
+        tree = cls(drive_data["folder_id"])
+        stack = [drive_data]
+        while stack:
+            listing = stack.pop()
+            tree.add_listing(listing)
+            stack.extend(folder["child_objects"] for folder in reversed(listing["folders"]) if folder["child_objects"])
+        tree.compute_counts()
+        return tree
+
+
+def walk_compact_tree(google_drive: GoogleDrive, file_id: str, on_listing=None) -> CompactTree:
+    """
+    walks the source tree straight into a compact tree, without ever holding the drive data dicts for all of it
+    :param google_drive: Google Drive resource
+    :param file_id: the file id to pull from
+    :param on_listing: also called with each folder's listing as it comes back (ie TreeStore.write_listing)
+    :return: the compact tree, with its counts worked out
+    """
+    tree = CompactTree(file_id)
+
+    def add_listing(listing: dict) -> None:
+        tree.add_listing(listing)
+        if on_listing:
+            on_listing(listing)
+
+    google_drive.get_nested_objects_concurrent(file_id, on_listing=add_listing, keep_tree=False)
+    tree.compute_counts()
+    return tree
@@ -0,0 +1,113 @@
+"""
+an on-disk journal of what a copy has done so far, so a copy that crashes or gets killed can be picked back up without
+duplicating anything that was already copied
+"""
+import sqlite3
+import threading
+
+
+class CopyJournal:
+    """
+    A SQLite journal of source id -> destination id for every folder created and file copied. Entries are keyed on the
+    source id and the destination folder it was copied into, so the same source item copied to two places is two
+    entries. The whole journal is also kept in memory so lookups during a copy don't touch the disk.
+    :param path: where the journal lives on disk
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        # WAL keeps each write cheap while still surviving the process being killed
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS copies ("
+            "source_id TEXT NOT NULL, destination_parent_id TEXT NOT NULL, destination_id TEXT NOT NULL, "
+            "kind TEXT NOT NULL, PRIMARY KEY (source_id, destination_parent_id))"
+        )
+        self.db.commit()
+        self.entries = {
+            (source_id, destination_parent_id): destination_id
+            for source_id, destination_parent_id, destination_id in self.db.execute(
+                "SELECT source_id, destination_parent_id, destination_id FROM copies"
+            )
+        }
+
+    def get(self, source_id: str, destination_parent_id: str = None) -> str | None:
+        """
+        looks up whether something has already been copied
+        :param source_id: the id of the source folder/file
+        :param destination_parent_id: the destination folder it was copied into (None for the copy's root folder)
+        :return: the id of the copy, or None if it hasn't been copied yet
+        """
+        return self.entries.get((source_id, destination_parent_id or ""))
+
+    def record(self, source_id: str, destination_parent_id: str, destination_id: str, kind: str) -> None:
+        """
+        writes down that something has been copied
+        :param source_id: the id of the source folder/file
+        :param destination_parent_id: the destination folder it was copied into (None for the copy's root folder)
+        :param destination_id: the id of the copy
+        :param kind: `root`, `folder` or `file`
+        :return:
+        """
+        key = (source_id, destination_parent_id or "")
+        with self.lock:
+            self.entries[key] = destination_id
+            self.db.execute("INSERT OR REPLACE INTO copies VALUES (?, ?, ?, ?)", (*key, destination_id, kind))
+            self.db.commit()
+
+    def record_many(self, entries: list) -> None:
+        """
+        record for lots of entries at once, in one transaction
+        :param entries: (source id, destination folder id, destination id, kind) for each entry
+        :return:
+        """
+        rows = [
+            (source_id, parent_id or "", destination_id, kind)
+            for source_id, parent_id, destination_id, kind in entries
+        ]
+        with self.lock:
+            self.entries.update(((row[0], row[1]), row[2]) for row in rows)
+            self.db.executemany("INSERT OR REPLACE INTO copies VALUES (?, ?, ?, ?)", rows)
+            self.db.commit()
+
+    def copies(self, source_id: str) -> list:
+        """
+        :param source_id: the id of the source folder/file
+        :return: the ids of every copy of it, wherever they were copied to
+        """
+        with self.lock:
+            return [value for key, value in self.entries.items() if key[0] == source_id]
+
+    def forget(self, source_ids: list) -> list:
+        """
+        drops entries so those items get copied again on the next run (ie because they changed)
+        :param source_ids: the source ids to forget about
+        :return: the destination ids of the copies we forgot about
+        """
+        source_ids = set(source_ids)
+        with self.lock:
+            forgotten = [value for key, value in self.entries.items() if key[0] in source_ids]
+            self.entries = {key: value for key, value in self.entries.items() if key[0] not in source_ids}
+            self.db.executemany("DELETE FROM copies WHERE source_id = ?", [(source_id,) for source_id in source_ids])
+            self.db.commit()
+        return forgotten
+
+    def clear(self) -> None:
+        """
+        empties the journal, for starting a brand new copy
+        :return:
+        """
+        with self.lock:
+            self.entries = {}
+            self.db.execute("DELETE FROM copies")
+            self.db.commit()
+
+    def close(self) -> None:
+        """
+        closes the journal database
+        :return:
+        """
+        self.db.close()
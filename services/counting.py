@@ -0,0 +1,194 @@
+"""
+a counting engine for the assessment one and two reports, which only need how many folders and files there are. the
+source is walked asking Drive for nothing but each item's id, mimeType and parents (to tell which folder of a batch it
+is in, and whether it might turn up again under another parent), and the counts go into a flat table with a row per
+folder -- its parent's row and how many folders and files are directly in it -- rather than a tree of dicts. nested
+counts are rolled up from the table in one backwards pass
+"""
+import logging
+from array import array
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from googleapiclient.errors import HttpError
+
+from services.google_drive_helpers import TYPE_FOLDER, GoogleDrive, iter_pages, parents_query, take_folder_batch
+from services.request_options import request_options
+
+logger = logging.getLogger(__name__)
+
+
+class FolderCounts:
+    """
+    A flat parent index of a source's folders. Row 0 is the source folder, and a folder's row always comes after its
+    parent's, so every folder's nested object count can be worked out in one pass from the last row back. Only the
+    names of the top level folders are kept, for the assessment two report. Anything found under more than one parent
+    is counted under the first one it is found in, like the copy_once multi_parent_policy, and folders found inside
+    themselves are never walked into.
+    :param root_id: the source folder id
+    :param metrics: where to count the cycles and items with more than one parent found
+    """
+
+    ROOT = 0
+
+    def __init__(self, root_id: str, metrics=None):
+        self.metrics = metrics
+        # folder id -> its row
+        self.rows = {root_id: self.ROOT}
+        # 32 bits per folder is plenty, with the source folder's parent being -1
+        self.parents = array("i", [-1])
+        self.folders = array("I", [0])
+        self.files = array("I", [0])
+        # (folder name, row) of the folders directly in the source, in the order Drive listed them
+        self.top_level = []
+        # ids of the files with more than one parent counted so far. every other file can only be found once
+        self.multi_parent_files = set()
+
+    def is_ancestor(self, row: int, of_row: int) -> bool:
+        """
+        :param row: a folder's row
+        :param of_row: another folder's row
+        :return: whether the first folder is the second one or one of its parents on the way to the source
+        """
+        while of_row != -1:
+            if of_row == row:
+                return True
+            of_row = self.parents[of_row]
+        return False
+
+    def add_listing(self, folder_id: str, items: list) -> list:
+        """
+        counts what is directly in a folder
+        :param folder_id: the folder id, already in the table
+        :param items: the file items from its listing, with their id, mimeType and parents
+        :return: the ids of the folders in it that haven't been found before, to be listed next
+        """
+        row, new_folders = self.rows[folder_id], []
+        for item in items:
+            if item["mimeType"] != TYPE_FOLDER:
+                if len(item.get("parents", ())) > 1:
+                    if item["id"] in self.multi_parent_files:
+                        self._count("multi_parent_files")
+                        continue
+                    self.multi_parent_files.add(item["id"])
+                self.files[row] += 1
+                continue
+
+            if item["id"] in self.rows:
+                if self.is_ancestor(self.rows[item["id"]], row):
+                    logger.warning(f"folder {item['id']} is inside itself (in folder {folder_id}), skipping it")
+                    self._count("cycles")
+                else:
+                    self._count("multi_parent_folders")
+                continue
+            self.rows[item["id"]] = len(self.parents)
+            if row == self.ROOT:
+                self.top_level.append((item.get("name", ""), len(self.parents)))
+            self.parents.append(row)
+            self.folders.append(0)
+            self.files.append(0)
+            self.folders[row] += 1
+            new_folders.append(item["id"])
+        return new_folders
+
+    def _count(self, name: str) -> None:
+        if self.metrics is not None:
+            self.metrics.count(name)
+
+    def nested_counts(self) -> array:
+        """
+        :return: every folder's nested object count, by row
+        """
+        nested = array("Q", (folders + files for folders, files in zip(self.folders, self.files)))
+        for row in range(len(self.parents) - 1, self.ROOT, -1):
+            nested[self.parents[row]] += nested[row]
+        return nested
+
+    def totals(self) -> tuple[int, int]:
+        """
+        :return: the total nested folders and files under the source, like get_nested_objects
+        """
+        return sum(self.folders), sum(self.files)
+
+
+def list_children(google_drive: GoogleDrive, folder_ids: list, extra_fields: list = ()) -> dict | None:
+    """
+    lists one or more folders, only asking for what counting needs
+    :param google_drive: Google Drive resource
+    :param folder_ids: the folder ids to list
+    :param extra_fields: file resource fields to list on top of the id, mimeType and parents (ie name)
+    :return: a dict of folder id -> the file items directly in it, or None if they couldn't be listed
+    """
+    with google_drive.metrics.span("listing"):
+        try:
+            request = google_drive.files.list(
+                q=parents_query(folder_ids, google_drive.skip_trashed), **request_options("count", list(extra_fields))
+            )
+            children, incomplete = {folder_id: [] for folder_id in folder_ids}, False
+            for response in iter_pages(google_drive.files, request, google_drive.prefetch_pages):
+                incomplete = incomplete or response["incompleteSearch"]
+                for item in response["files"]:
+                    for parent_id in item.get("parents", []):
+                        if parent_id in children:
+                            children[parent_id].append(item)
+        except HttpError as httpError:
+            if len(folder_ids) > 1 and httpError.resp.status in (400, 413, 414):
+                logger.warning(f"batched count of {len(folder_ids)} folders rejected, splitting the batch")
+                incomplete = True
+            else:
+                logger.error(f"count files and folders failed with HttpError: {httpError}")
+                return None
+
+    if incomplete and len(folder_ids) > 1:
+        # split the batch in half and try again, rather than losing the whole batch
+        half = len(folder_ids) // 2
+        first = list_children(google_drive, folder_ids[:half], extra_fields)
+        second = list_children(google_drive, folder_ids[half:], extra_fields)
+        return None if first is None or second is None else first | second
+    if incomplete:
+        logger.info(f"listing of folder {folder_ids[0]} was incomplete, listing it in partitions")
+        try:
+            # the parents are how anything in more than one folder is only counted once
+            return {folder_ids[0]: google_drive.list_partitioned(folder_ids[0], ["parents", *extra_fields])}
+        except HttpError as httpError:
+            logger.error(f"count files and folders failed with HttpError: {httpError}")
+            return None
+    return children
+
+
+def count_tree(google_drive: GoogleDrive, file_id: str, recursive: bool = True) -> FolderCounts | None:
+    """
+    counts everything under a source folder, breadth first on a pool of traversal_workers threads listing up to
+    listing_batch_size folders at a time
+    :param google_drive: Google Drive resource
+    :param file_id: the source folder id
+    :param recursive: count everything nested under the source, otherwise just what is directly in it
+    :return: the counts, or None if the source folder couldn't be listed
+    """
+    counts = FolderCounts(file_id, google_drive.metrics)
+    # the top level folders' names are the only ones the reports need
+    listing = list_children(google_drive, [file_id], ["name"])
+    if listing is None:
+        logger.error(f"could not count source folder {file_id}")
+        return None
+    pending = deque({"folder_id": folder_id} for folder_id in counts.add_listing(file_id, listing[file_id]))
+    if not recursive:
+        return counts
+
+    in_flight = {}
+    with ThreadPoolExecutor(max_workers=google_drive.traversal_workers) as executor:
+        while pending or in_flight:
+            while pending and len(in_flight) < google_drive.traversal_workers:
+                batch = [folder["folder_id"] for folder in take_folder_batch(pending, google_drive.listing_batch_size)]
+                in_flight[executor.submit(list_children, google_drive, batch)] = batch
+            done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in done:
+                batch = in_flight.pop(future)
+                children = future.result()
+                if children is None:
+                    logger.error(f"could not count folders {batch}, skipping their nested objects")
+                    continue
+                for folder_id in batch:
+                    new_folders = counts.add_listing(folder_id, children[folder_id])
+                    pending.extend({"folder_id": child_id} for child_id in new_folders)
+    return counts
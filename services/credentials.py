@@ -0,0 +1,209 @@
+"""
+keeps one Drive access token fresh for a whole run -- refreshed in the background shortly before it expires, shared by
+every thread, and handed between processes through the token file, so long copies never stall on an expired token
+"""
+import datetime
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import threading
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:
+    # no file locks on windows, so processes there may each refresh the token for themselves
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+# how long to wait before trying again after a background refresh failed
+RETRY_AFTER = 30
+
+
+def utcnow() -> datetime.datetime:
+    """
+    :return: the time now in UTC, without a timezone like the credentials' expiry
+    """
+    return datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None)
+
+
+def token_lock_path(token_path: str) -> str:
+    """
+    :param token_path: where the token is kept
+    :return: the lock file held while a token file is refreshed -- in the temp directory rather than next to the token,
+    so it doesn't litter the working directory, named after the token file's full path so every process using the same
+    token file finds the same lock
+    """
+    digest = hashlib.sha1(os.path.abspath(token_path).encode("utf-8")).hexdigest()[:16]
+    return os.path.join(tempfile.gettempdir(), f"drive-token-{digest}.lock")
+
+
+def write_token(credentials, token_path: str) -> None:
+    """
+    saves user credentials to their token file, atomically -- the new token is written next to it and then moved over
+    it, so another process reading the file never sees half a token
+    :param credentials: the user credentials
+    :param token_path: where the token is kept
+    :return:
+    """
+    directory = os.path.dirname(os.path.abspath(token_path))
+    with tempfile.NamedTemporaryFile("w", dir=directory, prefix=".token-", suffix=".json", delete=False) as token:
+        token.write(credentials.to_json())
+    os.replace(token.name, token_path)
+
+
+def read_token(token_path: str) -> tuple[str, datetime.datetime] | None:
+    """
+    :param token_path: where the token is kept
+    :return: the access token in a token file and when it expires, or None if there isn't one
+    """
+    try:
+        with open(token_path) as token:
+            stored = json.load(token)
+    except (OSError, ValueError):
+        return None
+    if not stored.get("token") or not stored.get("expiry"):
+        return None
+    return stored["token"], datetime.datetime.fromisoformat(stored["expiry"].rstrip("Z"))
+
+
+def get_service_account_credentials(key_path: str, scopes: list, subject: str = None):
+    """
+    loads service account credentials, for headless runs with nobody to sign in. they sign their own tokens, so there
+    is no token file to keep
+    :param key_path: the service account's json key file
+    :param scopes: the scopes to ask for
+    :param subject: the user to act as, with domain wide delegation (optional)
+    :return:
+    """
+    from google.oauth2 import service_account
+
+    credentials = service_account.Credentials.from_service_account_file(key_path, scopes=scopes)
+    return credentials.with_subject(subject) if subject else credentials
+
+
+class CredentialManager:
+    """
+    Owns the credentials for a run. A background thread refreshes the access token `refresh_margin` seconds before it
+    expires, and a refresh asked for by a request that found the token expired or rejected only happens once, however
+    many threads ask at the same time. With a token file, a refresh holds a lock on it: a process that finds another
+    one has already refreshed the token takes theirs rather than refreshing again, and the new token is written
+    atomically.
+    :param credentials: the user or service account credentials
+    :param token_path: the token file user credentials are kept in (None for service accounts, or to not keep them)
+    :param refresh_margin: how many seconds before the token expires to refresh it
+    """
+
+    def __init__(self, credentials, token_path: str = None, refresh_margin: float = 300):
+        self.credentials = credentials
+        self.token_path = token_path
+        self.refresh_margin = refresh_margin
+        self.counters = {"refreshes": 0, "adopted": 0, "failures": 0}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def expires_soon(self, margin: float = None) -> bool:
+        """
+        :param margin: how many seconds ahead to look, refresh_margin if not given
+        :return: whether the token is missing or expires within the margin
+        """
+        if not self.credentials.token:
+            return True
+        if self.credentials.expiry is None:
+            return False
+        margin = self.refresh_margin if margin is None else margin
+        return self.credentials.expiry - utcnow() <= datetime.timedelta(seconds=margin)
+
+    def refresh(self, stale_token: str = None) -> bool:
+        """
+        refreshes the token, unless another thread or process already has since it was found to be stale
+        :param stale_token: the access token that was found to be expired, rejected or about to expire
+        :return: whether the token was refreshed here
+        """
+        with self._lock:
+            if self.credentials.token != stale_token and not self.expires_soon(0):
+                # another thread got here first
+                return False
+            with self._token_file_lock():
+                if self._adopt_stored_token(stale_token):
+                    return False
+                # only needed once a token needs refreshing, and it pulls in requests
+                from google.auth.transport.requests import Request
+
+                logger.info("refreshing Drive credentials")
+                self.credentials.refresh(Request())
+                self.counters["refreshes"] += 1
+                if self.token_path:
+                    write_token(self.credentials, self.token_path)
+            return True
+
+    @contextmanager
+    def _token_file_lock(self):
+        # a lock file for the token (see token_lock_path), held while one process refreshes and writes it
+        if not self.token_path or fcntl is None:
+            yield
+            return
+        with open(token_lock_path(self.token_path), "a") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _adopt_stored_token(self, stale_token: str) -> bool:
+        # another process may have refreshed the token while we waited for the lock
+        stored = read_token(self.token_path) if self.token_path else None
+        if stored is None:
+            return False
+        token, expiry = stored
+        if token == stale_token or expiry - utcnow() <= datetime.timedelta(seconds=self.refresh_margin):
+            return False
+        self.credentials.token, self.credentials.expiry = token, expiry
+        self.counters["adopted"] += 1
+        return True
+
+    def start(self) -> None:
+        """
+        starts refreshing the token in the background, if it isn't already
+        :return:
+        """
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="credential-refresh", daemon=True)
+            self._thread.start()
+
+    def stop(self) -> None:
+        """
+        stops refreshing the token in the background
+        :return:
+        """
+        thread, self._thread = self._thread, None
+        if thread is not None:
+            self._stop.set()
+            thread.join()
+
+    def _run(self) -> None:
+        wait = 0
+        while not self._stop.wait(wait):
+            if self.expires_soon():
+                try:
+                    self.refresh(self.credentials.token)
+                except Exception as e:
+                    # requests will still refresh the token themselves if it does run out
+                    logger.warning(f"background refresh of Drive credentials failed: {e}")
+                    self.counters["failures"] += 1
+                    wait = RETRY_AFTER
+                    continue
+            if self.credentials.expiry is None:
+                # nothing to go on, so check back now and then
+                wait = self.refresh_margin
+                continue
+            remaining = (self.credentials.expiry - utcnow()).total_seconds()
+            # a token that doesn't last as long as the margin is refreshed half way through instead
+            wait = remaining - self.refresh_margin if remaining > self.refresh_margin else max(remaining / 2, 0.1)
@@ -0,0 +1,115 @@
+"""
+diff copies -- copying into a destination that already has an earlier copy in it. the destination tree is listed once
+and matched up with the source by relative path and name, and everything that is already there and unchanged goes in
+the copy journal, so the copy engines reuse the existing folders and only copy files that are missing or have changed
+"""
+import logging
+
+from services.copy_journal import CopyJournal
+from services.google_drive_helpers import GoogleDrive, links_file
+
+logger = logging.getLogger(__name__)
+
+
+def is_unchanged(source_file: dict, destination_file: dict, linked: bool = False) -> bool:
+    """
+    whether a file in the destination is an up to date copy of a source file
+    :param source_file: the source file object (listed with GoogleDrive.listing_fields)
+    :param destination_file: the destination file object with the same path
+    :param linked: whether the copy puts a shortcut to the source file in the destination rather than a copy
+    :return:
+    """
+    # a shortcut always points at the same source item
+    if linked or source_file.get("shortcut"):
+        return True
+    if source_file.get("size") != destination_file.get("size"):
+        return False
+    if source_file.get("md5_checksum") and destination_file.get("md5_checksum"):
+        return source_file["md5_checksum"] == destination_file["md5_checksum"]
+    # Google Docs and the like have no checksum, but we give copies the same modified time as their source
+    return bool(source_file.get("modified_time")) and source_file["modified_time"] == destination_file.get(
+        "modified_time"
+    )
+
+
+def match_destination(
+    source_data: dict,
+    destination_data: dict,
+    copy_exact_filename: bool = True,
+    copy_strategy: str = "full",
+    shortcut_min_size: int = 0,
+) -> tuple[list, list]:
+    """
+    pairs the source tree up with what is already in the destination, by relative path and name. items with the same
+    name in the same folder are paired in order
+    :param source_data: the Google Drive data being copied
+    :param destination_data: the Google Drive data of the destination folder
+    :param copy_exact_filename: whether copies keep their source's name, rather than getting `Copy of` in front
+    :param copy_strategy: which files are linked with shortcuts rather than copied (see GoogleDrive.copy_strategy)
+    :param shortcut_min_size: the size from which the hybrid copy strategy links files
+    :return: journal entries (source id, destination folder id, destination id, kind) for the folders to reuse and the
+    files that are already up to date, and the ids of destination files that are out of date
+    """
+    entries, outdated = [], []
+    stack = [(source_data, destination_data)]
+    while stack:
+        source, destination = stack.pop()
+        folders, files = {}, {}
+        for folder in destination["folders"]:
+            folders.setdefault(folder["folder_name"], []).append(folder)
+        for file in destination["files"]:
+            files.setdefault(file["file_name"], []).append(file)
+
+        for folder in source["folders"]:
+            matches = folders.get(folder["folder_name"])
+            if not matches:
+                continue
+            match = matches.pop(0)
+            entries.append((folder["folder_id"], destination["folder_id"], match["folder_id"], "folder"))
+            if folder["child_objects"] and match["child_objects"]:
+                stack.append((folder["child_objects"], match["child_objects"]))
+        for file in source["files"]:
+            linked = links_file(file, copy_strategy, shortcut_min_size)
+            # shortcuts are always named after what they point at
+            name = file["file_name"] if copy_exact_filename or linked else f"Copy of {file['file_name']}"
+            matches = files.get(name)
+            if not matches:
+                continue
+            match = matches.pop(0)
+            if is_unchanged(file, match, linked):
+                entries.append((file["file_id"], destination["folder_id"], match["file_id"], "file"))
+            else:
+                outdated.append(match["file_id"])
+    return entries, outdated
+
+
+def prepare_diff_copy(
+    google_drive: GoogleDrive, source_data: dict, destination_folder_id: str, journal: CopyJournal
+) -> None:
+    """
+    lists the destination and journals everything in it that the copy can skip, moving files that are out of date to
+    the trash so their new copies replace them
+    :param google_drive: Google Drive resource
+    :param source_data: the Google Drive data being copied
+    :param destination_folder_id: the existing destination folder
+    :param journal: the journal the copy will run with
+    :return:
+    """
+    destination_data, _, _ = google_drive.get_nested_objects_concurrent(destination_folder_id)
+    if not destination_data:
+        logger.error(f"could not list destination {destination_folder_id}, copying everything")
+        return
+    entries, outdated = match_destination(
+        source_data,
+        destination_data,
+        google_drive.copy_exact_filename,
+        google_drive.copy_strategy,
+        google_drive.shortcut_min_size,
+    )
+    journal.record_many(entries)
+    for file_id in outdated:
+        google_drive.trash_file(file_id)
+    logger.info(
+        f"diff copy: {sum(entry[3] == 'folder' for entry in entries)} folders to reuse, "
+        f"{sum(entry[3] == 'file' for entry in entries)} files up to date, {len(outdated)} files out of date"
+    )
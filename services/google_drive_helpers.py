@@ -1,41 +1,69 @@
+import asyncio
+import functools
+import itertools
 import logging
 import os.path
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from contextlib import contextmanager
 from json import JSONDecodeError
 
-from google.auth.transport.requests import Request
 from google.oauth2.credentials import Credentials
-from google_auth_oauthlib.flow import InstalledAppFlow
-from googleapiclient.discovery import build
 from googleapiclient.errors import HttpError
 
+from services.credentials import CredentialManager, get_service_account_credentials, write_token
+from services.http_pool import HttpPool
+from services.metrics import Metrics
+from services.partitions import parse_time, partition_query, split_partition, time_partitions
+from services.rate_limiter import RateLimiter, ThrottledHttp, backoff_delay, is_retryable_response
+from services.request_options import request_options
+from services.traversal import VisitedIndex
+
 SCOPES = ["https://www.googleapis.com/auth/drive"]
+TYPE_FOLDER = "application/vnd.google-apps.folder"
+TYPE_SHORTCUT = "application/vnd.google-apps.shortcut"
+# Drive does not document a limit for `q`, but very long queries get rejected (and the whole request has to fit in a
+# URL), so batched parents queries are kept under this many characters
+MAX_PARENTS_QUERY_LENGTH = 2000
+# the most sub-requests Drive accepts in one batch request
+BATCH_LIMIT = 100
+# file resource fields used to tell whether a file has changed -> the keys they are kept under in drive data
+FILE_METADATA_FIELDS = {"md5Checksum": "md5_checksum", "size": "size", "modifiedTime": "modified_time"}
 
 logger = logging.getLogger(__name__)
 
 
-def get_credentials() -> Credentials | None:
+def get_credentials(token_path: str = "token.json") -> Credentials | None:
     """
     credential helper for Google Drive -- this code was largely borrowed from the python quickstart
     from their documentation
+    :param token_path: where the token is kept, ie one per shard worker identity
     :return:
     """
     local_creds = None
-    if os.path.exists("token.json"):
+    if os.path.exists(token_path):
         try:
-            local_creds = Credentials.from_authorized_user_file("token.json", SCOPES)
+            local_creds = Credentials.from_authorized_user_file(token_path, SCOPES)
         except JSONDecodeError as e:
-            logger.error(f"Could not load token.json with JSONDecodeError: {e}")
+            logger.error(f"Could not load {token_path} with JSONDecodeError: {e}")
             return
         except Exception as e:
             # note: normally would try to be more specific than this
-            logger.error(f"Could not load token.json with unknown error: {e}")
+            logger.error(f"Could not load {token_path} with unknown error: {e}")
             return
 
     if not local_creds or not local_creds.valid:
+        # these pull in requests and oauthlib, so they're only imported when the token actually needs replacing
         if local_creds and local_creds.expired and local_creds.refresh_token:
+            from google.auth.transport.requests import Request
+
             local_creds.refresh(Request())
         else:
             if os.path.exists("credentials.json"):
+                from google_auth_oauthlib.flow import InstalledAppFlow
+
                 flow = InstalledAppFlow.from_client_secrets_file(
                     "credentials.json",
                     SCOPES,
@@ -48,89 +76,497 @@ def get_credentials() -> Credentials | None:
                 return
 
         # Save the token for the next run
-        with open("token.json", "w") as token:
-            token.write(local_creds.to_json())
+        write_token(local_creds, token_path)
     return local_creds
 
 
+def get_credential_manager(config: dict, token_path: str = "token.json") -> CredentialManager | None:
+    """
+    loads the credentials for a run -- a service account when config.yaml has a service_account_file, otherwise the
+    signed in user's token -- and wraps them in a CredentialManager to keep them fresh
+    :param config: the loaded config.yaml
+    :param token_path: where the user's token is kept, ie one per shard worker identity
+    :return: the credential manager, or None if there are no credentials to be had
+    """
+    refresh_margin = config.get("token_refresh_margin", 300)
+    if config.get("service_account_file"):
+        try:
+            credentials = get_service_account_credentials(
+                config["service_account_file"], SCOPES, config.get("service_account_subject")
+            )
+        except (OSError, ValueError) as e:
+            logger.error(f"Could not load service account {config['service_account_file']}: {e}")
+            return None
+        return CredentialManager(credentials, None, refresh_margin)
+    credentials = get_credentials(token_path)
+    if not credentials:
+        return None
+    return CredentialManager(credentials, token_path, refresh_margin)
+
+
+def parents_query(folder_ids: list, skip_trashed: bool = False) -> str:
+    """
+    builds a listing query for the direct children of one or more folders
+    :param folder_ids: the folder ids to list
+    :param skip_trashed: whether to leave out items in the trash
+    :return: a query like `'a' in parents or 'b' in parents`
+    """
+    query = " or ".join(f"'{folder_id}' in parents" for folder_id in folder_ids)
+    if skip_trashed:
+        query = f"({query}) and trashed = false"
+    return query
+
+
+def take_folder_batch(pending: deque, max_batch_size: int) -> list:
+    """
+    pops as many folders off the front of a work queue as will fit in one batched parents query
+    :param pending: the queue of folder objects waiting to be listed
+    :param max_batch_size: the most folders we want to list in one query
+    :return: the folder objects to list together, always at least one
+    """
+    batch = [pending.popleft()]
+    query_length = len(parents_query([batch[0]["folder_id"]]))
+    while pending and len(batch) < max_batch_size:
+        # every extra folder adds ` or '<id>' in parents` to the query
+        next_length = query_length + len(parents_query(["", pending[0]["folder_id"]]))
+        if next_length > MAX_PARENTS_QUERY_LENGTH:
+            break
+        batch.append(pending.popleft())
+        query_length = next_length
+    return batch
+
+
+def count_nested_objects(listed_folders: list) -> None:
+    """
+    works out the nested object count of every folder in a tree built by walking it
+    :param listed_folders: the folder objects with their `child_objects`, in the order they were listed (parents
+    always come before their children, so walking them backwards means a folder's children are always counted before
+    the folder itself)
+    :return:
+    """
+    for folder in reversed(listed_folders):
+        child_objects = folder["child_objects"]
+        folder["nested_object_count"] = (
+            len(child_objects["folders"])
+            + len(child_objects["files"])
+            + sum(child["nested_object_count"] for child in child_objects["folders"])
+        )
+
+
+def iter_pages(files, request, prefetch: bool = False):
+    """
+    lazily goes through the pages of a files list request, so a listing only ever holds the page it is on rather
+    than every response so far
+    :param files: the files resource the request was made from
+    :param request: the first list files request
+    :param prefetch: whether to fetch the next page on another thread while the caller is still working through the
+    current one (only started once a listing turns out to have more than one page)
+    :return: a generator of list files responses
+    """
+    response = request.execute()
+    if "nextPageToken" not in response or not prefetch:
+        yield response
+        while "nextPageToken" in response:
+            request = files.list_next(request, response)
+            response = request.execute()
+            yield response
+        return
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        while True:
+            upcoming = None
+            if "nextPageToken" in response:
+                request = files.list_next(request, response)
+                upcoming = executor.submit(request.execute)
+            yield response
+            if upcoming is None:
+                return
+            response = upcoming.result()
+
+
+def is_retryable(http_error: HttpError) -> bool:
+    """
+    whether a failed request is worth trying again (see is_retryable_response)
+    :param http_error: the error the request failed with
+    :return:
+    """
+    return is_retryable_response(http_error.resp.status, http_error.content)
+
+
+def span(name: str):
+    """
+    decorator timing every call of a GoogleDrive method as a span in its metrics
+    :param name: the span name, ie listing
+    :return:
+    """
+
+    def decorator(method):
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwargs):
+            with self.metrics.span(name):
+                return method(self, *args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def folder_object(file_item: dict) -> dict:
+    """
+    the drive data representation of a folder from a files list item
+    :param file_item: the item from a files list response
+    :return:
+    """
+    return {
+        "folder_id": file_item["id"],
+        "folder_name": file_item["name"],
+        "child_objects": {},
+        "nested_object_count": 0,
+    }
+
+
+def file_object(file_item: dict) -> dict:
+    """
+    the drive data representation of a (non folder) file from a files list item
+    :param file_item: the item from a files list response
+    :return:
+    """
+    file = {"file_id": file_item["id"], "file_name": file_item["name"]}
+    # only there when the listing asked for them (ie for diff copies)
+    for field, key in FILE_METADATA_FIELDS.items():
+        if field in file_item:
+            file[key] = file_item[field]
+    return file
+
+
+def links_file(file: dict, copy_strategy: str, shortcut_min_size: int) -> bool:
+    """
+    whether a file is copied as a shortcut to the source file rather than as a copy of it
+    :param file: the file object
+    :param copy_strategy: "full", "shortcut" or "hybrid" (see GoogleDrive.copy_strategy)
+    :param shortcut_min_size: the size in bytes from which the hybrid strategy links files
+    :return:
+    """
+    if file.get("shortcut") or copy_strategy == "shortcut":
+        return True
+    # Google Docs and the like have no checksum, as there is no blob behind them, so the hybrid strategy always copies
+    # them -- it only links large binary files
+    if copy_strategy != "hybrid" or not file.get("md5_checksum"):
+        return False
+    return int(file.get("size", 0)) >= shortcut_min_size
+
+
+def empty_listing(folder_id: str) -> dict:
+    """
+    :param folder_id: the folder id
+    :return: the files and folders data for a folder with nothing in it (yet)
+    """
+    return {"folder_id": folder_id, "folders": [], "files": [], "local_object_count": 0}
+
+
+def add_to_listing(listing: dict, file_item: dict) -> None:
+    """
+    adds a files list item to a folder's files and folders data, as a folder or a file
+    :param listing: the folder's files and folders data
+    :param file_item: the item from a files list response
+    :return:
+    """
+    # Note: an item with more than one parent can put a folder inside one of its own subfolders, so the walks keep a
+    # VisitedIndex to stop them going round in circles
+    if file_item["mimeType"] == TYPE_FOLDER:
+        listing["folders"].append(folder_object(file_item))
+    else:
+        listing["files"].append(file_object(file_item))
+    listing["local_object_count"] += 1
+
+
 class GoogleDrive:
     """
     A class used to represent our Google Drive API connection
     :param credentials: the token credentials for our api connection
+    :param config: the loaded config.yaml
+    :param http: optional http object to talk to Drive through instead of building one from the credentials
+    :param async_transport: optional async transport for the "async" copy engine to talk to Drive through instead of
+    aiohttp (see AsyncGoogleDrive)
+    :param credential_manager: the CredentialManager keeping the credentials fresh (see get_credential_manager), one
+    without a token file is made for the credentials if not provided
     """
 
-    def __init__(self, credentials: Credentials, config: dict):
-        self.connection = build("drive", "v3", credentials=credentials)
-        self.type_folder = "application/vnd.google-apps.folder"
+    def __init__(
+        self, credentials: Credentials, config: dict, http=None, async_transport=None, credential_manager=None
+    ):
+        self.credentials = credentials
+        if credential_manager is None and credentials is not None:
+            credential_manager = CredentialManager(credentials, None, config.get("token_refresh_margin", 300))
+        self.credential_manager = credential_manager
+        # kept to hand on to the worker processes of a sharded copy
+        self.config = config
+        # an already authorized http object (ie a fake Drive backend) to build connections with instead of credentials
+        self.http = http
+        self.async_transport = async_transport
+        self.type_folder = TYPE_FOLDER
         self.copy_exact_filename = config["copy_exact_filename"]
+        # "full" copies every file, "shortcut" recreates the folders but puts a shortcut to the source in place of every
+        # file, and "hybrid" only does that for binary files of at least shortcut_min_size bytes
+        self.copy_strategy = config.get("copy_strategy", "full")
+        self.shortcut_min_size = config.get("shortcut_min_size", 100 * 1024 * 1024)
+        self.traversal_workers = config.get("traversal_workers", 8)
+        self.listing_batch_size = config.get("listing_batch_size", 1)
+        # folders still going after this many pages (0 for never), and folders Drive gives up listing, are listed in
+        # this many partitions at once instead
+        self.partition_after_pages = config.get("partition_after_pages", 10)
+        self.listing_partitions = config.get("listing_partitions", 8)
+        # fetch a folder's next page of items while the current one is being worked through
+        self.prefetch_pages = config.get("prefetch_pages", True)
+        # how assessments one and two count: "listing" (full listings, kept in the tree store for assessment three) or
+        # "counting" (ids, types and parents only, see services.counting)
+        self.count_engine = config.get("count_engine", "listing")
+        # what to do with folders and files that are in more than one folder, see VisitedIndex
+        self.multi_parent_policy = config.get("multi_parent_policy", "copy_once")
+        self.copy_engine = config.get("copy_engine", "sequential")
+        self.copy_workers = config.get("copy_workers", 8)
+        # how many jobs from a job file are copied at the same time, all sharing this one connection and rate limiter
+        self.job_workers = config.get("job_workers", 4)
+        # assessment three copies with this many worker processes when it is more than 0, see services.sharding
+        self.shard_workers = config.get("shard_workers", 0)
+        self.shard_queue_path = config.get("shard_queue", "shard_queue.sqlite")
+        self.copy_journal_path = config.get("copy_journal", "copy_journal.sqlite")
+        self.tree_store_path = config.get("tree_store", "drive_data.sqlite")
+        self.tree_cache_max_age = config.get("tree_cache_max_age", 86400)
+        # copy into an existing destination by only copying what is missing or changed there, which needs the files'
+        # checksums, sizes and modified times listing too (as does the hybrid copy strategy)
+        self.diff_copy = config.get("diff_copy", False)
+        self.listing_fields = list(FILE_METADATA_FIELDS) if self.diff_copy or self.copy_strategy == "hybrid" else []
+        # a diff copy trashes the out of date copies it replaces, so they mustn't be matched again next time
+        self.skip_trashed = self.diff_copy
+        # a CopyJournal to record (and skip) completed copies in, set while assessment three is copying
+        self.journal = None
+        # a thread pool for the parallel and streaming copy engines to share, set while a job file is copying so that
+        # however many jobs are going there are only ever copy_workers copies in flight
+        self.copy_executor = None
+        self.batch_attempts = config.get("batch_attempts", 5)
+        # every request from every thread goes through the same rate limiter
+        self.rate_limiter = RateLimiter(config.get("rate_limit_qps", 20), config.get("rate_limit_max_qps", 200))
+        self.max_request_attempts = config.get("max_request_attempts", 6)
+        # every request's latency, bytes, retries and status, and spans of time spent on each phase of work
+        self.metrics = Metrics()
+        # also write the metrics next to the reports at the end of each assessment, as "json" or "prometheus" text
+        self.metrics_format = config.get("metrics_format")
+        # every thread shares one connection, which borrows a keep-alive http connection from a pool per request
+        self.connection_pool_size = config.get("connection_pool_size", 16)
+        self._connection = None
+        self._files = None
+        self._connection_lock = threading.Lock()
 
-    def pagination_helper(self, last_request, last_response) -> dict:
+    @property
+    def connection(self):
         """
-        a pagination helper for listing files
-        :param last_request: the last list files request
-        :param last_response: the last list files response
-        :return: a response object with the full list of file items
+        the Drive API connection, built the first time any thread asks for it. httplib2 connections are not thread
+        safe, so requests are sent through an HttpPool (unless we were given an http object to use)
+        :return: a Drive v3 resource
         """
-        response = {x: last_response[x] for x in last_response if x != "nextPageToken"}
-        while True:
-            new_request = self.connection.files().list_next(last_request, last_response)
-            # from documentation - new request will be `None` if there is not another page of results
-            if not new_request:
-                break
-            new_response = new_request.execute()
-            response["files"] += new_response["files"]
-            last_response = new_response
-            last_request = new_request
-        return response
+        if self._connection is None:
+            # googleapiclient.discovery is the bulk of our import time, so it waits until a command needs Drive
+            from googleapiclient.discovery import build
+
+            with self._connection_lock:
+                if self._connection is None:
+                    http = self.http
+                    if http is None:
+                        http = HttpPool(
+                            self.credentials, self.connection_pool_size, credential_manager=self.credential_manager
+                        )
+                        # keep the token fresh for as long as the connection is open
+                        if self.credential_manager is not None:
+                            self.credential_manager.start()
+                    # the discovery document bundled with googleapiclient, rather than fetching it every run
+                    self._connection = build(
+                        "drive",
+                        "v3",
+                        http=ThrottledHttp(http, self.rate_limiter, self.max_request_attempts, self.metrics),
+                        static_discovery=True,
+                    )
+        return self._connection
+
+    @property
+    def files(self):
+        """
+        the connection's files resource -- googleapiclient builds a new one every time `files()` is called, so it is
+        kept rather than rebuilt for every request
+        :return:
+        """
+        if self._files is None:
+            self._files = self.connection.files()
+        return self._files
 
+    def close(self) -> None:
+        """
+        closes the connection, and with it every pooled http connection
+        :return:
+        """
+        with self._connection_lock:
+            if self._connection is not None:
+                self._connection.close()
+            self._connection = self._files = None
+        if self.credential_manager is not None:
+            self.credential_manager.stop()
+
+    @span("listing")
     def get_files_and_folders(self, folder_id) -> dict:
         """
-        gets the files and folders given a folder ID
+        gets the files and folders given a folder ID. a folder that is still going after partition_after_pages pages,
+        or that Drive gives up listing (`incompleteSearch`), is listed in partitions instead (see list_partitioned)
         :param folder_id: the folder id to pull from
         :return:
         """
         try:
-            request = self.connection.files().list(q=f"'{folder_id}' in parents")
-            response = request.execute()
-            if response["incompleteSearch"]:
-                # ToDo investigate a better response if incomplete search is True rather than total failure
-                logger.error(f"Unable to get full data: {response}")
-                return {}
-            if "nextPageToken" in response.keys():
-                # if there is a nextPageToken we need to handle pagination for the folder
-                response = self.pagination_helper(request, response)
-            all_items = response["files"]
-            folders, other_files = [], []
-            for file_item in all_items:
-                # Note: do we need to consider weird behavior here? Like is it possible you could put the parent
-                # folder in one of the child folders and create some infinite self-referencing loop?
-                if file_item["mimeType"] == self.type_folder:
-                    folders.append(
-                        {
-                            "folder_id": file_item["id"],
-                            "folder_name": file_item["name"],
-                            "child_objects": {},
-                            "nested_object_count": 0,
-                        }
-                    )
-                else:
-                    other_files.append(
-                        {"file_id": file_item["id"], "file_name": file_item["name"]}
-                    )
-            return {
-                "folder_id": folder_id,
-                "folders": folders,
-                "files": other_files,
-                "local_object_count": len(all_items),
-            }
+            request = self.files.list(
+                q=parents_query([folder_id], self.skip_trashed), **request_options("list", self.listing_fields)
+            )
+            listing, pages = empty_listing(folder_id), 0
+            for response in iter_pages(self.files, request, self.prefetch_pages):
+                # each page is sorted into folders and files as it comes in, then dropped
+                for file_item in response["files"]:
+                    add_to_listing(listing, file_item)
+                pages += 1
+                if response["incompleteSearch"] or "nextPageToken" not in response:
+                    break
+                if self.partition_after_pages and pages >= self.partition_after_pages:
+                    break
+            if response["incompleteSearch"] or "nextPageToken" in response:
+                reason = "was incomplete" if response["incompleteSearch"] else f"has more than {pages} pages"
+                logger.info(f"listing of folder {folder_id} {reason}, listing it in partitions")
+                # whatever the pages we have got, the partitions cover everything
+                listing = empty_listing(folder_id)
+                for file_item in self.list_partitioned(folder_id):
+                    add_to_listing(listing, file_item)
+            return listing
         except HttpError as httpError:
             logger.error(f"get files and folders failed with HttpError: {httpError}")
 
-    def get_nested_objects(self, file_id) -> tuple[dict, int, int]:
+    def list_pages(self, query: str, extra_fields: list = ()) -> tuple[list, bool]:
         """
+        lists everything a query matches, page after page
+        :param query: the files list query
+        :param extra_fields: file resource fields to list on top of the defaults
+        :return: the file items, and whether Drive said any of the pages were incomplete
+        """
+        request = self.files.list(q=query, **request_options("list", list(extra_fields)))
+        items, incomplete = [], False
+        for response in iter_pages(self.files, request, self.prefetch_pages):
+            items += response["files"]
+            incomplete = incomplete or response["incompleteSearch"]
+        return items, incomplete
 
+    def modified_time_bounds(self, folder_id: str) -> tuple[float, float] | None:
+        """
+        :param folder_id: the folder id
+        :return: the oldest and newest modified times of the items in a folder, None if it is empty
+        """
+        bounds = []
+        for order in ("modifiedTime", "modifiedTime desc"):
+            response = self.files.list(
+                q=parents_query([folder_id], self.skip_trashed),
+                orderBy=order,
+                pageSize=1,
+                fields="files(modifiedTime)",
+            ).execute()
+            if not response["files"]:
+                return None
+            bounds.append(parse_time(response["files"][0]["modifiedTime"]))
+        return bounds[0], bounds[1]
+
+    def list_partitioned(self, folder_id: str, extra_fields: list = None) -> list:
+        """
+        lists a folder as separate queries for its folders and for its other files modified in each of
+        listing_partitions ranges of time, all at the same time on a pool of threads. a partition that Drive doesn't
+        finish listing either is split in half and listed again, until it can't be split any more
+        :param folder_id: the folder id to pull from
+        :param extra_fields: file resource fields to list on top of the defaults, listing_fields if not given
+        :return: the file items in the folder
+        """
+        extra_fields = self.listing_fields if extra_fields is None else extra_fields
+        bounds = self.modified_time_bounds(folder_id)
+        if bounds is None:
+            return []
+        partitions = time_partitions(f"mimeType = '{self.type_folder}'", *bounds, 1) + time_partitions(
+            f"mimeType != '{self.type_folder}'", *bounds, self.listing_partitions
+        )
+        base_query = parents_query([folder_id], self.skip_trashed)
+        items = {}
+        with ThreadPoolExecutor(max_workers=self.listing_partitions) as executor:
+            in_flight = {
+                executor.submit(self.list_pages, partition_query(base_query, partition), extra_fields): partition
+                for partition in partitions
+            }
+            while in_flight:
+                done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in done:
+                    partition = in_flight.pop(future)
+                    partition_items, incomplete = future.result()
+                    # an item modified while we're listing can turn up in two partitions
+                    items.update((item["id"], item) for item in partition_items)
+                    if not incomplete:
+                        continue
+                    halves = split_partition(partition, *bounds)
+                    if not halves:
+                        logger.error(f"folder {folder_id} is still incomplete after partitioning, items are missing")
+                    for half in halves:
+                        query = partition_query(base_query, half)
+                        in_flight[executor.submit(self.list_pages, query, extra_fields)] = half
+        return list(items.values())
+
+    @span("listing")
+    def get_files_and_folders_batched(self, folder_ids: list) -> dict:
+        """
+        lists several folders with one `'a' in parents or 'b' in parents ...` query and splits the items back out by
+        parent, so lots of small folders don't each cost a full round trip
+        :param folder_ids: the folder ids to pull from
+        :return: a dict of folder id -> the same files and folders data get_files_and_folders gives for that folder
+        """
+        try:
+            request = self.files.list(
+                q=parents_query(folder_ids, self.skip_trashed),
+                **request_options("list", ["parents", *self.listing_fields]),
+            )
+            pages = iter_pages(self.files, request, self.prefetch_pages)
+            response = next(pages)
+        except HttpError as httpError:
+            if len(folder_ids) > 1 and httpError.resp.status in (400, 413, 414):
+                # Drive thought the query was too long or too complex -- split the batch in half and try again
+                logger.warning(f"batched listing of {len(folder_ids)} folders rejected, splitting the batch")
+                half = len(folder_ids) // 2
+                return self.get_files_and_folders_batched(
+                    folder_ids[:half]
+                ) | self.get_files_and_folders_batched(folder_ids[half:])
+            logger.error(f"get batched files and folders failed with HttpError: {httpError}")
+            return {}
+
+        if response["incompleteSearch"]:
+            # fall back to listing the folders one at a time rather than losing the whole batch
+            logger.warning(f"incomplete search for batch of {len(folder_ids)} folders, listing them individually")
+            pages.close()
+            return {folder_id: self.get_files_and_folders(folder_id) for folder_id in folder_ids}
+
+        listings = {folder_id: empty_listing(folder_id) for folder_id in folder_ids}
+        try:
+            # the first page is already in, the rest are sorted into their folders one page at a time
+            for response in itertools.chain([response], pages):
+                for file_item in response["files"]:
+                    # an item with several parents belongs in the listing of every one of them that is in this batch
+                    for parent_id in file_item.get("parents", []):
+                        if parent_id in listings:
+                            add_to_listing(listings[parent_id], file_item)
+        except HttpError as httpError:
+            logger.error(f"get batched files and folders failed with HttpError: {httpError}")
+            return {}
+        return listings
+
+    def get_nested_objects(self, file_id) -> tuple[dict, int, int]:
+        """
+        walks the source tree one folder at a time, depth first. it keeps a stack of the folders still to go through
+        rather than recursing, so there is no limit on how deep the tree can be
         :param file_id: the file id to pull from
-        :return:
+        :return: the Google Drive data tree, and its total nested folders and files
         """
         # Note: could flag with something like a boolean value called copy to run copy commands at certain
         # stages like this
@@ -138,36 +574,204 @@ class GoogleDrive:
         #     parent_object_info = self.drive.files().get(fileId=self.file_id).execute()
         #     self.parent_copy_id = self.copy_folder(parent_object_info['name'])
 
-        files_and_folders = self.get_files_and_folders(file_id)
-        # grab the number of files and folders in this source file_id to start our count
-        total_nested_folders = len(files_and_folders["folders"])
-        total_nested_files = len(files_and_folders["files"])
-        # escape clause - we don't have any more nested objects
-        if total_nested_folders == 0:
-            return files_and_folders, total_nested_folders, total_nested_files
-
-        # recursively get nested objects for each folder
-        for folder in files_and_folders["folders"]:
-            child_objects, folder_count, file_count = self.get_nested_objects(
-                folder["folder_id"]
-            )
+        index = VisitedIndex(file_id, self.multi_parent_policy, self.metrics)
+        stack = index.listed(None, (file_id, None), self.get_files_and_folders(file_id))
+        if not stack:
+            logger.error(f"could not list source folder {file_id}")
+            return {}, 0, 0
+
+        files_and_folders, total_nested_folders, total_nested_files = {}, 0, 0
+        listed_folders = []
+        while stack:
+            folder, node, child_objects = stack.pop()
+            child_objects, to_list, listed = index.visit(node, child_objects)
+            if folder is None:
+                files_and_folders = child_objects
+            else:
+                folder["child_objects"] = child_objects
+                listed_folders.append(folder)
+            # grab the number of files and folders in this folder to add to our count
+            total_nested_folders += len(child_objects["folders"])
+            total_nested_files += len(child_objects["files"])
 
-            # let's store and count the nested child objects
-            folder["child_objects"] = child_objects
-            folder["nested_object_count"] += folder_count + file_count
-            # add the nested counter values
-            total_nested_folders += folder_count
-            total_nested_files += file_count
+            for child, child_node in to_list:
+                listing = self.get_files_and_folders(child["folder_id"])
+                if not listing:
+                    logger.error(f"could not list folder {child['folder_id']}, skipping its nested objects")
+                listed += index.listed(child, child_node, listing)
+            # reversed, so the first folder is the next one taken off the stack
+            stack.extend(reversed(listed))
+
+        count_nested_objects(listed_folders)
         return files_and_folders, total_nested_folders, total_nested_files
 
-    def copy_file(self, file_id, file_name=None, destination_folder_id=None) -> bool:
+    def iter_listings(self, file_id):
+        """
+        walks the source tree breadth first, handing back each folder's listing as soon as it comes in -- folders go on
+        a work queue as soon as they are discovered and are listed by a bounded pool of worker threads, so we are not
+        waiting on one round trip at a time. every folder is only listed once, and anything found under more than one
+        parent is handled by the multi_parent_policy (see VisitedIndex). only the folders waiting to be listed are held
+        on to, never the tree (unless the policy is copy_per_parent)
+        :param file_id: the file id to pull from
+        :return: an iterator of (folder object, its listing), starting with (None, the source folder's listing). a
+        folder is always handed back before its contents are, and folders we couldn't list are logged and skipped
+        """
+        index = VisitedIndex(file_id, self.multi_parent_policy, self.metrics)
+        # (folder object, node, listing) of folders listed but not yet handed back
+        ready = deque(index.listed(None, (file_id, None), self.get_files_and_folders(file_id)))
+        if not ready:
+            logger.error(f"could not list source folder {file_id}")
+            return
+
+        # folders waiting to be listed, and where each is in the walk until it has been
+        pending, nodes = deque(), {}
+        in_flight = {}
+        with ThreadPoolExecutor(max_workers=self.traversal_workers) as executor:
+            while ready or pending or in_flight:
+                while ready:
+                    folder, node, listing = ready.popleft()
+                    listing, to_list, listed = index.visit(node, listing)
+                    for child, child_node in to_list:
+                        pending.append(child)
+                        nodes[child["folder_id"]] = child_node
+                    ready.extend(listed)
+                    yield folder, listing
+
+                # keep every worker busy with the folders we know about
+                while pending and len(in_flight) < self.traversal_workers:
+                    batch = take_folder_batch(pending, self.listing_batch_size)
+                    if len(batch) == 1:
+                        future = executor.submit(self.get_files_and_folders, batch[0]["folder_id"])
+                    else:
+                        future = executor.submit(
+                            self.get_files_and_folders_batched, [folder["folder_id"] for folder in batch]
+                        )
+                    in_flight[future] = batch
+                if not in_flight:
+                    continue
+
+                done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in done:
+                    batch = in_flight.pop(future)
+                    listings = future.result()
+                    if len(batch) == 1:
+                        listings = {batch[0]["folder_id"]: listings}
+                    for folder in batch:
+                        child_objects = (listings or {}).get(folder["folder_id"])
+                        if not child_objects:
+                            logger.error(f"could not list folder {folder['folder_id']}, skipping its nested objects")
+                        ready.extend(index.listed(folder, nodes.pop(folder["folder_id"]), child_objects))
+
+    def iter_nested_objects(self, file_id):
+        """
+        every folder and file under the source folder, as the walk finds them
+        :param file_id: the file id to pull from
+        :return: an iterator of (parent folder id, folder/file object), a folder always coming before its contents
+        """
+        for _, listing in self.iter_listings(file_id):
+            for item in listing["folders"] + listing["files"]:
+                yield listing["folder_id"], item
+
+    def get_nested_objects_concurrent(self, file_id, on_listing=None, keep_tree=True) -> tuple[dict, int, int]:
+        """
+        breadth-first version of get_nested_objects, built from the listings iter_listings walks in parallel
+        :param file_id: the file id to pull from
+        :param on_listing: called with each folder's listing as it comes back (ie TreeStore.write_listing), before its
+        nested object counts are known
+        :param keep_tree: build up the drive data tree. without it, listings are only handed to on_listing and dropped
+        (so the caller can keep them elsewhere, ie in the tree store), and the tree returned is just the source folder's
+        listing
+        :return: the same drive data tree and nested folder/file totals as get_nested_objects
+        """
+        files_and_folders, total_nested_folders, total_nested_files = {}, 0, 0
+        # every folder we managed to list, in the order the listings came back. a folder is only queued once its
+        # parent has been listed, so parents always show up before their children
+        listed_folders = []
+        for folder, child_objects in self.iter_listings(file_id):
+            if folder is None:
+                files_and_folders = child_objects
+            elif keep_tree:
+                folder["child_objects"] = child_objects
+                listed_folders.append(folder)
+            if on_listing:
+                on_listing(child_objects)
+            total_nested_folders += len(child_objects["folders"])
+            total_nested_files += len(child_objects["files"])
+
+        count_nested_objects(listed_folders)
+        return files_and_folders, total_nested_folders, total_nested_files
+
+    def get_start_page_token(self) -> str:
+        """
+        gets the changes api page token for "now", so we can later ask for everything that changed since
+        :return: the start page token
+        """
+        try:
+            return self.connection.changes().getStartPageToken().execute()["startPageToken"]
+        except HttpError as httpError:
+            logger.error(f"get start page token failed with HttpError: {httpError}")
+
+    def get_changes(self, page_token: str) -> tuple[list, str]:
+        """
+        gets every change in the drive since a page token. files come with the listing fields, so a changed file can be
+        compared and copied just like a listed one
+        :param page_token: the page token from get_start_page_token (or a previous get_changes)
+        :return: the changes, and the page token to pass in next time
+        """
+        changes = []
+        try:
+            while True:
+                response = (
+                    self.connection.changes()
+                    .list(pageToken=page_token, includeRemoved=True, **request_options("changes", self.listing_fields))
+                    .execute()
+                )
+                changes += response["changes"]
+                if "newStartPageToken" in response:
+                    return changes, response["newStartPageToken"]
+                page_token = response["nextPageToken"]
+        except HttpError as httpError:
+            logger.error(f"get changes failed with HttpError: {httpError}")
+            return [], None
+
+    def trash_file(self, file_id: str) -> bool:
+        """
+        moves a file to the trash
+        :param file_id: the file id to trash
+        :return:
+        """
+        try:
+            self.files.update(
+                fileId=file_id, body={"trashed": True}, **request_options("update")
+            ).execute()
+            return True
+        except HttpError as httpError:
+            logger.error(f"trash file failed with HttpError: {httpError}")
+
+    def rename_file(self, file_id: str, name: str) -> bool:
+        """
+        renames a file or folder
+        :param file_id: the file id to rename
+        :param name: its new name
+        :return:
+        """
+        try:
+            self.files.update(fileId=file_id, body={"name": name}, **request_options("update")).execute()
+            return True
+        except HttpError as httpError:
+            logger.error(f"rename file failed with HttpError: {httpError}")
+
+    @span("file_copy")
+    def copy_file(self, file_id, file_name=None, destination_folder_id=None, modified_time=None) -> str:
         """
         Copies a file given an id
         :param file_id: the file id to copy
         :param file_name: name of the new file (optional, if not provided the name will be 'Copy "original file name"')
         :param destination_folder_id: the parent id to copy the file to, if not it will drop it in the main part of the
         drive
-        :return:
+        :param modified_time: the source's modified time, to give the copy the same one (so diff copies can tell it
+        is unchanged later on, even for files without a checksum like Google Docs)
+        :return: the id of the new file
         """
         file_configuration = {}
         # set our configuration options if they have been provided
@@ -175,15 +779,63 @@ class GoogleDrive:
             file_configuration["name"] = file_name
         if destination_folder_id:
             file_configuration["parents"] = [destination_folder_id]
+        if modified_time:
+            file_configuration["modifiedTime"] = modified_time
         # try our copy file
         try:
-            self.connection.files().copy(
-                fileId=file_id, body=file_configuration
+            file = self.files.copy(
+                fileId=file_id, body=file_configuration, **request_options("copy")
             ).execute()
-            return True
+            return file["id"]
         except HttpError as httpError:
-            logging.error(f"copy file failed with HttpError: {httpError}")
+            logger.error(f"copy file failed with HttpError: {httpError}")
+
+    @span("file_copy")
+    def create_shortcut(self, target_id: str, name: str, destination_folder_id: str) -> str:
+        """
+        Creates a shortcut to a file or folder
+        :param target_id: the id of the file or folder the shortcut points to
+        :param name: name of the shortcut
+        :param destination_folder_id: the folder to put the shortcut in
+        :return: the id of the new shortcut
+        """
+        try:
+            shortcut = self.files.create(
+                body=self.shortcut_configuration(target_id, name, destination_folder_id), **request_options("create")
+            ).execute()
+            return shortcut["id"]
+        except HttpError as httpError:
+            logger.error(f"create shortcut failed with HttpError: {httpError}")
+
+    def shortcut_configuration(self, target_id: str, name: str, destination_folder_id: str) -> dict:
+        """
+        :param target_id: the id of the file or folder the shortcut points to
+        :param name: name of the shortcut
+        :param destination_folder_id: the folder to put the shortcut in
+        :return: the files.create body for a shortcut
+        """
+        return {
+            "name": name,
+            "mimeType": TYPE_SHORTCUT,
+            "parents": [destination_folder_id],
+            "shortcutDetails": {"targetId": target_id},
+        }
+
+    def copy_file_object(self, file: dict, destination_folder_id: str) -> str:
+        """
+        Copies a file from the drive data, or creates a new shortcut to the same item when it is a shortcut (see the
+        multi_parent_policy "link") or the copy_strategy links it
+        :param file: the file object
+        :param destination_folder_id: the folder to copy it to
+        :return: the id of the new file
+        """
+        if links_file(file, self.copy_strategy, self.shortcut_min_size):
+            return self.create_shortcut(file["file_id"], file["file_name"], destination_folder_id)
+        # check if we want to copy the exact file name (ie Stranger Things -> Stranger Things)
+        file_name = file["file_name"] if self.copy_exact_filename else None
+        return self.copy_file(file["file_id"], file_name, destination_folder_id, file.get("modified_time"))
 
+    @span("folder_creation")
     def copy_folder(self, folder_name: str, destination_folder_id: str = None) -> str:
         """
         Creates a "copy" of a folder. Drive does not support direct copies, so we just create a new folder with
@@ -202,35 +854,41 @@ class GoogleDrive:
         # run our copy folder
         try:
             folder = (
-                self.connection.files()
-                .create(body=folder_configuration, fields="id")
+                self.files
+                .create(body=folder_configuration, **request_options("create"))
                 .execute()
             )
             return folder["id"]
         except HttpError as httpError:
-            logging.error(f"create/copy folder failed with HttpError: {httpError}")
+            logger.error(f"create/copy folder failed with HttpError: {httpError}")
 
-    def copy_nested_items(
-        self, drive_data: dict, destination_folder_id: str = None
-    ) -> str:
+    def copy_root(self, source_id: str, destination_folder_id: str = None) -> str:
         """
-        recursively create folders and copy files given the Google Drive data
+        works out where a copy goes -- the destination we were given, the one an interrupted copy already created, or
+        a new folder named after the source
+        :param source_id: the source folder id
         :param destination_folder_id: where we're copying to, if not specified we create a place
-        :param drive_data: the Google Drive data we're copying
-        :return:
+        :return: the destination folder id, or "" if there is nothing more to copy (the source was a single file, or
+        we couldn't create the destination)
         """
+        # if we are picking up an interrupted copy, carry on in the destination it already created
+        if not destination_folder_id and self.journal:
+            destination_folder_id = self.journal.get(source_id)
+            if destination_folder_id:
+                logger.info(f"resuming copy of {source_id} into {destination_folder_id}")
+
         # if there is no destination set, assume this is the first run from the source folder, we want to get the
         # info for our starting place
         if not destination_folder_id:
-            # pull source info from the parent folder ID in the drive_data object
+            # pull source info from the source folder ID
             try:
                 source_file_info = (
-                    self.connection.files()
-                    .get(fileId=drive_data["folder_id"])
+                    self.files
+                    .get(fileId=source_id, **request_options("get"))
                     .execute()
                 )
                 if source_file_info["mimeType"] != self.type_folder:
-                    self.copy_file(drive_data["folder_id"], source_file_info["name"])
+                    self.copy_file(source_id, source_file_info["name"])
                     logger.warning(
                         f"Source id of drive data is not folder type, copied file."
                     )
@@ -238,19 +896,52 @@ class GoogleDrive:
                 else:
                     # the source folder is a folder type, so create our destination to copy to
                     destination_folder_id = self.copy_folder(source_file_info["name"])
+                    if self.journal and destination_folder_id:
+                        self.journal.record(source_id, None, destination_folder_id, "root")
             except HttpError as err:
-                logging.error(f"get source file info failed with HttpError: {err}")
+                logger.error(f"get source file info failed with HttpError: {err}")
                 return ""
+        return destination_folder_id or ""
+
+    def copy_nested_items(
+        self, drive_data: dict, destination_folder_id: str = None
+    ) -> str:
+        """
+        recursively create folders and copy files given the Google Drive data
+        :param destination_folder_id: where we're copying to, if not specified we create a place
+        :param drive_data: the Google Drive data we're copying
+        :return:
+        """
+        if self.copy_engine == "async":
+            # only imported when it's used, as it needs aiohttp
+            from services.async_drive import copy_with_async_drive
+
+            return asyncio.run(copy_with_async_drive(self, drive_data, destination_folder_id))
+
+        destination_folder_id = self.copy_root(drive_data["folder_id"], destination_folder_id)
+        if not destination_folder_id:
+            return ""
+
+        if self.copy_engine == "batched":
+            return self.copy_nested_items_batched(drive_data, destination_folder_id)
+        # the streaming engine copies as the source is walked, with a tree already in hand it copies in parallel
+        if self.copy_engine in ("parallel", "streaming"):
+            return self.copy_nested_items_parallel(drive_data, destination_folder_id)
 
         # copy our folders
         for folder in drive_data["folders"]:
-            # create the new folder in the new destination
-            new_folder_id = self.copy_folder(
-                folder["folder_name"], destination_folder_id
-            )
-            logger.info(
-                f"copied folder {folder['folder_name']} to {destination_folder_id} with new id {new_folder_id}"
-            )
+            # reuse the folder if an earlier, interrupted run already created it
+            new_folder_id = self.journal.get(folder["folder_id"], destination_folder_id) if self.journal else None
+            if not new_folder_id:
+                # create the new folder in the new destination
+                new_folder_id = self.copy_folder(
+                    folder["folder_name"], destination_folder_id
+                )
+                logger.info(
+                    f"copied folder {folder['folder_name']} to {destination_folder_id} with new id {new_folder_id}"
+                )
+                if self.journal and new_folder_id:
+                    self.journal.record(folder["folder_id"], destination_folder_id, new_folder_id, "folder")
             # if the folder has children, copy those nested objects
             if folder["nested_object_count"] != 0:
                 # as an improvement you could instead write the next iteration data to a queue for ingestion or
@@ -261,16 +952,291 @@ class GoogleDrive:
                 )
         # copy our files
         for file in drive_data["files"]:
+            # skip anything an earlier, interrupted run already copied
+            if self.journal and self.journal.get(file["file_id"], destination_folder_id):
+                continue
+            if links_file(file, self.copy_strategy, self.shortcut_min_size):
+                new_file_id = self.create_shortcut(file["file_id"], file["file_name"], destination_folder_id)
             # check if we want to copy the exact file name (ie Stranger Things -> Stranger Things)
-            if self.copy_exact_filename:
-                if self.copy_file(
+            elif self.copy_exact_filename:
+                new_file_id = self.copy_file(
                     file["file_id"],
                     file_name=file["file_name"],
                     destination_folder_id=destination_folder_id,
-                ):
-                    logger.info(f"copied file {file['file_name']} to {destination_folder_id}")
+                    modified_time=file.get("modified_time"),
+                )
             else:
                 # create Copy file (ie Stranger Things -> Copy of Stranger Things)
-                if self.copy_file(file["file_id"], destination_folder_id=destination_folder_id):
-                    logger.info(f"copied file {file['file_name']} to {destination_folder_id}")
+                new_file_id = self.copy_file(
+                    file["file_id"],
+                    destination_folder_id=destination_folder_id,
+                    modified_time=file.get("modified_time"),
+                )
+            if new_file_id:
+                logger.info(f"copied file {file['file_name']} to {destination_folder_id}")
+                if self.journal:
+                    self.journal.record(file["file_id"], destination_folder_id, new_file_id, "file")
+        return destination_folder_id
+
+    def execute_batch(self, requests: list) -> list:
+        """
+        runs requests as Drive batch requests of up to BATCH_LIMIT sub-requests, retrying only the sub-requests that
+        failed with a retryable error
+        :param requests: the HttpRequest objects to run
+        :return: the response for each request in the same order, None where a request failed
+        """
+        responses = [None] * len(requests)
+        remaining = list(range(len(requests)))
+        for attempt in range(self.batch_attempts):
+            if attempt:
+                time.sleep(backoff_delay(attempt))
+            retry = []
+
+            def callback(request_id, response, exception):
+                index = int(request_id)
+                if exception is None:
+                    responses[index] = response
+                elif is_retryable(exception):
+                    if exception.resp.status in (403, 429):
+                        self.rate_limiter.on_throttle()
+                    retry.append(index)
+                else:
+                    logger.error(f"batched request failed with HttpError: {exception}")
+
+            for start in range(0, len(remaining), BATCH_LIMIT):
+                chunk = remaining[start:start + BATCH_LIMIT]
+                batch = self.connection.new_batch_http_request(callback=callback)
+                for index in chunk:
+                    batch.add(requests[index], request_id=str(index))
+                try:
+                    batch.execute()
+                except HttpError as httpError:
+                    # the batch as a whole failed, so none of its sub-requests ran
+                    if not is_retryable(httpError):
+                        logger.error(f"batch request failed with HttpError: {httpError}")
+                        continue
+                    retry.extend(index for index in chunk if index not in retry)
+
+            remaining = sorted(retry)
+            if not remaining:
+                break
+            logger.warning(f"retrying {len(remaining)} failed batched requests")
+        else:
+            logger.error(f"giving up on {len(remaining)} batched requests after {self.batch_attempts} attempts")
+        return responses
+
+    def copy_nested_items_batched(self, drive_data: dict, destination_folder_id: str) -> str:
+        """
+        copies the Google Drive data one level at a time, creating all of a level's folders and then copying all of its
+        files as batch requests instead of one round trip per item
+        :param drive_data: the Google Drive data we're copying
+        :param destination_folder_id: where we're copying to
+        :return:
+        """
+        # pairs of (drive data, the destination folder id its contents go in)
+        level = [(drive_data, destination_folder_id)]
+        while level:
+            drive_files = self.files
+            next_level = []
+            # create every folder on this level, all siblings (and cousins) together -- apart from any an earlier,
+            # interrupted run already created
+            folders = []
+            for data, parent_id in level:
+                for folder in data["folders"]:
+                    new_folder_id = self.journal.get(folder["folder_id"], parent_id) if self.journal else None
+                    if not new_folder_id:
+                        folders.append((folder, parent_id))
+                    elif folder["nested_object_count"] != 0:
+                        next_level.append((folder["child_objects"], new_folder_id))
+            with self.metrics.span("folder_creation"):
+                responses = self.execute_batch(
+                    [
+                        drive_files.create(
+                            body={"name": folder["folder_name"], "mimeType": self.type_folder, "parents": [parent_id]},
+                            **request_options("create"),
+                        )
+                        for folder, parent_id in folders
+                    ]
+                )
+            for (folder, parent_id), response in zip(folders, responses):
+                if not response:
+                    logger.error(f"could not copy folder {folder['folder_name']}, skipping its nested objects")
+                    continue
+                logger.info(
+                    f"copied folder {folder['folder_name']} to {parent_id} with new id {response['id']}"
+                )
+                if self.journal:
+                    self.journal.record(folder["folder_id"], parent_id, response["id"], "folder")
+                if folder["nested_object_count"] != 0:
+                    next_level.append((folder["child_objects"], response["id"]))
+
+            # then copy every file on this level
+            files = [
+                (file, parent_id)
+                for data, parent_id in level
+                for file in data["files"]
+                if not (self.journal and self.journal.get(file["file_id"], parent_id))
+            ]
+            requests = []
+            for file, parent_id in files:
+                if links_file(file, self.copy_strategy, self.shortcut_min_size):
+                    body = self.shortcut_configuration(file["file_id"], file["file_name"], parent_id)
+                    requests.append(drive_files.create(body=body, **request_options("create")))
+                    continue
+                file_configuration = {"parents": [parent_id]}
+                # check if we want to copy the exact file name (ie Stranger Things -> Stranger Things)
+                if self.copy_exact_filename:
+                    file_configuration["name"] = file["file_name"]
+                if file.get("modified_time"):
+                    file_configuration["modifiedTime"] = file["modified_time"]
+                requests.append(
+                    drive_files.copy(fileId=file["file_id"], body=file_configuration, **request_options("copy"))
+                )
+            with self.metrics.span("file_copy"):
+                responses = self.execute_batch(requests)
+            for (file, parent_id), response in zip(files, responses):
+                if response:
+                    logger.info(f"copied file {file['file_name']} to {parent_id}")
+                    if self.journal:
+                        self.journal.record(file["file_id"], parent_id, response["id"], "file")
+            level = next_level
+        return destination_folder_id
+
+    @contextmanager
+    def copy_pool(self):
+        """
+        the thread pool the parallel and streaming copy engines copy items on -- copy_executor if it is set, otherwise
+        a pool of copy_workers threads of their own
+        :return:
+        """
+        if self.copy_executor:
+            yield self.copy_executor
+            return
+        with ThreadPoolExecutor(max_workers=self.copy_workers) as executor:
+            yield executor
+
+    def copy_nested_items_parallel(self, drive_data: dict, destination_folder_id: str) -> str:
+        """
+        copies the Google Drive data on a pool of worker threads -- as soon as a folder has been created its files and
+        subfolders are scheduled, rather than waiting on the rest of the tree
+        :param drive_data: the Google Drive data we're copying
+        :param destination_folder_id: where we're copying to
+        :return:
+        """
+        with self.copy_pool() as executor:
+            # future -> (is folder, folder/file object, destination folder id)
+            in_flight = {}
+
+            def schedule(data, parent_id):
+                # folders first, so the deeper parts of the tree are unblocked as early as possible
+                for folder in data["folders"]:
+                    # an earlier, interrupted run may have already created the folder
+                    new_folder_id = self.journal.get(folder["folder_id"], parent_id) if self.journal else None
+                    if new_folder_id:
+                        if folder["nested_object_count"] != 0:
+                            schedule(folder["child_objects"], new_folder_id)
+                        continue
+                    future = executor.submit(self.copy_folder, folder["folder_name"], parent_id)
+                    in_flight[future] = (True, folder, parent_id)
+                for file in data["files"]:
+                    if self.journal and self.journal.get(file["file_id"], parent_id):
+                        continue
+                    future = executor.submit(self.copy_file_object, file, parent_id)
+                    in_flight[future] = (False, file, parent_id)
+
+            schedule(drive_data, destination_folder_id)
+            while in_flight:
+                done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in done:
+                    is_folder, item, parent_id = in_flight.pop(future)
+                    if not is_folder:
+                        new_file_id = future.result()
+                        if new_file_id:
+                            logger.info(f"copied file {item['file_name']} to {parent_id}")
+                            if self.journal:
+                                self.journal.record(item["file_id"], parent_id, new_file_id, "file")
+                        continue
+                    new_folder_id = future.result()
+                    if not new_folder_id:
+                        logger.error(f"could not copy folder {item['folder_name']}, skipping its nested objects")
+                        continue
+                    logger.info(f"copied folder {item['folder_name']} to {parent_id} with new id {new_folder_id}")
+                    if self.journal:
+                        self.journal.record(item["folder_id"], parent_id, new_folder_id, "folder")
+                    if item["nested_object_count"] != 0:
+                        schedule(item["child_objects"], new_folder_id)
+        return destination_folder_id
+
+    def copy_nested_items_streaming(self, file_id: str, destination_folder_id: str = None, on_listing=None) -> str:
+        """
+        copies the source folder while it is being walked -- each folder's contents are handed to a pool of worker
+        threads as soon as its listing comes in, so copying starts straight away and neither the walk nor the copy
+        ever hold the whole tree
+        :param file_id: the source folder id
+        :param destination_folder_id: where we're copying to, if not specified we create a place
+        :param on_listing: also called with each folder's listing as it comes back (ie TreeStore.write_listing)
+        :return: the destination folder id
+        """
+        destination_folder_id = self.copy_root(file_id, destination_folder_id)
+        if not destination_folder_id:
+            return ""
+
+        # source folder id -> its copies (or the futures creating them) waiting on its listing. with multi_parent_policy
+        # copy_per_parent, a folder with more than one parent in the tree is handed back and copied once for each
+        destinations = {file_id: [destination_folder_id]}
+        with self.copy_pool() as executor:
+            # future -> (is folder, folder/file object, destination folder id)
+            in_flight = {}
+
+            def finish(limit):
+                # journal whatever has finished, waiting while there is more than `limit` left to do
+                while len(in_flight) > limit:
+                    done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        is_folder, item, parent_id = in_flight.pop(future)
+                        new_id = future.result()
+                        if not is_folder:
+                            if new_id:
+                                logger.info(f"copied file {item['file_name']} to {parent_id}")
+                                if self.journal:
+                                    self.journal.record(item["file_id"], parent_id, new_id, "file")
+                            continue
+                        if not new_id:
+                            logger.error(f"could not copy folder {item['folder_name']}, skipping its nested objects")
+                            continue
+                        logger.info(f"copied folder {item['folder_name']} to {parent_id} with new id {new_id}")
+                        if self.journal:
+                            self.journal.record(item["folder_id"], parent_id, new_id, "folder")
+
+            for _, listing in self.iter_listings(file_id):
+                if on_listing:
+                    on_listing(listing)
+                waiting = destinations.get(listing["folder_id"])
+                if not waiting:
+                    # the folder itself couldn't be copied
+                    continue
+                parent_id = waiting.pop(0)
+                if not waiting:
+                    del destinations[listing["folder_id"]]
+                if not isinstance(parent_id, str):
+                    # the folder is usually long since created by the time its listing comes in
+                    parent_id = parent_id.result()
+                    if not parent_id:
+                        continue
+
+                for folder in listing["folders"]:
+                    # an earlier, interrupted run may have already created the folder
+                    new_folder_id = self.journal.get(folder["folder_id"], parent_id) if self.journal else None
+                    if not new_folder_id:
+                        new_folder_id = executor.submit(self.copy_folder, folder["folder_name"], parent_id)
+                        in_flight[new_folder_id] = (True, folder, parent_id)
+                    destinations.setdefault(folder["folder_id"], []).append(new_folder_id)
+                for file in listing["files"]:
+                    if self.journal and self.journal.get(file["file_id"], parent_id):
+                        continue
+                    future = executor.submit(self.copy_file_object, file, parent_id)
+                    in_flight[future] = (False, file, parent_id)
+                # don't let the walk get too far ahead of the copy
+                finish(self.copy_workers * 4)
+            finish(0)
         return destination_folder_id
@@ -0,0 +1,130 @@
+"""
+a process wide pool of keep-alive http connections to Drive, shared by every thread, with one place the credentials
+get refreshed from
+"""
+import logging
+import queue
+import threading
+
+from google.oauth2.credentials import Credentials
+from google_auth_httplib2 import AuthorizedHttp
+from googleapiclient.http import build_http
+
+logger = logging.getLogger(__name__)
+
+
+class HttpPool:
+    """
+    A bounded pool of authorized httplib2.Http objects behind the httplib2.Http request interface. Each Http object
+    keeps its connection (and TLS session) open between requests, but is not thread safe, so every request borrows
+    one from the pool for just as long as it takes. That lets any number of threads share one Drive connection while
+    only ever opening `size` connections, and a connection dropped by the server is reopened by the next request that
+    borrows it. The credentials are refreshed here, behind a lock, rather than by every Http object that notices they
+    have expired.
+    :param credentials: the token credentials for our api connection
+    :param size: the most connections to open at once, requests wait for one to be handed back after that
+    :param factory: builds an unauthorized httplib2.Http object for a new connection
+    :param credential_manager: a CredentialManager to refresh the credentials through, so they are refreshed once
+    across every pool and process using them (optional)
+    """
+
+    def __init__(self, credentials: Credentials, size: int = 16, factory=build_http, credential_manager=None):
+        self.credentials = credentials
+        self.credential_manager = credential_manager
+        self.size = size
+        self.factory = factory
+        # last in first out, so the connection that was used most recently (and is least likely to have been closed
+        # by the server) goes out first
+        self._idle = queue.LifoQueue()
+        self._lock = threading.Lock()
+        self._refresh_lock = threading.Lock()
+        self._created = 0
+        self.counters = {"connections": 0, "reused": 0, "waited": 0, "refreshes": 0}
+
+    def acquire(self) -> AuthorizedHttp:
+        """
+        borrows an idle connection, opens a new one if the pool isn't full, or else waits for one to be handed back
+        :return:
+        """
+        try:
+            http = self._idle.get_nowait()
+            self._count("reused")
+            return http
+        except queue.Empty:
+            pass
+        with self._lock:
+            create = self._created < self.size
+            if create:
+                self._created += 1
+                self.counters["connections"] += 1
+        if create:
+            # the pool refreshes the credentials itself (see `request`), so the Http objects are told not to
+            return AuthorizedHttp(self.credentials, http=self.factory(), refresh_status_codes=())
+        self._count("waited")
+        return self._idle.get()
+
+    def release(self, http: AuthorizedHttp) -> None:
+        """
+        hands a borrowed connection back to the pool
+        :param http: the connection from acquire
+        :return:
+        """
+        self._idle.put(http)
+
+    def _count(self, counter: str) -> None:
+        with self._lock:
+            self.counters[counter] += 1
+
+    def refresh_credentials(self, stale_token: str | None = None) -> None:
+        """
+        refreshes the shared credentials, once, however many threads find out at the same time that they need it
+        :param stale_token: the access token that was found to be expired or rejected
+        :return:
+        """
+        if self.credential_manager is not None:
+            if self.credential_manager.refresh(stale_token):
+                self._count("refreshes")
+            return
+        with self._refresh_lock:
+            if self.credentials.valid and self.credentials.token != stale_token:
+                # another thread got here first
+                return
+            # only needed once a token expires mid run, and it pulls in requests
+            from google.auth.transport.requests import Request
+
+            logger.info("refreshing Drive credentials")
+            self.credentials.refresh(Request())
+            self._count("refreshes")
+
+    def request(self, uri, method="GET", body=None, headers=None, **kwargs):
+        """
+        the httplib2.Http request interface, sent through a pooled connection
+        :return: a (response, content) tuple
+        """
+        if not self.credentials.valid:
+            self.refresh_credentials(self.credentials.token)
+        token = self.credentials.token
+        http = self.acquire()
+        try:
+            response, content = http.request(uri, method=method, body=body, headers=headers, **kwargs)
+            if response.status == 401:
+                # the token may have been revoked or expired in flight, so refresh it and try again once
+                self.refresh_credentials(token)
+                response, content = http.request(uri, method=method, body=body, headers=headers, **kwargs)
+            return response, content
+        finally:
+            self.release(http)
+
+    def close(self) -> None:
+        """
+        closes every idle connection -- the pool can still be used afterwards, it will just open new ones
+        :return:
+        """
+        while True:
+            try:
+                http = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            http.close()
+            with self._lock:
+                self._created -= 1
@@ -0,0 +1,198 @@
+"""
+incremental sync -- instead of walking the whole source tree again, ask the Drive changes api for everything that
+changed since the cached drive data was built and apply just those changes (adds, moves, renames and trashes) to it
+"""
+import logging
+
+from services.diff_copy import is_unchanged
+from services.google_drive_helpers import GoogleDrive, empty_listing, file_object, folder_object, links_file
+
+logger = logging.getLogger(__name__)
+
+
+def _remove(objects: list, entry: dict) -> None:
+    """
+    removes a folder/file object from a list by identity (comparing the nested dicts would be slow, and pointless)
+    :param objects: a listing's folders or files
+    :param entry: the folder/file object to remove
+    :return:
+    """
+    del objects[next(index for index, item in enumerate(objects) if item is entry)]
+
+
+def _index(drive_data: dict, listings: dict, items: dict) -> None:
+    """
+    indexes a drive data tree so changes can be applied without searching it
+    :param drive_data: the (sub)tree to index
+    :param listings: filled with folder id -> the files and folders data of that folder
+    :param items: filled with item id -> (the listing it's in, its folder/file object)
+    :return:
+    """
+    stack = [drive_data]
+    while stack:
+        listing = stack.pop()
+        listings[listing["folder_id"]] = listing
+        for file in listing["files"]:
+            items[file["file_id"]] = (listing, file)
+        for folder in listing["folders"]:
+            items[folder["folder_id"]] = (listing, folder)
+            # a folder we couldn't list has empty child objects, treat it as an empty folder from here on
+            if not folder["child_objects"]:
+                folder["child_objects"] = empty_listing(folder["folder_id"])
+            stack.append(folder["child_objects"])
+
+
+def _unindex(entry: dict, listings: dict, items: dict) -> None:
+    """
+    drops an item (and, for a folder, everything in it) from the index
+    :param entry: the folder/file object
+    :param listings: the folder index from _index
+    :param items: the item index from _index
+    :return:
+    """
+    if "file_id" in entry:
+        items.pop(entry["file_id"], None)
+        return
+    removed_listings, removed_items = {}, {}
+    _index(entry["child_objects"], removed_listings, removed_items)
+    for folder_id in removed_listings:
+        listings.pop(folder_id, None)
+    for item_id in removed_items:
+        items.pop(item_id, None)
+    items.pop(entry["folder_id"], None)
+
+
+def recount(drive_data: dict) -> tuple[int, int]:
+    """
+    recalculates every nested/local object count in a drive data tree after it has been changed
+    :param drive_data: the Google Drive data
+    :return: the total nested folders and files, like get_nested_objects
+    """
+    # walk the tree top down, then count it bottom up
+    order, stack = [], [drive_data]
+    while stack:
+        listing = stack.pop()
+        order.append(listing)
+        stack.extend(folder["child_objects"] for folder in listing["folders"] if folder["child_objects"])
+
+    totals = {}
+    for listing in reversed(order):
+        listing["local_object_count"] = len(listing["folders"]) + len(listing["files"])
+        total_folders, total_files = len(listing["folders"]), len(listing["files"])
+        for folder in listing["folders"]:
+            folder_count, file_count = totals.get(folder["folder_id"], (0, 0))
+            folder["nested_object_count"] = folder_count + file_count
+            total_folders += folder_count
+            total_files += file_count
+        totals[listing["folder_id"]] = (total_folders, total_files)
+    return totals[drive_data["folder_id"]]
+
+
+def apply_changes(google_drive: GoogleDrive, drive_data: dict, changes: list, renamed: dict = None) -> set:
+    """
+    applies changes api results to a drive data tree. anything outside of the tree is ignored, and folders that get
+    moved into the tree are listed so their contents come along too. a file only counts as changed when it moved or
+    its content did (its checksum and size, or its modified time when it has no checksum, see is_unchanged) -- not
+    when it was just renamed, starred or shared
+    :param google_drive: Google Drive resource
+    :param drive_data: the Google Drive data to update in place
+    :param changes: the changes from google_drive.get_changes
+    :param renamed: filled with item id -> the name its copies should now have, for the folders and unchanged files
+    that were only renamed
+    :return: the ids of every file that is new or has changed, and of every folder moved to another folder in the tree,
+    whose earlier copies need replacing
+    """
+    listings, items = {}, {}
+    _index(drive_data, listings, items)
+    changed_files = set()
+
+    for change in changes:
+        file_item = change.get("file")
+        known = items.get(change["fileId"])
+        removed = change.get("removed") or not file_item or file_item.get("trashed")
+        # where the item lives in our tree now, if anywhere
+        parent_id = None
+        if not removed:
+            parent_id = next((parent for parent in file_item.get("parents", []) if parent in listings), None)
+
+        if parent_id is None:
+            if known:
+                # trashed, deleted or moved somewhere outside of the tree
+                listing, entry = known
+                _remove(listing["folders"] if "folder_id" in entry else listing["files"], entry)
+                _unindex(entry, listings, items)
+            continue
+
+        is_folder = file_item["mimeType"] == google_drive.type_folder
+        if known:
+            listing, entry = known
+            moved = listing["folder_id"] != parent_id
+            if moved:
+                # moved to another folder in the tree -- its earlier copy is replaced by one in the new place (for a
+                # folder, along with everything in it)
+                _remove(listing["folders"] if is_folder else listing["files"], entry)
+                (listings[parent_id]["folders"] if is_folder else listings[parent_id]["files"]).append(entry)
+                items[change["fileId"]] = (listings[parent_id], entry)
+                changed_files.add(change["fileId"])
+            if is_folder:
+                if not moved and renamed is not None and entry["folder_name"] != file_item["name"]:
+                    renamed[change["fileId"]] = file_item["name"]
+                entry["folder_name"] = file_item["name"]
+                continue
+            latest = file_object(file_item)
+            if entry.get("shortcut"):
+                latest["shortcut"] = True
+            linked = links_file(latest, google_drive.copy_strategy, google_drive.shortcut_min_size)
+            if not moved and not is_unchanged(latest, entry, linked):
+                changed_files.add(change["fileId"])
+            elif not moved and renamed is not None and entry["file_name"] != latest["file_name"]:
+                # copies and shortcuts are named like copy_file_object names them
+                exact = google_drive.copy_exact_filename or linked
+                renamed[change["fileId"]] = latest["file_name"] if exact else f"Copy of {latest['file_name']}"
+            # the entry stays where it is in the tree, with the latest name and metadata
+            entry.clear()
+            entry.update(latest)
+            continue
+
+        # something new in the tree
+        if is_folder:
+            entry = folder_object(file_item)
+            # it may have been moved in from elsewhere with its contents, so list it rather than waiting on changes
+            entry["child_objects"], _, _ = google_drive.get_nested_objects_concurrent(file_item["id"])
+            if not entry["child_objects"]:
+                logger.error(f"could not list folder {file_item['id']} moved into the tree, treating it as empty")
+                entry["child_objects"] = empty_listing(file_item["id"])
+            new_listings, new_items = {}, {}
+            _index(entry["child_objects"], new_listings, new_items)
+            listings.update(new_listings)
+            items.update(new_items)
+            changed_files.update(item_id for item_id, (_, item) in new_items.items() if "file_id" in item)
+            listings[parent_id]["folders"].append(entry)
+        else:
+            entry = file_object(file_item)
+            changed_files.add(file_item["id"])
+            listings[parent_id]["files"].append(entry)
+        items[file_item["id"]] = (listings[parent_id], entry)
+
+    return changed_files
+
+
+def sync_drive_data(google_drive: GoogleDrive, drive_data: dict, renamed: dict = None) -> set | None:
+    """
+    brings cached drive data up to date from the changes since its `start_page_token`
+    :param google_drive: Google Drive resource
+    :param drive_data: the cached Google Drive data, updated in place along with its page token
+    :param renamed: filled with item id -> the name its copies should now have, for everything that was only renamed
+    (see apply_changes)
+    :return: the ids of every file that is new or has changed and every folder that moved (see apply_changes), or
+    None if the changes couldn't be fetched, leaving the drive data as it was
+    """
+    changes, new_page_token = google_drive.get_changes(drive_data["start_page_token"])
+    if new_page_token is None:
+        logger.error("could not get changes for incremental sync")
+        return None
+    changed_files = apply_changes(google_drive, drive_data, changes, renamed)
+    recount(drive_data)
+    drive_data["start_page_token"] = new_page_token
+    logger.info(f"applied {len(changes)} changes, {len(changed_files)} new or changed files")
+    return changed_files
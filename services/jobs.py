@@ -0,0 +1,162 @@
+"""
+job files -- copying many source folders to many destinations in one run. every job shares the one GoogleDrive, so
+the whole run goes through one rate limiter and one pool of http connections, and the source trees go through the tree
+store, so a source listed by more than one job (or inside another job's source) is only walked once
+"""
+import csv
+import json
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import yaml
+
+from services.copy_journal import CopyJournal
+from services.diff_copy import prepare_diff_copy
+from services.google_drive_helpers import GoogleDrive
+from services.tree_store import TreeStore
+
+logger = logging.getLogger(__name__)
+
+
+def load_jobs(path: str) -> list[dict]:
+    """
+    reads a job file, either a csv file with `source` and `destination` columns or a yaml file with a list of jobs
+    (on its own or under `jobs`), each with a `source` and optionally a `destination`
+    :param path: the job file
+    :return: the jobs, as {"source": ..., "destination": ...} with None for no destination (a new folder named after
+    the source is created, like assessment three without a destination)
+    :raises ValueError: if a job has no source, or copies the same source to the same place as an earlier job (they
+    would share the one copy in the journal, so the second job would only race the first one)
+    """
+    with open(path, newline="", encoding="utf-8") as f:
+        if path.endswith(".csv"):
+            rows = list(csv.DictReader(f))
+        else:
+            rows = yaml.safe_load(f) or []
+            if isinstance(rows, dict):
+                rows = rows.get("jobs") or []
+
+    jobs, numbers = [], {}
+    for number, row in enumerate(rows, start=1):
+        if not isinstance(row, dict) or not row.get("source"):
+            raise ValueError(f"job {number} in {path} has no source")
+        source, destination = str(row["source"]).strip(), str(row.get("destination") or "").strip() or None
+        if (source, destination) in numbers:
+            raise ValueError(f"job {number} in {path} is the same as job {numbers[source, destination]}")
+        numbers[source, destination] = number
+        jobs.append({"source": source, "destination": destination})
+    return jobs
+
+
+def prepare_sources(google_drive: GoogleDrive, tree_store: TreeStore, jobs: list) -> None:
+    """
+    makes sure the tree store has an up to date tree for every job's source, walking each source at most once. a
+    source inside another source that was already walked is finished from the listings already stored rather than
+    walked again. sources are walked in job file order, so an outer source only saves walking the ones after it
+    :param google_drive: Google Drive resource
+    :param tree_store: the tree store
+    :param jobs: the jobs, each given its source's `total_objects`
+    :return:
+    """
+    totals = {}
+    max_age, fields = google_drive.tree_cache_max_age, google_drive.listing_fields
+    policy = google_drive.multi_parent_policy
+    for job in jobs:
+        source_id = job["source"]
+        if source_id not in totals:
+            cached = tree_store.get_source(source_id, max_age, fields, policy)
+            if cached:
+                logger.info(f"using the cached tree for source {source_id}")
+                totals[source_id] = (cached["total_nested_folders"], cached["total_nested_files"])
+            elif tree_store.has_subtree(source_id, max_age):
+                logger.info(f"source {source_id} was listed with another source, not walking it again")
+                totals[source_id] = tree_store.finish_source(source_id, None, fields, policy)
+            else:
+                logger.info(f"walking source {source_id}")
+                start_page_token = google_drive.get_start_page_token()
+                google_drive.get_nested_objects_concurrent(
+                    source_id, on_listing=tree_store.write_listing, keep_tree=False
+                )
+                totals[source_id] = tree_store.finish_source(source_id, start_page_token, fields, policy)
+        job["total_objects"] = sum(totals[source_id])
+
+
+def run_job(google_drive: GoogleDrive, tree_store: TreeStore, journal: CopyJournal, job: dict) -> None:
+    """
+    copies one job's source from the tree store to its destination, filling in the job's `status`,
+    `copy_source_id` and `seconds`
+    :param google_drive: Google Drive resource
+    :param tree_store: the tree store, with the job's source already in it
+    :param journal: the copy journal shared by every job
+    :param job: the job
+    :return:
+    """
+    logger.info(f"copying job {job['source']} -> {job['destination']}, {job['total_objects']} objects")
+    started = time.perf_counter()
+    job["status"] = "copying"
+    source_data = tree_store.load_tree(job["source"], compact=True)
+    if google_drive.diff_copy and job["destination"]:
+        prepare_diff_copy(google_drive, source_data, job["destination"], journal)
+    job["copy_source_id"] = google_drive.copy_nested_items(source_data, job["destination"])
+    job["status"] = "done" if job["copy_source_id"] else "failed"
+    job["seconds"] = round(time.perf_counter() - started, 3)
+
+
+def run_jobs(google_drive: GoogleDrive, jobs: list, resume: bool = False) -> list[dict]:
+    """
+    runs every job in a job file. the sources are walked first (see prepare_sources), then the copies run job_workers
+    at a time, biggest first so the longest copies aren't left running on their own at the end. progress is logged as
+    each job starts and finishes, and every job's outcome is written to reports/jobs_report.json
+    :param google_drive: Google Drive resource
+    :param jobs: the jobs, as load_jobs returns them
+    :param resume: pick up where an interrupted run of the same job file left off instead of starting over
+    :return: the jobs, with their `total_objects`, `status`, `copy_source_id` and `seconds`
+    """
+    journal = CopyJournal(google_drive.copy_journal_path)
+    if resume:
+        logger.info(f"resuming jobs with {len(journal.entries)} items already copied")
+    else:
+        journal.clear()
+    tree_store = TreeStore(google_drive.tree_store_path)
+    for job in jobs:
+        job.update(total_objects=0, status="pending", copy_source_id="", seconds=0.0)
+
+    finished = 0
+    google_drive.journal = journal
+    # every job's items are copied on the one pool, so the jobs going at once share copy_workers threads between them
+    # rather than each having a pool of its own
+    google_drive.copy_executor = ThreadPoolExecutor(max_workers=google_drive.copy_workers)
+    try:
+        prepare_sources(google_drive, tree_store, jobs)
+        order = sorted(jobs, key=lambda job: job["total_objects"], reverse=True)
+        with ThreadPoolExecutor(max_workers=google_drive.job_workers) as executor:
+            futures = {executor.submit(run_job, google_drive, tree_store, journal, job): job for job in order}
+            for future in as_completed(futures):
+                job = futures[future]
+                try:
+                    future.result()
+                except Exception as e:
+                    # one broken job shouldn't take the rest of the run down with it
+                    logger.error(f"job {job['source']} -> {job['destination']} failed: {e}")
+                    job["status"] = "failed"
+                finished += 1
+                logger.info(
+                    f"job {finished}/{len(jobs)} {job['status']}: {job['source']} -> "
+                    f"{job['copy_source_id'] or job['destination']}, {job['total_objects']} objects in "
+                    f"{job['seconds']}s"
+                )
+    finally:
+        google_drive.copy_executor.shutdown()
+        google_drive.copy_executor = None
+        google_drive.journal = None
+        journal.close()
+        tree_store.close()
+
+    with open("reports/jobs_report.json", "w", encoding="utf-8") as f:
+        json.dump({"jobs": jobs}, f, ensure_ascii=False, indent=4)
+    logger.info(f"jobs metrics:\n{google_drive.metrics.summary()}")
+    if google_drive.metrics_format:
+        path = google_drive.metrics.write("reports/jobs_metrics", google_drive.metrics_format)
+        logger.info(f"wrote jobs metrics to {path}")
+    return jobs
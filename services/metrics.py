@@ -0,0 +1,286 @@
+"""
+instrumentation -- what every Drive request cost and where a run spent its time, added up into counters and latency
+histograms that are logged at the end of each assessment and can be written out as json or Prometheus text
+"""
+import json
+import threading
+import time
+from contextlib import contextmanager
+from urllib.parse import urlsplit
+
+# upper bounds (in seconds) of the latency histogram buckets, Prometheus' default ones
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# metrics format -> file extension
+METRICS_FORMATS = {"json": "json", "prometheus": "prom"}
+# (http method, whether the url has a file id) -> the files method it is
+FILES_OPERATIONS = {
+    ("GET", False): "files.list",
+    ("POST", False): "files.create",
+    ("GET", True): "files.get",
+    ("PATCH", True): "files.update",
+    ("DELETE", True): "files.delete",
+}
+
+
+def operation_name(method: str, uri: str) -> str:
+    """
+    names the Drive API method a request is for, from its http method and url
+    :param method: the http method
+    :param uri: the request url
+    :return: ie `files.list`, `files.copy` or `batch`
+    """
+    path = urlsplit(uri).path
+    if path.startswith("/batch/"):
+        return "batch"
+    # /drive/v3/<resource>[/<id>[/<action>]]
+    parts = path.strip("/").split("/")[2:]
+    if parts[:1] == ["changes"]:
+        return "changes.getStartPageToken" if parts[-1] == "startPageToken" else "changes.list"
+    if parts[:1] == ["files"] and len(parts) == 3:
+        # ie files/<id>/copy
+        return f"files.{parts[2]}"
+    if parts[:1] == ["files"]:
+        return FILES_OPERATIONS.get((method, len(parts) == 2), f"files.{method.lower()}")
+    return f"{method} {path}"
+
+
+class Histogram:
+    """
+    counts observations into the LATENCY_BUCKETS buckets, plus their sum
+    """
+
+    __slots__ = ("counts", "count", "sum")
+
+    def __init__(self):
+        # one count per bucket, plus one for anything over the last bucket
+        self.counts = [0] * (len(LATENCY_BUCKETS) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float) -> None:
+        index = 0
+        while index < len(LATENCY_BUCKETS) and value > LATENCY_BUCKETS[index]:
+            index += 1
+        self.counts[index] += 1
+        self.count += 1
+        self.sum += value
+
+    def quantile(self, q: float) -> float:
+        """
+        :param q: the quantile, ie 0.95
+        :return: the upper bound of the bucket the quantile falls in (inf if it's past the last one)
+        """
+        target, seen = q * self.count, 0
+        for bound, count in zip((*LATENCY_BUCKETS, float("inf")), self.counts):
+            seen += count
+            if seen >= target:
+                return bound
+        return float("inf")
+
+    def cumulative(self) -> list[tuple[str, int]]:
+        """
+        :return: (upper bound, observations at or under it) for every bucket, like Prometheus' `le` buckets
+        """
+        buckets, seen = [], 0
+        for bound, count in zip((*map(str, LATENCY_BUCKETS), "+Inf"), self.counts):
+            seen += count
+            buckets.append((bound, seen))
+        return buckets
+
+    def to_dict(self) -> dict:
+        return {"count": self.count, "sum": round(self.sum, 6), "buckets": dict(self.cumulative())}
+
+
+class Metrics:
+    """
+    Thread safe counters and latency histograms for Drive requests, by operation, and for spans -- named phases of
+    work like listing a folder or copying a file, timed however many requests they take
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self) -> None:
+        """
+        forgets everything recorded so far
+        :return:
+        """
+        with self.lock:
+            self.started = time.monotonic()
+            # operation -> counters and latency histogram
+            self.requests = {}
+            # span name -> latency histogram
+            self.spans = {}
+            # event name -> how many times it happened, ie cycles found walking the source
+            self.counters = {}
+
+    def record_request(
+        self,
+        operation: str,
+        seconds: float,
+        status: int,
+        retries: int = 0,
+        bytes_sent: int = 0,
+        bytes_received: int = 0,
+        calls: int = 1,
+    ) -> None:
+        """
+        records one Drive request, once it has finished (including any retries)
+        :param operation: the API method, see operation_name
+        :param seconds: how long it took, retries and all
+        :param status: the http status it finished with
+        :param retries: how many times it was retried
+        :param bytes_sent: the size of the request body
+        :param bytes_received: the size of the response body
+        :param calls: how many API calls it made (the sub-requests of a batch)
+        :return:
+        """
+        with self.lock:
+            stats = self.requests.get(operation)
+            if stats is None:
+                stats = self.requests[operation] = {
+                    "count": 0,
+                    "calls": 0,
+                    "errors": 0,
+                    "retries": 0,
+                    "bytes_sent": 0,
+                    "bytes_received": 0,
+                    "statuses": {},
+                    "latency": Histogram(),
+                }
+            stats["count"] += 1
+            stats["calls"] += calls
+            stats["errors"] += status >= 400
+            stats["retries"] += retries
+            stats["bytes_sent"] += bytes_sent
+            stats["bytes_received"] += bytes_received
+            stats["statuses"][status] = stats["statuses"].get(status, 0) + 1
+            stats["latency"].observe(seconds)
+
+    def count(self, name: str, amount: int = 1) -> None:
+        """
+        counts something happening that isn't a request, ie finding a folder with more than one parent
+        :param name: what happened
+        :param amount: how many times
+        :return:
+        """
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + amount
+
+    @contextmanager
+    def span(self, name: str):
+        """
+        times the work done inside the `with` block as a span
+        :param name: what the work is, ie listing, folder_creation or file_copy
+        """
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            seconds = time.perf_counter() - started
+            with self.lock:
+                self.spans.setdefault(name, Histogram()).observe(seconds)
+
+    def snapshot(self) -> dict:
+        """
+        :return: everything recorded so far, as json friendly dicts
+        """
+        with self.lock:
+            requests = {
+                operation: {
+                    **{key: value for key, value in stats.items() if key not in ("statuses", "latency")},
+                    "statuses": {str(status): count for status, count in stats["statuses"].items()},
+                    "latency_seconds": stats["latency"].to_dict(),
+                }
+                for operation, stats in sorted(self.requests.items())
+            }
+            return {
+                "elapsed_seconds": round(time.monotonic() - self.started, 3),
+                # every files.list request is one page of a listing
+                "list_pages": self.requests["files.list"]["count"] if "files.list" in self.requests else 0,
+                "requests": requests,
+                "spans": {name: histogram.to_dict() for name, histogram in sorted(self.spans.items())},
+                "counters": dict(sorted(self.counters.items())),
+            }
+
+    def summary(self) -> str:
+        """
+        :return: a line for every operation and span, for the logs
+        """
+        lines = []
+        with self.lock:
+            for operation, stats in sorted(self.requests.items()):
+                latency = stats["latency"]
+                lines.append(
+                    f"{operation}: {stats['count']} requests ({stats['calls']} calls), {stats['errors']} errors, "
+                    f"{stats['retries']} retries, mean {latency.sum / latency.count * 1000:.1f}ms, "
+                    f"p95 <= {latency.quantile(0.95) * 1000:.0f}ms, {stats['bytes_received']} bytes received"
+                )
+            for name, latency in sorted(self.spans.items()):
+                lines.append(
+                    f"{name}: {latency.count} spans, {latency.sum:.2f}s in total, mean "
+                    f"{latency.sum / latency.count * 1000:.1f}ms, p95 <= {latency.quantile(0.95) * 1000:.0f}ms"
+                )
+            for name, count in sorted(self.counters.items()):
+                lines.append(f"{name}: {count}")
+        return "\n".join(lines)
+
+    def to_prometheus(self) -> str:
+        """
+        :return: everything recorded so far in the Prometheus text exposition format
+        """
+        snapshot = self.snapshot()
+        lines = [
+            "# HELP drive_requests_total Drive API requests by operation and http status.",
+            "# TYPE drive_requests_total counter",
+        ]
+        for operation, stats in snapshot["requests"].items():
+            for status, count in stats["statuses"].items():
+                lines.append(f'drive_requests_total{{operation="{operation}",status="{status}"}} {count}')
+        for counter, description in (
+            ("calls", "Drive API calls, counting each sub-request of a batch."),
+            ("retries", "Drive API requests retried after a rate limit or server error."),
+            ("bytes_sent", "Bytes of Drive API request bodies."),
+            ("bytes_received", "Bytes of Drive API response bodies."),
+        ):
+            metric = f"drive_request_{counter}_total"
+            lines += [f"# HELP {metric} {description}", f"# TYPE {metric} counter"]
+            for operation, stats in snapshot["requests"].items():
+                lines.append(f'{metric}{{operation="{operation}"}} {stats[counter]}')
+
+        for metric, label, histograms, description in (
+            (
+                "drive_request_duration_seconds",
+                "operation",
+                {operation: stats["latency_seconds"] for operation, stats in snapshot["requests"].items()},
+                "Drive API request latency, including retries.",
+            ),
+            ("drive_span_duration_seconds", "span", snapshot["spans"], "Time spent in each phase of work."),
+        ):
+            lines += [f"# HELP {metric} {description}", f"# TYPE {metric} histogram"]
+            for name, histogram in histograms.items():
+                for bound, count in histogram["buckets"].items():
+                    lines.append(f'{metric}_bucket{{{label}="{name}",le="{bound}"}} {count}')
+                lines.append(f'{metric}_sum{{{label}="{name}"}} {histogram["sum"]}')
+                lines.append(f'{metric}_count{{{label}="{name}"}} {histogram["count"]}')
+
+        lines += ["# HELP drive_events_total Things that happened along the way.", "# TYPE drive_events_total counter"]
+        for name, count in snapshot["counters"].items():
+            lines.append(f'drive_events_total{{event="{name}"}} {count}')
+        return "\n".join(lines) + "\n"
+
+    def write(self, path: str, metrics_format: str = "json") -> str:
+        """
+        writes everything recorded so far to a file
+        :param path: the file path, without its extension
+        :param metrics_format: "json" or "prometheus"
+        :return: the path written to
+        """
+        path = f"{path}.{METRICS_FORMATS[metrics_format]}"
+        with open(path, "w", encoding="utf-8") as f:
+            if metrics_format == "prometheus":
+                f.write(self.to_prometheus())
+            else:
+                json.dump(self.snapshot(), f, indent=4)
+        return path
@@ -0,0 +1,74 @@
+"""
+partitioned listings -- splitting one folder's listing into queries that can run side by side, for folders too big to
+page through one page at a time or that Drive gives up on (`incompleteSearch`). A partition is the folder's folders or
+its other files, modified within a range of time. Ranges are worked out from the oldest and newest modified times in
+the folder, and a partition that still comes back incomplete is split in half
+"""
+import datetime
+
+# a partition narrower than this (in seconds) isn't split any more. Drive keeps modified times to the millisecond
+MIN_PARTITION_SECONDS = 0.002
+
+
+def parse_time(value: str) -> float:
+    """
+    :param value: an RFC 3339 time as Drive gives it, ie 2024-01-01T00:00:00.000Z
+    :return: seconds since the epoch
+    """
+    return datetime.datetime.fromisoformat(value).timestamp()
+
+
+def format_time(seconds: float) -> str:
+    """
+    :param seconds: seconds since the epoch
+    :return: an RFC 3339 time in the same form as Drive's, to compare modified times against in queries
+    """
+    return datetime.datetime.fromtimestamp(seconds, datetime.UTC).strftime("%Y-%m-%dT%H:%M:%S.%f")[:-3] + "Z"
+
+
+def time_partitions(condition: str, oldest: float, newest: float, count: int) -> list[tuple]:
+    """
+    splits a folder's items into equal ranges of modified time. the first and last ranges are left open ended, so
+    nothing modified since the bounds were looked up is missed
+    :param condition: the query condition for the kind of item, ie `mimeType = 'application/vnd.google-apps.folder'`
+    :param oldest: the oldest modified time in the folder
+    :param newest: the newest modified time in the folder
+    :param count: how many ranges to make
+    :return: partitions, as (condition, from, until) with None for an open end
+    """
+    width = (newest - oldest) / count
+    if width < MIN_PARTITION_SECONDS:
+        return [(condition, None, None)]
+    bounds = [None] + [oldest + width * index for index in range(1, count)] + [None]
+    return [(condition, start, end) for start, end in zip(bounds, bounds[1:])]
+
+
+def split_partition(partition: tuple, oldest: float, newest: float) -> list[tuple]:
+    """
+    :param partition: (condition, from, until) with None for an open end
+    :param oldest: the oldest modified time in the folder, standing in for an open start
+    :param newest: the newest modified time in the folder, standing in for an open end
+    :return: the partition's two halves, or nothing if it is already too narrow to split
+    """
+    condition, start, end = partition
+    low = oldest if start is None else start
+    high = newest if end is None else end
+    if high - low < MIN_PARTITION_SECONDS:
+        return []
+    middle = (low + high) / 2
+    return [(condition, start, middle), (condition, middle, end)]
+
+
+def partition_query(base_query: str, partition: tuple) -> str:
+    """
+    :param base_query: the query for everything in the folder, ie from parents_query
+    :param partition: (condition, from, until) with None for an open end
+    :return: the query for just the partition
+    """
+    condition, start, end = partition
+    query = f"{base_query} and {condition}"
+    if start is not None:
+        query += f" and modifiedTime >= '{format_time(start)}'"
+    if end is not None:
+        query += f" and modifiedTime < '{format_time(end)}'"
+    return query
@@ -0,0 +1,197 @@
+"""
+client side throttling for Drive requests: a shared token bucket whose rate adapts AIMD style (additive increase on
+success, multiplicative decrease when Drive tells us to slow down), and an http wrapper that sends every request through
+it and retries rate limited and server side failures with jittered exponential backoff
+"""
+import json
+import logging
+import random
+import threading
+import time
+
+from services.metrics import Metrics, operation_name
+
+logger = logging.getLogger(__name__)
+
+RETRYABLE_STATUSES = (429, 500, 502, 503, 504)
+RATE_LIMIT_REASONS = ("rateLimitExceeded", "userRateLimitExceeded")
+
+
+def is_retryable_response(status: int, content) -> bool:
+    """
+    whether a failed response is worth trying again -- rate limiting and server side errors are, anything else (not
+    found, permission denied, etc.) will just fail again
+    :param status: the http status of the response
+    :param content: the response body
+    :return:
+    """
+    if status in RETRYABLE_STATUSES:
+        return True
+    if status == 403:
+        try:
+            errors = json.loads(content)["error"]["errors"]
+        except (ValueError, KeyError, TypeError):
+            return False
+        return any(error.get("reason") in RATE_LIMIT_REASONS for error in errors)
+    return False
+
+
+def backoff_delay(attempt: int) -> float:
+    """
+    exponential backoff with full jitter, capped at 32 seconds
+    :param attempt: how many times we have already tried
+    :return: seconds to wait before the next try
+    """
+    return random.uniform(0, min(2 ** attempt, 32))
+
+
+class RateLimiter:
+    """
+    A token bucket shared by every thread making Drive requests. The rate creeps up while requests succeed and is cut
+    in half when we get throttled, so it settles just under whatever quota Drive is enforcing.
+    :param rate: the starting rate, in requests per second
+    :param max_rate: the rate will never grow past this
+    :param min_rate: the rate will never shrink below this
+    """
+
+    def __init__(self, rate: float = 20.0, max_rate: float = 200.0, min_rate: float = 0.5):
+        self.rate = rate
+        self.max_rate = max_rate
+        self.min_rate = min_rate
+        # allow short bursts of up to a second's worth of requests
+        self.tokens = rate
+        self.lock = threading.Lock()
+        self.started = self.last_refill = self.last_decrease = time.monotonic()
+        self.counters = {"requests": 0, "throttles": 0, "retries": 0, "failures": 0}
+
+    def acquire(self, cost: int = 1) -> None:
+        """
+        blocks until we are allowed to send a request
+        :param cost: how many requests' worth of quota this uses (ie the number of sub-requests in a batch)
+        :return:
+        """
+        wait = self.reserve(cost)
+        if wait:
+            time.sleep(wait)
+
+    def reserve(self, cost: int = 1) -> float:
+        """
+        takes the tokens for a request without waiting, for callers that wait in their own way (ie asyncio.sleep)
+        :param cost: how many requests' worth of quota this uses
+        :return: how many seconds to wait before sending the request
+        """
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.rate, self.tokens + (now - self.last_refill) * self.rate)
+            self.last_refill = now
+            # take the tokens now (even if that puts us in debt), then wait for the debt to be paid off outside the lock
+            self.tokens -= cost
+            self.counters["requests"] += cost
+            return -self.tokens / self.rate if self.tokens < 0 else 0
+
+    def on_success(self, cost: int = 1) -> None:
+        """
+        additive increase -- roughly one more request per second for every second of successful requests
+        :param cost: how many requests succeeded
+        :return:
+        """
+        with self.lock:
+            self.rate = min(self.max_rate, self.rate + cost / self.rate)
+
+    def on_throttle(self) -> None:
+        """
+        multiplicative decrease -- a burst of throttled requests that were all in flight together only counts once
+        :return:
+        """
+        with self.lock:
+            self.counters["throttles"] += 1
+            now = time.monotonic()
+            if now - self.last_decrease < 1:
+                return
+            self.last_decrease = now
+            self.rate = max(self.min_rate, self.rate / 2)
+            self.tokens = min(self.tokens, 0)
+            logger.warning(f"throttled by Drive, slowing down to {self.rate:.1f} requests per second")
+
+    def record(self, counter: str) -> None:
+        """
+        bumps one of the counters
+        :param counter: the counter name (ie retries)
+        :return:
+        """
+        with self.lock:
+            self.counters[counter] += 1
+
+    def stats(self) -> dict:
+        """
+        :return: the counters along with the current and effective request rates
+        """
+        with self.lock:
+            elapsed = time.monotonic() - self.started
+            return {
+                **self.counters,
+                "rate": round(self.rate, 2),
+                "effective_qps": round(self.counters["requests"] / elapsed, 2) if elapsed else 0.0,
+            }
+
+
+class ThrottledHttp:
+    """
+    Wraps an (authorized) httplib2.Http style object so every request waits on the shared rate limiter and rate limited
+    or server side failures are retried. Anything else is passed straight through to the wrapped http object.
+    :param http: the http object to send requests with
+    :param rate_limiter: the rate limiter shared by all connections
+    :param max_attempts: how many times a request is tried before we hand the failure back to the caller
+    :param metrics: Metrics to record every request in, once it is done with
+    """
+
+    def __init__(self, http, rate_limiter: RateLimiter, max_attempts: int = 6, metrics: Metrics = None):
+        self.http = http
+        self.rate_limiter = rate_limiter
+        self.max_attempts = max_attempts
+        self.metrics = metrics
+
+    def __getattr__(self, name):
+        return getattr(self.http, name)
+
+    def request(self, uri, method="GET", body=None, headers=None, **kwargs):
+        """
+        the httplib2.Http request interface, throttled and retried
+        :return: a (response, content) tuple
+        """
+        # each sub-request of a batch counts against the quota on its own
+        cost = max(1, body.count("Content-ID:")) if isinstance(body, str) and "/batch/" in uri else 1
+        started = time.perf_counter()
+        for attempt in range(self.max_attempts):
+            self.rate_limiter.acquire(cost)
+            response, content = self.http.request(uri, method=method, body=body, headers=headers, **kwargs)
+            if not is_retryable_response(response.status, content):
+                self.rate_limiter.on_success(cost)
+                self._record(method, uri, body, started, response, content, attempt, cost)
+                return response, content
+
+            if response.status in (403, 429):
+                # server errors are just retried, being told to slow down is what adjusts our rate
+                self.rate_limiter.on_throttle()
+            if attempt + 1 == self.max_attempts:
+                break
+            self.rate_limiter.record("retries")
+            # respect Retry-After when Drive gives us one
+            retry_after = response.get("retry-after", "")
+            time.sleep(float(retry_after) if retry_after.isdigit() else backoff_delay(attempt))
+        self.rate_limiter.record("failures")
+        logger.error(f"giving up on {method} {uri} after {self.max_attempts} attempts (status {response.status})")
+        self._record(method, uri, body, started, response, content, attempt, cost)
+        return response, content
+
+    def _record(self, method, uri, body, started, response, content, retries, cost) -> None:
+        if self.metrics is not None:
+            self.metrics.record_request(
+                operation_name(method, uri),
+                time.perf_counter() - started,
+                response.status,
+                retries=retries,
+                bytes_sent=len(body) if body else 0,
+                bytes_received=len(content) if content else 0,
+                calls=cost,
+            )
@@ -0,0 +1,44 @@
+"""
+partial response field masks and page sizes for each kind of Drive call we make, so we only download the parts of a
+file resource we actually read and list folders in as few pages as possible
+"""
+
+# the largest page size files().list will honour
+MAX_PAGE_SIZE = 1000
+
+# the file resource fields each call type needs by default
+FILE_FIELDS = {
+    "list": ["id", "name", "mimeType"],
+    # listing just to count what is there (see services.counting)
+    "count": ["id", "mimeType", "parents"],
+    "get": ["id", "name", "mimeType"],
+    "copy": ["id"],
+    "create": ["id"],
+    "update": ["id"],
+    "changes": ["id", "name", "mimeType", "parents", "trashed"],
+}
+
+
+def request_options(call_type: str, extra_fields: list = None) -> dict:
+    """
+    the keyword arguments to pass along with a Drive call of a given type
+    :param call_type: one of `list`, `count`, `get`, `copy`, `create`, `update` or `changes`
+    :param extra_fields: any file resource fields a feature needs on top of the defaults (ie `parents`)
+    :return: keyword arguments with a `fields` mask (and a `pageSize` for listing)
+    """
+    fields = list(FILE_FIELDS[call_type])
+    for field in extra_fields or []:
+        if field not in fields:
+            fields.append(field)
+
+    if call_type in ("list", "count"):
+        return {
+            "fields": f"nextPageToken, incompleteSearch, files({','.join(fields)})",
+            "pageSize": MAX_PAGE_SIZE,
+        }
+    if call_type == "changes":
+        return {
+            "fields": f"nextPageToken, newStartPageToken, changes(fileId,removed,file({','.join(fields)}))",
+            "pageSize": MAX_PAGE_SIZE,
+        }
+    return {"fields": ",".join(fields)}
@@ -0,0 +1,288 @@
+"""
+sharded copies -- splitting assessment three's copy across worker processes on this machine, each with its own Drive
+credentials and so its own quota. the coordinator walks the source and creates the destination as usual, splits the
+source's top level folders and files into shards of about the same size and queues them in a SQLite shard queue.
+workers claim shards from the queue one at a time and copy them into the destination, reading the tree from the tree
+store and recording what they copy in the copy journal -- the same files the coordinator used, so every worker agrees
+on where things go and an interrupted sharded copy can be resumed like any other
+"""
+import json
+import logging
+import multiprocessing
+import socket
+import sqlite3
+import time
+
+from services.copy_journal import CopyJournal
+from services.google_drive_helpers import GoogleDrive, get_credential_manager
+from services.tree_store import TreeStore
+
+# the coordinator queues this many shards per worker, so a worker that finishes early has more to pick up
+SHARDS_PER_WORKER = 4
+
+logger = logging.getLogger(__name__)
+
+
+def make_shards(drive_data: dict, count: int) -> list[tuple[list, int]]:
+    """
+    splits the top level of a source into shards of about the same number of objects, biggest folders first each going
+    to whichever shard is smallest so far
+    :param drive_data: the Google Drive data for the source
+    :param count: how many shards to make at most
+    :return: (ids of the top level folders and files in it, its number of objects) for every shard that isn't empty
+    """
+    items = [(folder["folder_id"], 1 + folder["nested_object_count"]) for folder in drive_data["folders"]]
+    items += [(file["file_id"], 1) for file in drive_data["files"]]
+    shards = [([], 0) for _ in range(max(1, count))]
+    for item_id, objects in sorted(items, key=lambda item: item[1], reverse=True):
+        smallest = min(range(len(shards)), key=lambda index: shards[index][1])
+        shards[smallest] = (shards[smallest][0] + [item_id], shards[smallest][1] + objects)
+    return [shard for shard in shards if shard[0]]
+
+
+def shard_data(drive_data: dict, item_ids: list) -> dict:
+    """
+    :param drive_data: the Google Drive data for the source
+    :param item_ids: the top level folder and file ids in a shard
+    :return: the drive data for just the shard, to copy into the destination like a whole source
+    """
+    item_ids = set(item_ids)
+    folders = [folder for folder in drive_data["folders"] if folder["folder_id"] in item_ids]
+    files = [file for file in drive_data["files"] if file["file_id"] in item_ids]
+    return {**drive_data, "folders": folders, "files": files, "local_object_count": len(folders) + len(files)}
+
+
+def uncopied(journal: CopyJournal, drive_data: dict, destination_id: str) -> int:
+    """
+    the copy engines log a folder or file they couldn't copy and carry on, so a shard's copy is checked against the
+    journal afterwards instead
+    :param journal: the copy journal the shard was copied with
+    :param drive_data: the Google Drive data for the shard
+    :param destination_id: the folder it was copied into
+    :return: how many of its folders and files have no copy (counting everything in a folder that has none)
+    """
+    missing, pending = 0, [(drive_data, destination_id)]
+    while pending:
+        data, parent_id = pending.pop()
+        missing += sum(1 for file in data["files"] if not journal.get(file["file_id"], parent_id))
+        for folder in data["folders"]:
+            new_folder_id = journal.get(folder["folder_id"], parent_id)
+            if not new_folder_id:
+                missing += 1 + folder["nested_object_count"]
+            elif folder["nested_object_count"] != 0:
+                pending.append((folder["child_objects"], new_folder_id))
+    return missing
+
+
+class ShardQueue:
+    """
+    A SQLite queue of the shards of one sharded copy, along with the source and destination they are copied from and
+    to. Shards are claimed in a transaction of their own, so any number of worker processes on the same machine can
+    share the queue. It is in WAL mode, which SQLite doesn't support over network filesystems, so workers on other
+    machines can't share it.
+    :param path: where the queue lives on disk
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        # autocommit, so claiming a shard can take the write lock up front with BEGIN IMMEDIATE
+        self.db = sqlite3.connect(path, timeout=30, isolation_level=None)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS plan (key TEXT PRIMARY KEY, value TEXT);
+            CREATE TABLE IF NOT EXISTS shards (
+                shard INTEGER PRIMARY KEY,
+                item_ids TEXT NOT NULL,
+                objects INTEGER NOT NULL,
+                status TEXT NOT NULL DEFAULT 'pending',
+                worker TEXT,
+                updated_at REAL,
+                error TEXT
+            );
+            """
+        )
+
+    def plan(self, source_id: str, destination_id: str, shards: list, resume: bool = False) -> None:
+        """
+        queues the shards of a copy. resuming the same copy keeps the shards that were already copied, and queues the
+        ones that were still being copied (ie by a worker that was killed) again
+        :param source_id: the source folder id
+        :param destination_id: the destination folder id
+        :param shards: (ids of the top level folders and files in it, its number of objects) for each shard
+        :param resume: keep the queue if it is for the same copy
+        :return:
+        """
+        if resume and self.copy() == (source_id, destination_id):
+            self.db.execute("UPDATE shards SET status = 'pending', worker = NULL WHERE status != 'done'")
+            return
+        self.db.execute("BEGIN IMMEDIATE")
+        self.db.execute("DELETE FROM plan")
+        self.db.execute("DELETE FROM shards")
+        self.db.executemany(
+            "INSERT INTO plan VALUES (?, ?)", (("source_id", source_id), ("destination_id", destination_id))
+        )
+        self.db.executemany(
+            "INSERT INTO shards (shard, item_ids, objects) VALUES (?, ?, ?)",
+            ((number, json.dumps(item_ids), objects) for number, (item_ids, objects) in enumerate(shards)),
+        )
+        self.db.execute("COMMIT")
+
+    def copy(self) -> tuple[str, str] | None:
+        """
+        :return: the source and destination folder ids of the queued copy, or None if nothing is queued
+        """
+        rows = dict(self.db.execute("SELECT key, value FROM plan").fetchall())
+        if "source_id" not in rows:
+            return None
+        return rows["source_id"], rows["destination_id"]
+
+    def claim(self, worker: str) -> tuple[int, list] | None:
+        """
+        takes the biggest shard nobody has started on yet
+        :param worker: who is claiming it, ie the host and process id
+        :return: the shard number and its top level folder and file ids, or None if there is nothing left to copy
+        """
+        self.db.execute("BEGIN IMMEDIATE")
+        row = self.db.execute(
+            "SELECT shard, item_ids FROM shards WHERE status = 'pending' ORDER BY objects DESC, shard LIMIT 1"
+        ).fetchone()
+        if row:
+            self.db.execute(
+                "UPDATE shards SET status = 'copying', worker = ?, updated_at = ? WHERE shard = ?",
+                (worker, time.time(), row[0]),
+            )
+        self.db.execute("COMMIT")
+        return (row[0], json.loads(row[1])) if row else None
+
+    def finish(self, shard: int, error: str = None) -> None:
+        """
+        marks a claimed shard as copied, or as failed
+        :param shard: the shard number
+        :param error: what went wrong, if the shard failed
+        :return:
+        """
+        self.db.execute(
+            "UPDATE shards SET status = ?, updated_at = ?, error = ? WHERE shard = ?",
+            ("failed" if error else "done", time.time(), error, shard),
+        )
+
+    def statuses(self) -> dict:
+        """
+        :return: how many shards are pending, copying, done and failed
+        """
+        return dict(self.db.execute("SELECT status, COUNT(*) FROM shards GROUP BY status").fetchall())
+
+    def close(self) -> None:
+        """
+        closes the queue database
+        :return:
+        """
+        self.db.close()
+
+
+def run_shard_worker(google_drive: GoogleDrive, queue_path: str, worker: str = None) -> int:
+    """
+    copies shards from the queue until there are none left
+    :param google_drive: Google Drive resource for this worker, with its own credentials
+    :param queue_path: the shard queue
+    :param worker: the worker's name in the queue, defaults to the host and process id
+    :return: how many shards it copied
+    """
+    worker = worker or f"{socket.gethostname()}:{multiprocessing.current_process().pid}"
+    queue = ShardQueue(queue_path)
+    copy = queue.copy()
+    if copy is None:
+        logger.warning(f"no sharded copy queued in {queue_path}")
+        queue.close()
+        return 0
+
+    source_id, destination_id = copy
+    tree_store = TreeStore(google_drive.tree_store_path)
+    journal = CopyJournal(google_drive.copy_journal_path)
+    google_drive.journal = journal
+    copied = 0
+    try:
+        source_data = tree_store.load_tree(source_id, compact=True)
+        while (claimed := queue.claim(worker)) is not None:
+            shard, item_ids = claimed
+            logger.info(f"worker {worker} copying shard {shard} ({len(item_ids)} top level items)")
+            data = shard_data(source_data, item_ids)
+            try:
+                error = None
+                if not google_drive.copy_nested_items(data, destination_id):
+                    error = f"could not copy into {destination_id}"
+                elif missing := uncopied(journal, data, destination_id):
+                    error = f"{missing} folders and files were not copied"
+            except Exception as e:
+                error = str(e)
+            if error:
+                # leave it for the coordinator to report (and --resume to copy what is missing), and carry on with the
+                # next one
+                logger.error(f"worker {worker} failed to copy shard {shard}: {error}")
+                queue.finish(shard, error)
+                continue
+            queue.finish(shard)
+            copied += 1
+    finally:
+        google_drive.journal = None
+        journal.close()
+        tree_store.close()
+        queue.close()
+    logger.info(f"worker {worker} copied {copied} shards")
+    return copied
+
+
+def shard_process(config: dict, number: int) -> None:
+    """
+    the entry point of a shard worker process, started by copy_sharded or on its own (see main.py --shard-worker)
+    :param config: the loaded config.yaml
+    :param number: which worker this is, picking its credentials from shard_credentials
+    :return:
+    """
+    logging.basicConfig(
+        level=logging.INFO, format=f"%(asctime)s - shard worker {number} - [%(levelname)s] -  %(message)s"
+    )
+    token_files = config.get("shard_credentials") or ["token.json"]
+    # workers sharing a token file take turns refreshing it, see CredentialManager
+    credential_manager = get_credential_manager(config, token_files[number % len(token_files)])
+    if not credential_manager:
+        return
+    google_drive = GoogleDrive(credential_manager.credentials, config, credential_manager=credential_manager)
+    try:
+        run_shard_worker(google_drive, google_drive.shard_queue_path)
+    finally:
+        google_drive.close()
+
+
+def copy_sharded(google_drive: GoogleDrive, source_data: dict, destination_id: str, resume: bool = False) -> dict:
+    """
+    copies the source by queueing its shards and running shard_workers worker processes on them. more workers started
+    on the same machine with main.py --shard-worker help out too
+    :param google_drive: Google Drive resource for the coordinator
+    :param source_data: the Google Drive data for the source, already in the tree store
+    :param destination_id: the destination folder id, already created
+    :param resume: pick up an interrupted sharded copy of the same source and destination
+    :return: how many shards ended up pending, copying, done and failed
+    """
+    queue = ShardQueue(google_drive.shard_queue_path)
+    shards = make_shards(source_data, google_drive.shard_workers * SHARDS_PER_WORKER)
+    queue.plan(source_data["folder_id"], destination_id, shards, resume=resume)
+    logger.info(f"queued {len(shards)} shards for {google_drive.shard_workers} worker processes")
+
+    # spawned rather than forked, so workers don't inherit the coordinator's threads and open connections
+    context = multiprocessing.get_context("spawn")
+    processes = [
+        context.Process(target=shard_process, args=(google_drive.config, number))
+        for number in range(google_drive.shard_workers)
+    ]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
+
+    statuses = queue.statuses()
+    queue.close()
+    if set(statuses) != {"done"}:
+        logger.error(f"sharded copy did not finish: {statuses}, run it again with --resume")
+    return statuses
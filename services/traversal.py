@@ -0,0 +1,144 @@
+"""
+keeping a walk of the source tree to one listing per folder. Drive lets an item have more than one parent (legacy
+multi-parent items), which can even make a folder its own ancestor, so the walk keeps an index of every folder it has
+found and decides what to do with anything it finds again by the multi_parent_policy:
+
+- "copy_once": an item is only walked and copied under the first parent it is found in
+- "copy_per_parent": an item is copied under every parent it is in. folders are still only listed once, their listings
+  are kept and handed back again for each of their other parents (so the whole tree is held until the walk is done)
+- "link": an item is copied under the first parent it is found in, and gets a shortcut to the source item under the
+  rest
+
+a folder found inside one of its own descendants is a cycle, which is never walked into, whatever the policy
+"""
+import logging
+
+from services.metrics import Metrics
+
+MULTI_PARENT_POLICIES = ("copy_once", "copy_per_parent", "link")
+
+logger = logging.getLogger(__name__)
+
+
+def shortcut_object(item: dict) -> dict:
+    """
+    the drive data representation of a shortcut to a folder or file, copied as a new shortcut to the same target
+    :param item: the folder or file object being linked to
+    :return:
+    """
+    if "folder_id" in item:
+        return {"file_id": item["folder_id"], "file_name": item["folder_name"], "shortcut": True}
+    return {"file_id": item["file_id"], "file_name": item["file_name"], "shortcut": True}
+
+
+def copy_listing(listing: dict) -> dict:
+    """
+    a listing with its own folder objects, for another parent of a folder to build its part of the tree with
+    :param listing: the files and folders data for a folder
+    :return:
+    """
+    folders = [{**folder, "child_objects": {}, "nested_object_count": 0} for folder in listing["folders"]]
+    return {**listing, "folders": folders}
+
+
+def is_ancestor(folder_id: str, node: tuple) -> bool:
+    """
+    :param folder_id: the folder id
+    :param node: a place in the walk, as (folder id, parent node)
+    :return: whether the folder is the node's folder or one of its parents on the way to the source
+    """
+    while node is not None:
+        if node[0] == folder_id:
+            return True
+        node = node[1]
+    return False
+
+
+class VisitedIndex:
+    """
+    Every folder (and, unless the policy is copy_per_parent, every file) a walk of the source has found, which applies
+    the multi_parent_policy to each listing before it is handed on. A place in the walk is a node -- a folder id along
+    with the node of the parent it was found in, so we can tell when a folder turns up inside itself
+    :param root_id: the source folder id
+    :param policy: one of MULTI_PARENT_POLICIES
+    :param metrics: where to count the cycles and items with more than one parent found
+    """
+
+    def __init__(self, root_id: str, policy: str = "copy_once", metrics: Metrics = None):
+        if policy not in MULTI_PARENT_POLICIES:
+            raise ValueError(f"unknown multi_parent_policy {policy!r}, expected one of {MULTI_PARENT_POLICIES}")
+        self.policy = policy
+        self.metrics = metrics or Metrics()
+        # folder id -> the id of the first parent it was found in
+        self.folders = {root_id: None}
+        # folder id -> its listing, once it is in (copy_per_parent)
+        self.listings = {}
+        self.file_ids = set()
+        # folder id -> (folder object, node) of its other parents' copies, waiting on its listing (copy_per_parent)
+        self.waiting = {}
+
+    def listed(self, folder: dict | None, node: tuple, listing: dict | None) -> list:
+        """
+        takes a folder's listing as it comes back
+        :param folder: the folder object (None for the source folder)
+        :param node: where the folder is in the walk
+        :param listing: the files and folders data for the folder, or None if it couldn't be listed
+        :return: (folder object, node, listing) for the folder and any other parents' copies of it that were waiting on
+        the listing, each to go through `visit`
+        """
+        waiting = self.waiting.pop(node[0], [])
+        if not listing:
+            return []
+        if self.policy == "copy_per_parent":
+            self.listings[node[0]] = listing
+        return [(folder, node, listing)] + [(other, other_node, copy_listing(listing)) for other, other_node in waiting]
+
+    def visit(self, node: tuple, listing: dict) -> tuple[dict, list, list]:
+        """
+        applies the policy to the contents of a folder's listing, before the listing is handed on
+        :param node: where the folder is in the walk
+        :param listing: the files and folders data for the folder
+        :return: the listing to hand on, (folder object, node) of the folders in it that need listing, and (folder
+        object, node, listing) of folders in it that were already listed (copy_per_parent)
+        """
+        folders, files, to_list, listed = [], [], [], []
+        for folder in listing["folders"]:
+            folder_id = folder["folder_id"]
+            if folder_id not in self.folders:
+                self.folders[folder_id] = node[0]
+                folders.append(folder)
+                to_list.append((folder, (folder_id, node)))
+                continue
+            # only a folder we've already found can be one of this one's parents
+            if is_ancestor(folder_id, node):
+                logger.warning(f"folder {folder_id} is inside itself (in folder {node[0]}), not walking into it again")
+                self.metrics.count("cycles")
+                continue
+
+            # with copy_per_parent, everything in a folder found again is found again under the same parent
+            if self.folders[folder_id] != node[0]:
+                self.metrics.count("multi_parent_folders")
+            if self.policy == "copy_once":
+                logger.info(f"folder {folder_id} has more than one parent, only copying it under the first")
+            elif self.policy == "link":
+                files.append(shortcut_object(folder))
+            else:
+                folders.append(folder)
+                if folder_id in self.listings:
+                    listed.append((folder, (folder_id, node), copy_listing(self.listings[folder_id])))
+                else:
+                    self.waiting.setdefault(folder_id, []).append((folder, (folder_id, node)))
+
+        for file in listing["files"]:
+            if self.policy != "copy_per_parent":
+                if file["file_id"] in self.file_ids:
+                    self.metrics.count("multi_parent_files")
+                    if self.policy == "link":
+                        files.append(shortcut_object(file))
+                    continue
+                self.file_ids.add(file["file_id"])
+            files.append(file)
+
+        if len(folders) != len(listing["folders"]) or files != listing["files"]:
+            listing = {**listing, "folders": folders, "files": files, "local_object_count": len(folders) + len(files)}
+        return listing, to_list, listed
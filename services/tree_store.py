@@ -0,0 +1,310 @@
+"""
+an indexed SQLite cache of the source tree, replacing drive_data.json. listings are written as the traversal gets them,
+and trees are read back lazily -- a folder's contents are only loaded from disk when something asks for them
+"""
+import sqlite3
+import threading
+import time
+from collections import deque
+
+from services.compact_tree import CompactTree
+
+# bumped whenever the tables change. the store is only a cache, so a store with an older layout is emptied rather than
+# migrated
+SCHEMA_VERSION = 3
+# drive data file keys that are kept alongside each file when they are there (see FILE_METADATA_FIELDS)
+FILE_METADATA_KEYS = ("md5_checksum", "size", "modified_time")
+
+
+class _LazyFolder(dict):
+    """
+    a drive data folder object whose `child_objects` are loaded from the tree store the first time they are used
+    """
+
+    def __init__(self, store, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.store = store
+
+    def __missing__(self, key):
+        if key != "child_objects":
+            raise KeyError(key)
+        child_objects = self.store.load_listing(self["folder_id"])
+        self["child_objects"] = child_objects
+        return child_objects
+
+
+class TreeStore:
+    """
+    A SQLite store of folder listings. Every node is stored under its parent (clustered on parent id, so listing a
+    folder is one index range scan) with its name, whether it is a folder, for folders its nested object count and for
+    files whatever metadata was listed. Listings are stored per folder, so trees for overlapping sources share them.
+    Each fully walked source folder gets a row with when it was walked, its totals, its changes api page token and the
+    extra fields it was listed with.
+    :param path: where the store lives on disk
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.lock = threading.RLock()
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        if self.db.execute("PRAGMA user_version").fetchone()[0] != SCHEMA_VERSION:
+            self.db.executescript(
+                "DROP TABLE IF EXISTS nodes; DROP TABLE IF EXISTS listings; DROP TABLE IF EXISTS sources;"
+                f"PRAGMA user_version = {SCHEMA_VERSION};"
+            )
+        self.db.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS nodes (
+                parent_id TEXT NOT NULL,
+                position INTEGER NOT NULL,
+                id TEXT NOT NULL,
+                name TEXT NOT NULL,
+                is_folder INTEGER NOT NULL,
+                nested_object_count INTEGER NOT NULL DEFAULT 0,
+                md5_checksum TEXT,
+                size TEXT,
+                modified_time TEXT,
+                is_shortcut INTEGER NOT NULL DEFAULT 0,
+                PRIMARY KEY (parent_id, position)
+            ) WITHOUT ROWID;
+            CREATE INDEX IF NOT EXISTS nodes_id ON nodes (id);
+            CREATE TABLE IF NOT EXISTS listings (folder_id TEXT PRIMARY KEY, listed_at REAL NOT NULL);
+            CREATE TABLE IF NOT EXISTS sources (
+                source_id TEXT PRIMARY KEY,
+                walked_at REAL NOT NULL,
+                start_page_token TEXT,
+                total_nested_folders INTEGER NOT NULL,
+                total_nested_files INTEGER NOT NULL,
+                listing_fields TEXT NOT NULL DEFAULT '',
+                multi_parent_policy TEXT
+            );
+            """
+        )
+        self.db.commit()
+
+    def write_listing(self, listing: dict) -> None:
+        """
+        stores (or replaces) one folder's listing -- meant to be handed to the traversal as it goes
+        :param listing: the files and folders data for a folder, as get_files_and_folders returns it
+        :return:
+        """
+        rows = [
+            (listing["folder_id"], position, folder["folder_id"], folder["folder_name"], 1, 0, None, None, None, 0)
+            for position, folder in enumerate(listing["folders"])
+        ]
+        rows += [
+            (
+                listing["folder_id"],
+                len(rows) + position,
+                file["file_id"],
+                file["file_name"],
+                0,
+                0,
+                *(file.get(key) for key in FILE_METADATA_KEYS),
+                int(file.get("shortcut", False)),
+            )
+            for position, file in enumerate(listing["files"])
+        ]
+        with self.lock:
+            self.db.execute("DELETE FROM nodes WHERE parent_id = ?", (listing["folder_id"],))
+            self.db.executemany("INSERT INTO nodes VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", rows)
+            self.db.execute("INSERT OR REPLACE INTO listings VALUES (?, ?)", (listing["folder_id"], time.time()))
+            self.db.commit()
+
+    def finish_source(
+        self,
+        source_id: str,
+        start_page_token: str = None,
+        listing_fields: list = (),
+        multi_parent_policy: str = "copy_once",
+    ) -> tuple[int, int]:
+        """
+        marks a source folder as fully walked once all of its listings have been written, working out the nested object
+        count of every folder under it from what is stored (so nobody needs to hold the tree in memory to do it)
+        :param source_id: the source folder id
+        :param start_page_token: the changes api page token from before the walk
+        :param listing_fields: the extra file fields the source was listed with (ie GoogleDrive.listing_fields)
+        :param multi_parent_policy: the policy the source was walked with (ie GoogleDrive.multi_parent_policy)
+        :return: the total nested folders and files, like get_nested_objects
+        """
+        # every folder under the source, top down, along with how many folders/files are directly in each
+        order, children, local_counts = [source_id], {}, {}
+        with self.lock:
+            for folder_id in order:
+                rows = self.db.execute("SELECT id, is_folder FROM nodes WHERE parent_id = ?", (folder_id,)).fetchall()
+                children[folder_id] = [node_id for node_id, is_folder in rows if is_folder]
+                local_counts[folder_id] = (len(children[folder_id]), len(rows) - len(children[folder_id]))
+                # a folder with more than one parent only needs counting once
+                order.extend(node_id for node_id in children[folder_id] if node_id not in children)
+
+        # then count them bottom up
+        totals = {}
+        for folder_id in reversed(order):
+            total_folders, total_files = local_counts[folder_id]
+            for child in children[folder_id]:
+                total_folders += totals[child][0]
+                total_files += totals[child][1]
+            totals[folder_id] = (total_folders, total_files)
+
+        with self.lock:
+            self.db.executemany(
+                "UPDATE nodes SET nested_object_count = ? WHERE id = ? AND is_folder = 1",
+                ((sum(totals[folder_id]), folder_id) for folder_id in order[1:]),
+            )
+            self.db.execute(
+                "INSERT OR REPLACE INTO sources VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (
+                    source_id,
+                    time.time(),
+                    start_page_token,
+                    *totals[source_id],
+                    ",".join(listing_fields),
+                    multi_parent_policy,
+                ),
+            )
+            self.db.commit()
+        return totals[source_id]
+
+    def save_tree(self, drive_data: dict, listing_fields: list = (), multi_parent_policy: str = "copy_once") -> None:
+        """
+        stores a whole tree that was changed in memory (ie by an incremental sync)
+        :param drive_data: the Google Drive data for the source (with its `start_page_token`, if there is one)
+        :param listing_fields: the extra file fields the source was listed with
+        :param multi_parent_policy: the policy the source was walked with
+        :return:
+        """
+        stack = [drive_data]
+        while stack:
+            listing = stack.pop()
+            self.write_listing(listing)
+            stack.extend(folder["child_objects"] for folder in listing["folders"] if folder["child_objects"])
+        self.finish_source(
+            drive_data["folder_id"], drive_data.get("start_page_token"), listing_fields, multi_parent_policy
+        )
+
+    def get_source(
+        self, source_id: str, max_age: float = None, listing_fields: list = (), multi_parent_policy: str = None
+    ) -> dict | None:
+        """
+        checks the cache for a fully walked source folder
+        :param source_id: the source folder id
+        :param max_age: how old (in seconds) the walk is allowed to be, None for any age
+        :param listing_fields: extra file fields the walk needs to have been listed with
+        :param multi_parent_policy: the policy the walk needs to have been made with, None for any
+        :return: when it was walked, its page token, totals, listing fields and multi parent policy -- or None if we
+        don't have it (or it's too old, is missing fields or was walked with another policy)
+        """
+        with self.lock:
+            row = self.db.execute(
+                "SELECT walked_at, start_page_token, total_nested_folders, total_nested_files, listing_fields, "
+                "multi_parent_policy FROM sources WHERE source_id = ?",
+                (source_id,),
+            ).fetchone()
+        if not row or (max_age is not None and time.time() - row[0] > max_age):
+            return None
+        source = dict(zip(("walked_at", "start_page_token", "total_nested_folders", "total_nested_files"), row))
+        source["listing_fields"] = row[4].split(",") if row[4] else []
+        source["multi_parent_policy"] = row[5]
+        if not set(listing_fields) <= set(source["listing_fields"]):
+            return None
+        if multi_parent_policy and multi_parent_policy != source["multi_parent_policy"]:
+            return None
+        return source
+
+    def has_subtree(self, folder_id: str, max_age: float = None) -> bool:
+        """
+        checks whether a folder and every folder under it have been listed, ie as part of walking a source it is inside,
+        so the folder can be finished as a source of its own without listing any of it again
+        :param folder_id: the folder id
+        :param max_age: how old (in seconds) the listings are allowed to be, None for any age
+        :return:
+        """
+        oldest = 0 if max_age is None else time.time() - max_age
+        order, seen = [folder_id], {folder_id}
+        with self.lock:
+            for parent_id in order:
+                row = self.db.execute("SELECT listed_at FROM listings WHERE folder_id = ?", (parent_id,)).fetchone()
+                if not row or row[0] < oldest:
+                    return False
+                rows = self.db.execute(
+                    "SELECT id FROM nodes WHERE parent_id = ? AND is_folder = 1", (parent_id,)
+                ).fetchall()
+                order.extend(node_id for node_id, in rows if node_id not in seen)
+                seen.update(node_id for node_id, in rows)
+        return True
+
+    def load_listing(self, folder_id: str) -> dict:
+        """
+        loads one folder's listing, with its folders' contents left to be loaded lazily
+        :param folder_id: the folder id
+        :return: the files and folders data for the folder, or {} if it was never listed
+        """
+        with self.lock:
+            if not self.db.execute("SELECT 1 FROM listings WHERE folder_id = ?", (folder_id,)).fetchone():
+                return {}
+            rows = self.db.execute(
+                "SELECT id, name, is_folder, nested_object_count, is_shortcut, md5_checksum, size, modified_time "
+                "FROM nodes WHERE parent_id = ? ORDER BY position",
+                (folder_id,),
+            ).fetchall()
+        folders, files = [], []
+        for node_id, name, is_folder, nested_object_count, is_shortcut, *metadata in rows:
+            if is_folder:
+                folders.append(
+                    _LazyFolder(self, folder_id=node_id, folder_name=name, nested_object_count=nested_object_count)
+                )
+                continue
+            file = {"file_id": node_id, "file_name": name}
+            file.update((key, value) for key, value in zip(FILE_METADATA_KEYS, metadata) if value is not None)
+            if is_shortcut:
+                file["shortcut"] = True
+            files.append(file)
+        return {"folder_id": folder_id, "folders": folders, "files": files, "local_object_count": len(rows)}
+
+    def load_compact_tree(self, source_id: str) -> CompactTree:
+        """
+        loads a source folder's whole tree into a compact tree, folder by folder, with its nested object counts worked
+        out. a folder stored once but found under more than one parent (multi_parent_policy copy_per_parent) is loaded
+        under each of them
+        :param source_id: the source folder id
+        :return: the compact tree, with nothing listed if the source was never listed
+        """
+        tree = CompactTree(source_id)
+        pending = deque([source_id])
+        while pending:
+            listing = self.load_listing(pending.popleft())
+            if not listing:
+                continue
+            tree.add_listing(listing)
+            pending.extend(folder["folder_id"] for folder in listing["folders"])
+        tree.compute_counts()
+        return tree
+
+    def load_tree(self, source_id: str, lazy: bool = True, compact: bool = False) -> dict:
+        """
+        loads the drive data for a source folder, a drop in replacement for what get_nested_objects returns
+        :param source_id: the source folder id
+        :param lazy: leave folders' contents on disk until they are used, otherwise load the whole tree now
+        :param compact: load the whole tree into a compact tree now and build folders' contents from it as they are
+        used, so a copy holds the tree in a fraction of the memory and never reads the store again
+        :return: the Google Drive data (with its `start_page_token`, if there is one)
+        """
+        drive_data = self.load_compact_tree(source_id).drive_data() if compact else self.load_listing(source_id)
+        source = self.get_source(source_id)
+        if source and source["start_page_token"]:
+            drive_data["start_page_token"] = source["start_page_token"]
+        stack = [] if lazy or compact else [drive_data]
+        while stack:
+            listing = stack.pop()
+            listing["folders"] = [dict(folder, child_objects=folder["child_objects"]) for folder in listing["folders"]]
+            stack.extend(folder["child_objects"] for folder in listing["folders"] if folder["child_objects"])
+        return drive_data
+
+    def close(self) -> None:
+        """
+        closes the store's database
+        :return:
+        """
+        self.db.close()
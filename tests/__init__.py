@@ -0,0 +1,19 @@
+"""
+helpers shared by the tests that run against the fake drive
+"""
+from benchmarks.fake_drive import FakeDriveHttp
+
+# exact file names to compare copies with their sources, and a rate limit that never holds the fake drive back
+FAKE_CONFIG = {"copy_exact_filename": True, "rate_limit_qps": 10000, "rate_limit_max_qps": 10000}
+
+
+def shape(fake: FakeDriveHttp, folder_id: str) -> list:
+    """
+    the names and types of everything in a folder on the fake drive that isn't in the trash, all the way down, to
+    compare copies with
+    """
+    return sorted(
+        (child["name"], child["mimeType"], shape(fake, child["id"]))
+        for child in fake.children(folder_id)
+        if not child["trashed"]
+    )
@@ -0,0 +1,136 @@
+import json
+import os
+import tempfile
+from unittest import TestCase
+
+from benchmarks.fake_drive import FakeDriveHttp, build_tree
+from services import assessments
+from services.google_drive_helpers import GoogleDrive, TYPE_FOLDER
+from services.tree_store import TreeStore
+from tests import FAKE_CONFIG, shape
+
+
+class TestAssessments(TestCase):
+    def setup(self):
+        """
+        Run setup of commonly used objects / mocks / expectations
+        :return:
+        """
+        # the assessments write their reports relative to where they are run from
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        os.mkdir(os.path.join(self.directory.name, "reports"))
+        self.addCleanup(os.chdir, os.getcwd())
+        os.chdir(self.directory.name)
+
+        self.fake = FakeDriveHttp()
+        self.source_id = self.fake.add_folder("source")
+        build_tree(self.fake, self.source_id, depth=3, folders_per_folder=2, files_per_folder=2)
+        self.config = {
+            **FAKE_CONFIG,
+            "tree_store": os.path.join(self.directory.name, "drive_data.sqlite"),
+            "copy_journal": os.path.join(self.directory.name, "copy_journal.sqlite"),
+        }
+
+    def report(self, number):
+        with open(f"reports/assessment_{number}_report.json") as f:
+            return json.load(f)
+
+    def test_assessment_two(self):
+        # run setup
+        self.setup()
+
+        google_drive = GoogleDrive(None, {**self.config, "metrics_format": "json"}, http=self.fake)
+        assessments.assessment_two(google_drive, self.source_id)
+        # the walk's requests were written out next to the report, and then forgotten
+        with open("reports/assessment_2_metrics.json") as f:
+            self.assertEqual(15, json.load(f)["list_pages"])
+        self.assertEqual({}, google_drive.metrics.snapshot()["requests"])
+
+        # the counts added up as the walk went should match the finished tree's
+        drive_data, total_folders, total_files = google_drive.get_nested_objects_concurrent(self.source_id)
+        self.assertEqual(
+            {
+                "total_nested_files": total_files,
+                "total_nested_folders": total_folders,
+                "nested_object_counts_by_folder": {
+                    folder["folder_name"]: folder["nested_object_count"] for folder in drive_data["folders"]
+                },
+                "total_nested_object_count": total_files + total_folders,
+            },
+            self.report(2),
+        )
+        tree_store = TreeStore(self.config["tree_store"])
+        stored = tree_store.load_tree(self.source_id, lazy=False)
+        # along with where the changes api was at before the walk
+        self.assertTrue(stored.pop("start_page_token"))
+        self.assertEqual(drive_data, stored)
+        tree_store.close()
+
+    def test_assessment_two_from_tree_store(self):
+        # run setup
+        self.setup()
+
+        google_drive = GoogleDrive(None, {**self.config, "metrics_format": "json"}, http=self.fake)
+        assessments.assessment_two(google_drive, self.source_id)
+        report = self.report(2)
+
+        # a fresh enough stored tree is counted without listing anything
+        assessments.assessment_two(google_drive, self.source_id)
+        with open("reports/assessment_2_metrics.json") as f:
+            self.assertEqual(0, json.load(f)["list_pages"])
+        self.assertEqual(report, self.report(2))
+
+        # but not once it is too old
+        google_drive.tree_cache_max_age = -1
+        assessments.assessment_two(google_drive, self.source_id)
+        with open("reports/assessment_2_metrics.json") as f:
+            self.assertEqual(15, json.load(f)["list_pages"])
+        self.assertEqual(report, self.report(2))
+
+    def test_assessment_three_streaming(self):
+        # run setup
+        self.setup()
+
+        google_drive = GoogleDrive(None, {**self.config, "copy_engine": "streaming"}, http=self.fake)
+        assessments.assessment_three(google_drive, self.source_id)
+        copied, total_folders, total_files = google_drive.get_nested_objects_concurrent(
+            self.report(3)["copy_source_id"]
+        )
+        self.assertEqual((14, 30), (total_folders, total_files))
+
+        # and the tree was kept for next time
+        tree_store = TreeStore(self.config["tree_store"])
+        source = tree_store.get_source(self.source_id)
+        self.assertEqual((14, 30), (source["total_nested_folders"], source["total_nested_files"]))
+        tree_store.close()
+
+    def test_assessment_three_incremental(self):
+        # run setup
+        self.setup()
+
+        google_drive = GoogleDrive(None, self.config, http=self.fake)
+        assessments.assessment_three(google_drive, self.source_id)
+        copy_id = self.report(3)["copy_source_id"]
+
+        # rename one top level folder and move the other into it
+        first, second = [
+            child["id"] for child in self.fake.children(self.source_id) if child["mimeType"] == TYPE_FOLDER
+        ][:2]
+        self.fake.update_file(first, name="renamed")
+        self.fake.update_file(second, add_parents=[first], remove_parents=[self.source_id])
+        calls = self.fake.stats["calls"]
+        assessments.assessment_three(google_drive, self.source_id, incremental=True)
+        self.assertEqual(copy_id, self.report(3)["copy_source_id"])
+        self.assertEqual(shape(self.fake, self.source_id), shape(self.fake, copy_id))
+        # the renamed folder's copy was renamed rather than copied again, and the moved folder's old copy was trashed
+        # rather than left behind: 7 folders and 14 files copied into the new place, plus the changes, the rename and
+        # the trash
+        self.assertEqual(7 + 14 + 3, self.fake.stats["calls"] - calls)
+
+        # without the changes api, it falls back to copying whatever isn't copied yet
+        google_drive.get_changes = lambda page_token: ([], None)
+        calls = self.fake.stats["calls"]
+        assessments.assessment_three(google_drive, self.source_id, incremental=True)
+        self.assertEqual(copy_id, self.report(3)["copy_source_id"])
+        self.assertEqual(0, self.fake.stats["calls"] - calls)
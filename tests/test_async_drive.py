@@ -0,0 +1,124 @@
+import asyncio
+import time
+from unittest import TestCase
+
+from benchmarks.fake_drive import AsyncFakeDriveHttp, FakeDriveHttp, build_tree
+from services.async_drive import AsyncGoogleDrive
+from services.google_drive_helpers import GoogleDrive
+from tests import FAKE_CONFIG
+
+
+class TestAsyncDrive(TestCase):
+    def setup(self, **fake_options):
+        """
+        Run setup of commonly used objects / mocks / expectations
+        :return:
+        """
+        self.fake = FakeDriveHttp(**fake_options)
+        self.source_id = self.fake.add_folder("source")
+        build_tree(self.fake, self.source_id, depth=2, folders_per_folder=10, files_per_folder=5)
+
+    def run_async(self, coroutine_function, config: dict = None):
+        # a fresh client on a fresh event loop, closed once it's done
+        async def run():
+            google_drive = AsyncGoogleDrive(None, {**FAKE_CONFIG, **(config or {})}, AsyncFakeDriveHttp(self.fake))
+            try:
+                return await coroutine_function(google_drive)
+            finally:
+                await google_drive.close()
+
+        return asyncio.run(run())
+
+    def test_get_nested_objects(self):
+        # run setup
+        self.setup()
+
+        expected = GoogleDrive(None, FAKE_CONFIG, http=self.fake).get_nested_objects(self.source_id)
+        self.assertEqual(expected, self.run_async(lambda google_drive: google_drive.get_nested_objects(self.source_id)))
+
+    def test_copy_nested_items(self):
+        # run setup, with requests that take a while
+        self.setup(latency=0.02)
+
+        async def walk_and_copy(google_drive):
+            drive_data, total_folders, total_files = await google_drive.get_nested_objects(self.source_id)
+            return total_folders + total_files, await google_drive.copy_nested_items(drive_data)
+
+        started = time.perf_counter()
+        total, destination_id = self.run_async(walk_and_copy)
+        # 111 listings and 666 copies, with 20ms each, only take as long as the longest chain of them
+        self.assertLess(time.perf_counter() - started, 2)
+        self.fake.latency = 0
+        _, total_folders, total_files = GoogleDrive(None, FAKE_CONFIG, http=self.fake).get_nested_objects(
+            destination_id
+        )
+        self.assertEqual(total, total_folders + total_files)
+
+    def test_concurrency_limit(self):
+        # run setup
+        self.setup(latency=0.01)
+
+        in_flight, most_in_flight = 0, 0
+        transport = AsyncFakeDriveHttp(self.fake)
+        send = transport.request
+
+        async def counting_request(*args):
+            nonlocal in_flight, most_in_flight
+            in_flight += 1
+            most_in_flight = max(most_in_flight, in_flight)
+            try:
+                return await send(*args)
+            finally:
+                in_flight -= 1
+
+        transport.request = counting_request
+
+        async def walk(google_drive):
+            google_drive.transport = transport
+            return await google_drive.get_nested_objects(self.source_id)
+
+        self.run_async(walk, {"async_concurrency": 4})
+        self.assertEqual(4, most_in_flight)
+
+    def test_async_copy_engine(self):
+        # run setup
+        self.setup()
+
+        config = {**FAKE_CONFIG, "copy_engine": "async"}
+        google_drive = GoogleDrive(None, config, http=self.fake, async_transport=AsyncFakeDriveHttp(self.fake))
+        drive_data, total_folders, total_files = google_drive.get_nested_objects_concurrent(self.source_id)
+        destination_id = google_drive.copy_nested_items(drive_data)
+        _, copied_folders, copied_files = google_drive.get_nested_objects_concurrent(destination_id)
+        self.assertEqual((total_folders, total_files), (copied_folders, copied_files))
+        # the copies went through the GoogleDrive's metrics
+        self.assertEqual(total_files, google_drive.metrics.snapshot()["requests"]["files.copy"]["count"])
+
+    def test_partitioned_listing(self):
+        # a folder of 200 files, ten a page, that Drive gives up on past 30 matches
+        self.fake = FakeDriveHttp(max_page_size=10, incomplete_search_over=30)
+        self.source_id = self.fake.add_folder("source")
+        for index in range(200):
+            self.fake.add_file(f"file {index}", self.source_id)
+        expected = sorted(item["id"] for item in self.fake.children(self.source_id))
+
+        partitioned = []
+
+        async def listed_ids(google_drive):
+            list_partitioned = google_drive.list_partitioned
+
+            async def spy(folder_id):
+                partitioned.append(folder_id)
+                return await list_partitioned(folder_id)
+
+            google_drive.list_partitioned = spy
+            listing = await google_drive.get_files_and_folders(self.source_id)
+            return sorted(file["file_id"] for file in listing["files"])
+
+        # incomplete listings are partitioned until they are complete, and so are folders past partition_after_pages
+        self.assertEqual(expected, self.run_async(listed_ids, {"listing_partitions": 4}))
+        self.fake.incomplete_search_over = None
+        self.assertEqual(expected, self.run_async(listed_ids, {"partition_after_pages": 2, "listing_partitions": 4}))
+        self.assertEqual([self.source_id, self.source_id], partitioned)
+        # and without partitioning, a page at a time
+        self.assertEqual(expected, self.run_async(listed_ids, {"partition_after_pages": 0}))
+        self.assertEqual(2, len(partitioned))
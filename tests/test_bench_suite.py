@@ -0,0 +1,28 @@
+from unittest import TestCase
+
+from benchmarks.bench_suite import COPY_ENGINES, WALK_ENGINES, run_case
+
+
+class TestBenchSuite(TestCase):
+    def test_every_engine_completes(self):
+        for engine in WALK_ENGINES:
+            result = run_case("deep", "walk", engine)
+            self.assertTrue(result["ok"], engine)
+            self.assertEqual(64, result["items"])
+        for engine in COPY_ENGINES:
+            result = run_case("deep", "copy", engine)
+            self.assertTrue(result["ok"], engine)
+            # one request per item, plus getting the source folder and listing it as well when streaming
+            self.assertEqual(66 if engine != "streaming" else 79, result["calls"], engine)
+
+    def test_fake_page_size(self):
+        # five folders of up to 250 files, a hundred a page
+        result = run_case("wide", "walk", "concurrent", max_page_size=100)
+        self.assertEqual(15, result["list_pages"])
+        result = run_case("wide", "walk", "concurrent", max_page_size=1000)
+        self.assertEqual(5, result["list_pages"])
+
+    def test_fake_latency(self):
+        result = run_case("deep", "walk", "recursive", latency=0.01)
+        # a chain of folders is listed one after another
+        self.assertGreaterEqual(result["seconds"], 13 * 0.01)
@@ -0,0 +1,78 @@
+from unittest import TestCase
+
+from benchmarks.fake_drive import FakeDriveHttp, build_tree
+from services.compact_tree import CompactTree, walk_compact_tree
+from services.google_drive_helpers import GoogleDrive
+from tests import FAKE_CONFIG
+
+
+class TestCompactTree(TestCase):
+    def setup(self):
+        """
+        Run setup of commonly used objects / mocks / expectations
+        :return:
+        """
+        self.fake = FakeDriveHttp()
+        self.source_id = self.fake.add_folder("source")
+        build_tree(self.fake, self.source_id, depth=3, folders_per_folder=2, files_per_folder=3)
+        self.google_drive = GoogleDrive(None, FAKE_CONFIG, http=self.fake)
+        self.drive_data, self.total_folders, self.total_files = self.google_drive.get_nested_objects_concurrent(
+            self.source_id
+        )
+
+    def test_round_trip(self):
+        # run setup
+        self.setup()
+
+        tree = CompactTree.from_drive_data(self.drive_data)
+        self.assertEqual(1 + self.total_folders + self.total_files, len(tree))
+        self.assertEqual((self.total_folders, self.total_files), tree.totals())
+        self.assertEqual(self.drive_data, tree.to_drive_data())
+
+    def test_walk_compact_tree(self):
+        # run setup
+        self.setup()
+
+        listings = []
+        tree = walk_compact_tree(self.google_drive, self.source_id, on_listing=listings.append)
+        self.assertEqual(1 + self.total_folders, len(listings))
+        self.assertEqual((self.total_folders, self.total_files), tree.totals())
+        self.assertEqual(self.drive_data, tree.to_drive_data())
+
+        # the iterator api sees the same tree
+        top_level = [node for node in tree.children() if tree.is_folder[node]]
+        self.assertEqual(
+            [(folder["folder_name"], folder["nested_object_count"]) for folder in self.drive_data["folders"]],
+            [(tree.node_name(node), tree.nested_object_count[node]) for node in top_level],
+        )
+        self.assertEqual(len(tree) - 1, sum(1 for _ in tree.walk()))
+        self.assertEqual(self.total_folders, len(list(tree.folder_counts())))
+
+    def test_drive_data(self):
+        # run setup
+        self.setup()
+
+        tree = CompactTree.from_drive_data(self.drive_data)
+        drive_data = tree.drive_data()
+        folder = drive_data["folders"][0]
+        expected = self.drive_data["folders"][0]
+        self.assertEqual(expected["nested_object_count"], folder["nested_object_count"])
+        self.assertEqual(expected["child_objects"]["files"], folder["child_objects"]["files"])
+        # a folder's contents are built each time they are used rather than kept
+        self.assertNotIn("child_objects", folder)
+
+        # and the copy engines copy from it like any other drive data
+        destination_id = self.google_drive.copy_nested_items(drive_data)
+        _, total_folders, total_files = self.google_drive.get_nested_objects_concurrent(destination_id)
+        self.assertEqual((self.total_folders, self.total_files), (total_folders, total_files))
+
+    def test_file_metadata(self):
+        # run setup
+        self.setup()
+
+        files = self.drive_data["folders"][0]["child_objects"]["files"]
+        files[0].update(md5_checksum="abc", size="12", modified_time="2024-01-01T00:00:00.000Z")
+        files[1].update(shortcut=True)
+        tree = CompactTree.from_drive_data(self.drive_data)
+        self.assertEqual(self.drive_data, tree.to_drive_data())
+        self.assertEqual(files, tree.drive_data()["folders"][0]["child_objects"]["files"])
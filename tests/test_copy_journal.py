@@ -0,0 +1,79 @@
+import os
+import tempfile
+from unittest import TestCase
+
+from benchmarks.fake_drive import FakeDriveHttp, build_tree
+from services.copy_journal import CopyJournal
+from services.google_drive_helpers import GoogleDrive
+from tests import FAKE_CONFIG
+
+
+class TestCopyJournal(TestCase):
+    def setup(self):
+        """
+        Run setup of commonly used objects / mocks / expectations
+        :return:
+        """
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        self.journal_path = os.path.join(self.directory.name, "copy_journal.sqlite")
+
+    def test_journal_survives_reopening(self):
+        # run setup
+        self.setup()
+
+        journal = CopyJournal(self.journal_path)
+        journal.record("source-root", None, "destination-root", "root")
+        journal.record("source-file", "destination-root", "destination-file", "file")
+        journal.close()
+
+        journal = CopyJournal(self.journal_path)
+        self.assertEqual("destination-root", journal.get("source-root"))
+        self.assertEqual("destination-file", journal.get("source-file", "destination-root"))
+        # the same file copied somewhere else is a different entry
+        self.assertIsNone(journal.get("source-file", "somewhere-else"))
+
+        journal.forget(["source-file"])
+        self.assertIsNone(journal.get("source-file", "destination-root"))
+        journal.clear()
+        self.assertEqual({}, journal.entries)
+        journal.close()
+
+    def test_resume_interrupted_copy(self):
+        # run setup
+        self.setup()
+
+        fake = FakeDriveHttp()
+        source_id = fake.add_folder("source")
+        build_tree(fake, source_id, depth=2, folders_per_folder=2, files_per_folder=3)
+        google_drive = GoogleDrive(None, FAKE_CONFIG, http=fake)
+        drive_data, total_folders, total_files = google_drive.get_nested_objects_concurrent(source_id)
+
+        # kill the copy part of the way through
+        copy_file = google_drive.copy_file
+        copies = []
+
+        def interrupted_copy_file(*args, **kwargs):
+            if len(copies) == 8:
+                raise KeyboardInterrupt
+            copies.append(args)
+            return copy_file(*args, **kwargs)
+
+        google_drive.copy_file = interrupted_copy_file
+        google_drive.journal = CopyJournal(self.journal_path)
+        with self.assertRaises(KeyboardInterrupt):
+            google_drive.copy_nested_items(drive_data)
+        google_drive.journal.close()
+
+        # then pick it back up from the journal
+        google_drive = GoogleDrive(None, {**FAKE_CONFIG, "copy_engine": "parallel"}, http=fake)
+        google_drive.journal = CopyJournal(self.journal_path)
+        destination_id = google_drive.copy_nested_items(drive_data)
+        google_drive.journal.close()
+
+        # there is exactly one copy of everything, in the destination the first run created -- so just the source
+        # folder and its one copy
+        self.assertEqual(2, len([resource for resource in fake.files.values() if resource["name"] == "source"]))
+        self.assertEqual(
+            (total_folders, total_files), google_drive.get_nested_objects_concurrent(destination_id)[1:]
+        )
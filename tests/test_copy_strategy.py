@@ -0,0 +1,77 @@
+from unittest import TestCase
+
+from benchmarks.fake_drive import AsyncFakeDriveHttp, FakeDriveHttp, build_tree
+from services.google_drive_helpers import GoogleDrive, TYPE_FOLDER, TYPE_SHORTCUT, links_file
+from tests import FAKE_CONFIG
+
+
+class TestCopyStrategy(TestCase):
+    def setup(self):
+        """
+        Run setup of commonly used objects / mocks / expectations
+        :return:
+        """
+        # a tree of Google Sheets (no checksum), plus a small and a large uploaded file in every folder
+        self.fake = FakeDriveHttp()
+        self.source_id = self.fake.add_folder("source")
+        build_tree(self.fake, self.source_id, depth=2, folders_per_folder=2, files_per_folder=2)
+        for folder_id in [self.source_id] + [item["id"] for item in self.fake.files.values() if item["parents"]]:
+            if self.fake.files[folder_id]["mimeType"] != TYPE_FOLDER:
+                continue
+            self.fake.add_file("notes.txt", folder_id, md5Checksum="abc", size="10")
+            self.fake.add_file("video.mp4", folder_id, "video/mp4", md5Checksum="def", size=str(10 * 1024 * 1024))
+
+    def copied(self, copy_engine: str, copy_strategy: str) -> dict:
+        # the name of every file in the copy -> whether it is a shortcut to the source file of the same name
+        config = {
+            **FAKE_CONFIG,
+            "copy_engine": copy_engine,
+            "copy_strategy": copy_strategy,
+            "shortcut_min_size": 1024 * 1024,
+        }
+        google_drive = GoogleDrive(None, config, http=self.fake, async_transport=AsyncFakeDriveHttp(self.fake))
+        drive_data, _, _ = google_drive.get_nested_objects_concurrent(self.source_id)
+        destination_id = google_drive.copy_nested_items(drive_data)
+
+        linked = {}
+        stack = [(self.source_id, destination_id, "")]
+        while stack:
+            source_id, copy_id, path = stack.pop()
+            sources = {child["name"]: child for child in self.fake.children(source_id)}
+            for child in self.fake.children(copy_id):
+                source = sources[child["name"]]
+                if child["mimeType"] == TYPE_FOLDER:
+                    stack.append((source["id"], child["id"], f"{path}{child['name']}/"))
+                    continue
+                is_shortcut = child["mimeType"] == TYPE_SHORTCUT
+                if is_shortcut:
+                    self.assertEqual(source["id"], child["shortcutDetails"]["targetId"])
+                linked[path + child["name"]] = is_shortcut
+        return linked
+
+    def test_links_file(self):
+        sheet = {"file_id": "a", "file_name": "a", "size": "20000"}
+        video = {"file_id": "b", "file_name": "b", "md5_checksum": "abc", "size": "20000"}
+        self.assertFalse(links_file(video, "full", 100))
+        self.assertTrue(links_file(sheet, "shortcut", 100))
+        self.assertTrue(links_file(video, "hybrid", 100))
+        self.assertFalse(links_file(video, "hybrid", 100000))
+        self.assertFalse(links_file(sheet, "hybrid", 100))
+        # a shortcut from the multi_parent_policy "link" is always one
+        self.assertTrue(links_file({**sheet, "shortcut": True}, "full", 100))
+
+    def test_copy_strategies(self):
+        # run setup
+        self.setup()
+
+        for copy_engine in ("sequential", "batched", "parallel", "async"):
+            full = self.copied(copy_engine, "full")
+            self.assertEqual(7 * 4, len(full))
+            self.assertFalse(any(full.values()))
+            shortcut = self.copied(copy_engine, "shortcut")
+            self.assertEqual(full.keys(), shortcut.keys())
+            self.assertTrue(all(shortcut.values()))
+            # only the videos are linked
+            hybrid = self.copied(copy_engine, "hybrid")
+            self.assertEqual(full.keys(), hybrid.keys())
+            self.assertEqual({name: name.endswith("video.mp4") for name in full}, hybrid)
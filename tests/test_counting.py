@@ -0,0 +1,105 @@
+import json
+import os
+import tempfile
+from unittest import TestCase
+from unittest.mock import patch
+
+import httplib2
+from googleapiclient.errors import HttpError
+
+from benchmarks.fake_drive import FakeDriveHttp, build_tree
+from services import assessments
+from services.counting import FolderCounts, count_tree
+from services.google_drive_helpers import GoogleDrive, TYPE_FOLDER
+from tests import FAKE_CONFIG
+
+
+class TestCounting(TestCase):
+    def setup(self):
+        """
+        Run setup of commonly used objects / mocks / expectations
+        :return:
+        """
+        # the assessments write their reports relative to where they are run from
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        os.mkdir(os.path.join(self.directory.name, "reports"))
+        self.addCleanup(os.chdir, os.getcwd())
+        os.chdir(self.directory.name)
+
+        # a tree with a file in two of its folders, and a folder inside itself
+        self.fake = FakeDriveHttp()
+        self.source_id = self.fake.add_folder("source")
+        build_tree(self.fake, self.source_id, depth=3, folders_per_folder=3, files_per_folder=2)
+        children = self.fake.children(self.source_id)
+        first, second = [item["id"] for item in children if item["mimeType"] == TYPE_FOLDER][:2]
+        shared_file = self.fake.add_file("shared file", first)
+        self.fake.update_file(shared_file, add_parents=[second])
+        self.fake.update_file(first, add_parents=[self.fake.add_folder("loop", first)])
+        self.config = {
+            **FAKE_CONFIG,
+            "listing_batch_size": 50,
+            "tree_store": os.path.join(self.directory.name, "drive_data.sqlite"),
+        }
+
+    def reports(self, count_engine: str) -> list:
+        google_drive = GoogleDrive(None, {**self.config, "count_engine": count_engine}, http=self.fake)
+        assessments.assessment_one(google_drive, self.source_id)
+        assessments.assessment_two(google_drive, self.source_id)
+        reports = []
+        for number in (1, 2):
+            with open(f"reports/assessment_{number}_report.json") as f:
+                reports.append(json.load(f))
+        return reports
+
+    def test_same_reports(self):
+        # run setup
+        self.setup()
+
+        listed = self.reports("listing")
+        pages_before = self.fake.stats["list_pages"]
+        counted = self.reports("counting")
+        self.assertEqual(listed, counted)
+        self.assertEqual(39 + 80 + 2, counted[1]["total_nested_object_count"])
+        # the root for each assessment, then the 41 folders under it in batches rather than one by one
+        self.assertLess(self.fake.stats["list_pages"] - pages_before, 1 + 1 + 10)
+
+    def test_folder_counts(self):
+        counts = FolderCounts("root")
+        folder = {"mimeType": TYPE_FOLDER, "parents": ["root"]}
+        self.assertEqual(["a", "b"], counts.add_listing("root", [
+            {"id": "a", "name": "a", **folder},
+            {"id": "b", "name": "b", **folder},
+            {"id": "f", "mimeType": "text/plain", "parents": ["root", "a"]},
+        ]))
+        self.assertEqual(["c"], counts.add_listing("a", [
+            {"id": "c", "mimeType": TYPE_FOLDER, "parents": ["a"]},
+            {"id": "f", "mimeType": "text/plain", "parents": ["root", "a"]},
+            {"id": "g", "mimeType": "text/plain", "parents": ["a"]},
+        ]))
+        # root is inside c, which is never counted again
+        self.assertEqual([], counts.add_listing("c", [{"id": "root", "mimeType": TYPE_FOLDER, "parents": ["c"]}]))
+        self.assertEqual((3, 2), counts.totals())
+        self.assertEqual([5, 2, 0, 0], list(counts.nested_counts()))
+        self.assertEqual([("a", 1), ("b", 2)], counts.top_level)
+
+    def test_partitioned_folder(self):
+        # Drive gives up on anything matching more than 30 files, and a file is in the source and the folder too big
+        # to list in one go
+        fake = FakeDriveHttp(incomplete_search_over=30)
+        source_id = fake.add_folder("source")
+        big_id = fake.add_folder("big", source_id)
+        for index in range(40):
+            fake.add_file(f"file {index}", big_id)
+        shared_file = fake.add_file("shared file", source_id)
+        fake.update_file(shared_file, add_parents=[big_id])
+
+        google_drive = GoogleDrive(None, {**FAKE_CONFIG, "listing_partitions": 4}, http=fake)
+        counts = count_tree(google_drive, source_id)
+        # the shared file is only counted under the source
+        self.assertEqual((1, 41), counts.totals())
+
+        # and a folder whose partitions can't be listed is skipped, rather than failing the whole count
+        error = HttpError(httplib2.Response({"status": 500}), b"{}")
+        with patch.object(google_drive, "list_partitioned", side_effect=error):
+            self.assertEqual((1, 1), count_tree(google_drive, source_id).totals())
@@ -0,0 +1,142 @@
+import datetime
+import json
+import os
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from unittest import TestCase
+from unittest.mock import Mock
+
+import httplib2
+from google.oauth2.credentials import Credentials
+
+from services.credentials import CredentialManager, read_token, token_lock_path, utcnow, write_token
+from services.http_pool import HttpPool
+
+
+class FakeCredentials(Credentials):
+    """
+    user credentials that hand out a new token, lasting `lifetime` seconds, instead of asking Google for one
+    """
+
+    def __init__(self, token: str, lifetime: float):
+        super().__init__(
+            token,
+            refresh_token="refresh",
+            token_uri="https://oauth2.googleapis.com/token",
+            client_id="client",
+            client_secret="secret",
+            expiry=utcnow() + datetime.timedelta(seconds=lifetime),
+        )
+        self.lifetime = lifetime
+        self.refreshes = 0
+
+    def refresh(self, request):
+        # slow enough for other threads to pile up behind it
+        time.sleep(0.05)
+        self.refreshes += 1
+        self.token = f"token {self.refreshes}"
+        self.expiry = utcnow() + datetime.timedelta(seconds=self.lifetime)
+
+
+class TestCredentialManager(TestCase):
+    def setup(self):
+        """
+        Run setup of commonly used objects / mocks / expectations
+        :return:
+        """
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        self.token_path = os.path.join(self.directory.name, "token.json")
+
+    def test_refresh_once(self):
+        # run setup
+        self.setup()
+
+        credentials = FakeCredentials("token 0", 3600)
+        manager = CredentialManager(credentials, self.token_path)
+        # every thread finds the same token rejected at once
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            refreshed = list(executor.map(manager.refresh, ["token 0"] * 8))
+        self.assertEqual(1, credentials.refreshes)
+        self.assertEqual(1, sum(refreshed))
+        # and the new token is saved for next time
+        self.assertEqual("token 1", read_token(self.token_path)[0])
+        self.assertEqual([], [name for name in os.listdir(self.directory.name) if name.startswith(".token-")])
+
+    def test_background_refresh(self):
+        # run setup
+        self.setup()
+
+        credentials = FakeCredentials("token 0", 1.5)
+        manager = CredentialManager(credentials, self.token_path, refresh_margin=1)
+        manager.start()
+        try:
+            # refreshed a second before each token expires, so it is never found expired
+            deadline = time.monotonic() + 2
+            while time.monotonic() < deadline:
+                self.assertGreater(credentials.expiry, utcnow())
+                time.sleep(0.05)
+        finally:
+            manager.stop()
+        self.assertGreaterEqual(credentials.refreshes, 2)
+        self.assertEqual(credentials.token, read_token(self.token_path)[0])
+
+    def test_token_shared_between_processes(self):
+        # run setup
+        self.setup()
+
+        # two processes on the one token file
+        first, second = FakeCredentials("token 0", 3600), FakeCredentials("token 0", 3600)
+        write_token(first, self.token_path)
+        self.assertTrue(CredentialManager(first, self.token_path).refresh("token 0"))
+
+        # the second finds the token already refreshed, and takes it instead of refreshing again
+        manager = CredentialManager(second, self.token_path)
+        self.assertFalse(manager.refresh("token 0"))
+        self.assertEqual(0, second.refreshes)
+        self.assertEqual("token 1", second.token)
+        self.assertEqual({"refreshes": 0, "adopted": 1, "failures": 0}, manager.counters)
+        # the lock they took turns with is kept out of the way of the token
+        self.assertEqual(["token.json"], os.listdir(self.directory.name))
+        self.assertEqual(token_lock_path(self.token_path), token_lock_path(os.path.relpath(self.token_path)))
+
+    def test_write_token(self):
+        # run setup
+        self.setup()
+
+        credentials = FakeCredentials("token 0", 3600)
+        write_token(credentials, self.token_path)
+        with open(self.token_path) as token:
+            self.assertEqual("refresh", json.load(token)["refresh_token"])
+        token, expiry = read_token(self.token_path)
+        self.assertEqual("token 0", token)
+        self.assertLess(abs((expiry - credentials.expiry).total_seconds()), 1)
+        self.assertIsNone(read_token(os.path.join(self.directory.name, "missing.json")))
+
+    def test_threads_share_refresh_with_pool(self):
+        # run setup
+        self.setup()
+
+        credentials = FakeCredentials("token 0", 3600)
+        manager = CredentialManager(credentials)
+
+        def factory():
+            http = Mock()
+            # the first token is rejected, the refreshed one works
+            http.request.side_effect = lambda *args, **kwargs: (
+                httplib2.Response({"status": 401 if credentials.token == "token 0" else 200}),
+                b"{}",
+            )
+            return http
+
+        pool = HttpPool(credentials, size=4, factory=factory, credential_manager=manager)
+        uri = "https://www.googleapis.com/drive/v3/files"
+        threads = [threading.Thread(target=pool.request, args=(uri,)) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(1, credentials.refreshes)
+        self.assertEqual(1, pool.counters["refreshes"])
@@ -0,0 +1,91 @@
+import os
+import tempfile
+from unittest import TestCase
+
+from benchmarks.fake_drive import FakeDriveHttp, build_tree
+from services.copy_journal import CopyJournal
+from services.diff_copy import is_unchanged, prepare_diff_copy
+from services.google_drive_helpers import GoogleDrive
+from tests import FAKE_CONFIG
+
+DIFF_COPY_CONFIG = {**FAKE_CONFIG, "diff_copy": True}
+
+
+class TestDiffCopy(TestCase):
+    def setup(self):
+        """
+        Run setup of commonly used objects / mocks / expectations
+        :return:
+        """
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        self.journal = CopyJournal(os.path.join(self.directory.name, "copy_journal.sqlite"))
+        self.addCleanup(self.journal.close)
+
+        # a tree of Google Sheets (no checksum), plus an uploaded file with one
+        self.fake = FakeDriveHttp()
+        self.source_id = self.fake.add_folder("source")
+        build_tree(self.fake, self.source_id, depth=2, folders_per_folder=2, files_per_folder=2)
+        self.uploaded = self.fake.add_file("report.pdf", self.source_id, "application/pdf", md5Checksum="abc", size="3")
+        self.google_drive = GoogleDrive(None, DIFF_COPY_CONFIG, http=self.fake)
+        self.google_drive.journal = self.journal
+
+        # an earlier copy to diff against
+        drive_data, _, _ = self.google_drive.get_nested_objects_concurrent(self.source_id)
+        self.destination_id = self.google_drive.copy_nested_items(drive_data)
+        self.journal.clear()
+
+    def live_names(self, folder_id):
+        return sorted(child["name"] for child in self.fake.children(folder_id) if not child["trashed"])
+
+    def test_is_unchanged(self):
+        self.assertTrue(is_unchanged({"md5_checksum": "a", "size": "1"}, {"md5_checksum": "a", "size": "1"}))
+        self.assertFalse(is_unchanged({"md5_checksum": "a", "size": "1"}, {"md5_checksum": "b", "size": "1"}))
+        self.assertTrue(is_unchanged({"modified_time": "t"}, {"modified_time": "t"}))
+        self.assertFalse(is_unchanged({"modified_time": "t"}, {"modified_time": "later"}))
+        # nothing to go on means copying again
+        self.assertFalse(is_unchanged({}, {}))
+
+    def test_diff_copy(self):
+        # run setup
+        self.setup()
+
+        # change one file, add another, leave everything else alone
+        self.fake.update_file(self.uploaded, md5Checksum="def")
+        self.fake.add_file("new.txt", self.source_id, md5Checksum="123", size="1")
+        drive_data, _, _ = self.google_drive.get_nested_objects_concurrent(self.source_id)
+
+        prepare_diff_copy(self.google_drive, drive_data, self.destination_id, self.journal)
+        calls = self.fake.stats["calls"]
+        self.assertEqual(self.destination_id, self.google_drive.copy_nested_items(drive_data, self.destination_id))
+
+        # only the changed and new files were copied, into the existing folders
+        self.assertEqual(2, self.fake.stats["calls"] - calls)
+        self.assertEqual(self.live_names(self.source_id), self.live_names(self.destination_id))
+        copies = [child for child in self.fake.children(self.destination_id) if child["name"] == "report.pdf"]
+        self.assertEqual([(True, "abc"), (False, "def")], [(copy["trashed"], copy["md5Checksum"]) for copy in copies])
+
+        # and a second diff finds nothing to do
+        self.journal.clear()
+        drive_data, _, _ = self.google_drive.get_nested_objects_concurrent(self.source_id)
+        prepare_diff_copy(self.google_drive, drive_data, self.destination_id, self.journal)
+        calls = self.fake.stats["calls"]
+        self.google_drive.copy_nested_items(drive_data, self.destination_id)
+        self.assertEqual(0, self.fake.stats["calls"] - calls)
+
+    def test_diff_copy_shortcuts(self):
+        # run setup
+        self.setup()
+
+        google_drive = GoogleDrive(None, {**DIFF_COPY_CONFIG, "copy_strategy": "shortcut"}, http=self.fake)
+        google_drive.journal = self.journal
+        drive_data, _, _ = google_drive.get_nested_objects_concurrent(self.source_id)
+        destination_id = google_drive.copy_nested_items(drive_data)
+        self.journal.clear()
+
+        # the shortcuts already in the destination are up to date, even though they have no checksum or size
+        prepare_diff_copy(google_drive, drive_data, destination_id, self.journal)
+        calls = self.fake.stats["calls"]
+        google_drive.copy_nested_items(drive_data, destination_id)
+        self.assertEqual(0, self.fake.stats["calls"] - calls)
+        self.assertEqual(self.live_names(self.source_id), self.live_names(destination_id))
@@ -1,7 +1,22 @@
+import copy
+import time
+from collections import deque
 from unittest import TestCase
-from unittest.mock import Mock, MagicMock
+from unittest.mock import Mock, MagicMock, patch
 
-from services.google_drive_helpers import GoogleDrive
+import httplib2
+from googleapiclient.errors import HttpError as GoogleHttpError
+
+from benchmarks.fake_drive import FakeDriveHttp, build_tree
+from services.google_drive_helpers import (
+    GoogleDrive,
+    MAX_PARENTS_QUERY_LENGTH,
+    iter_pages,
+    parents_query,
+    take_folder_batch,
+)
+from services.metrics import Metrics
+from tests import FAKE_CONFIG, shape
 
 
 class TestGoogleDrive(TestCase):
@@ -10,16 +25,17 @@ class TestGoogleDrive(TestCase):
         Run setup of commonly used objects / mocks / expectations
         :return:
         """
-        self.test_response = {
-            "files": ["one"]
-        }
-        self.test_response_two = {
-            "files": ["two"]
-        }
-
         self.mock_drive = Mock()
         self.mock_drive.type_folder = "application/vnd.google-apps.folder"
-        self.mock_files = self.mock_drive.connection.files()
+        self.mock_drive.journal = None
+        self.mock_drive.listing_fields = []
+        self.mock_drive.skip_trashed = False
+        self.mock_drive.metrics = Metrics()
+        self.mock_drive.multi_parent_policy = "copy_once"
+        self.mock_files = self.mock_drive.files
+        # helpers the methods under test call on themselves run for real
+        self.mock_drive.iter_listings.side_effect = lambda file_id: GoogleDrive.iter_listings(self.mock_drive, file_id)
+        self.mock_drive.copy_root.side_effect = lambda *args: GoogleDrive.copy_root(self.mock_drive, *args)
 
         self.mock_request = MagicMock()
 
@@ -72,44 +88,52 @@ class TestGoogleDrive(TestCase):
             "local_object_count": 2
         }
 
-    def test_pagination_helper_no_next_page(self):
-        # run setup
-        self.setup()
-        
-        # except no next page for pagination helper
-        self.mock_drive.connection.files().list_next.return_value = None
-        # assert we get the response we expect
-        self.assertEqual(self.test_response, GoogleDrive.pagination_helper(
-            self.mock_drive, self.mock_request, self.test_response
-        ))
-
-    def test_pagination_helper_next_page(self):
-        # run setup
-        self.setup()
-
-        # loop through 1x, return our second test response
-        self.mock_files.list_next.side_effect = [self.mock_request, None]
-        self.mock_request.execute.return_value = self.test_response_two
-
-        # assert we get the stuff we expect
-        expected_response = {
-            "files": ["one", "two"]
+        # a small tree: folder-id -> 123 -> 456 -> 789, with files sprinkled throughout
+        self.nested_listings = {
+            "folder-id": self.expected_files_and_folders,
+            "123": {
+                "folder_id": "123",
+                "folders": [
+                    {"folder_id": "456", "folder_name": "nested", "child_objects": {}, "nested_object_count": 0}
+                ],
+                "files": [{"file_id": "654", "file_name": "nested_file"}],
+                "local_object_count": 2,
+            },
+            "456": {
+                "folder_id": "456",
+                "folders": [
+                    {"folder_id": "789", "folder_name": "deeper", "child_objects": {}, "nested_object_count": 0}
+                ],
+                "files": [],
+                "local_object_count": 1,
+            },
+            "789": {
+                "folder_id": "789",
+                "folders": [],
+                "files": [{"file_id": "987", "file_name": "deep_file"}],
+                "local_object_count": 1,
+            },
         }
-        self.assertEqual(expected_response, GoogleDrive.pagination_helper(
-            self.mock_drive, self.mock_request, self.test_response
-        ))
 
     def test_get_files_and_folders_incomplete_search(self):
         # run setup
         self.setup()
 
         # set expectations
+        self.mock_drive.partition_after_pages = 5
         self.mock_files.list.return_value = self.mock_request
         self.mock_request.execute.return_value = {
-            "incompleteSearch": True
+            "incompleteSearch": True,
+            "files": [{"id": "321", "name": "test_file", "mimeType": "application/vnd.google-apps.sheet"}],
         }
-        # get nothing back because we obtained an incomplete Search
-        self.assertEqual({}, GoogleDrive.get_files_and_folders(self.mock_drive, "folder-id"))
+        # the rest of the folder comes from listing it in partitions, without doubling up on what we already have
+        self.mock_drive.list_partitioned.return_value = [
+            {"id": "123", "name": "test_folder", "mimeType": "application/vnd.google-apps.folder"},
+            {"id": "321", "name": "test_file", "mimeType": "application/vnd.google-apps.sheet"},
+        ]
+        listing = GoogleDrive.get_files_and_folders(self.mock_drive, "folder-id")
+        self.mock_drive.list_partitioned.assert_called_once_with("folder-id")
+        self.assertEqual(self.expected_files_and_folders, listing)
 
     def test_get_files_and_folders(self):
         # run setup
@@ -153,14 +177,105 @@ class TestGoogleDrive(TestCase):
         self.setup()
 
         # test with actual nesting
-        self.mock_drive.get_files_and_folders.return_value = self.expected_files_and_folders
-        self.mock_drive.get_nested_objects.return_value = self.child_object, 0, 1
+        listings = {"folder-id": self.expected_files_and_folders, "123": self.child_object}
+        self.mock_drive.get_files_and_folders.side_effect = lambda folder_id: listings[folder_id]
         # ensure we see the objects and level of nesting we'd expect
-        files_and_folders, nested_folders, nested_files = GoogleDrive.get_nested_objects(self.mock_drive, "1234")
+        files_and_folders, nested_folders, nested_files = GoogleDrive.get_nested_objects(self.mock_drive, "folder-id")
         self.assertEqual(2, nested_files)
         self.assertEqual(1, nested_folders)
         self.assertEqual(self.test_drive_data, files_and_folders)
 
+    def test_get_nested_objects_concurrent(self):
+        # run setup
+        self.setup()
+
+        self.mock_drive.traversal_workers = 4
+        self.mock_drive.listing_batch_size = 1
+        self.mock_drive.get_files_and_folders.side_effect = lambda folder_id: copy.deepcopy(
+            self.nested_listings[folder_id]
+        )
+        files_and_folders, nested_folders, nested_files = GoogleDrive.get_nested_objects_concurrent(
+            self.mock_drive, "folder-id"
+        )
+
+        # the depth first walk over the same listings should give us exactly the same tree and totals
+        self.assertEqual(
+            GoogleDrive.get_nested_objects(self.mock_drive, "folder-id"),
+            (files_and_folders, nested_folders, nested_files),
+        )
+        self.assertEqual(3, nested_folders)
+        self.assertEqual(3, nested_files)
+        self.assertEqual(4, files_and_folders["folders"][0]["nested_object_count"])
+
+    def test_get_nested_objects_concurrent_batched(self):
+        # run setup
+        self.setup()
+
+        # give the root a second folder so there is something to batch together
+        root_listing = copy.deepcopy(self.expected_files_and_folders)
+        root_listing["folders"].append(
+            {"folder_id": "124", "folder_name": "sibling", "child_objects": {}, "nested_object_count": 0}
+        )
+        root_listing["local_object_count"] += 1
+        self.nested_listings["folder-id"] = root_listing
+        self.nested_listings["124"] = {
+            "folder_id": "124",
+            "folders": [],
+            "files": [{"file_id": "421", "file_name": "sibling_file"}],
+            "local_object_count": 1,
+        }
+
+        # per folder listings first
+        self.mock_drive.traversal_workers = 2
+        self.mock_drive.listing_batch_size = 1
+        self.mock_drive.get_files_and_folders.side_effect = lambda folder_id: copy.deepcopy(
+            self.nested_listings[folder_id]
+        )
+        expected = GoogleDrive.get_nested_objects_concurrent(self.mock_drive, "folder-id")
+
+        # then the same tree listed in batches should come out identical
+        self.mock_drive.listing_batch_size = 10
+        self.mock_drive.get_files_and_folders_batched.side_effect = lambda folder_ids: {
+            folder_id: copy.deepcopy(self.nested_listings[folder_id]) for folder_id in folder_ids
+        }
+        self.assertEqual(expected, GoogleDrive.get_nested_objects_concurrent(self.mock_drive, "folder-id"))
+        self.mock_drive.get_files_and_folders_batched.assert_called_once_with(["123", "124"])
+
+    def test_get_files_and_folders_batched(self):
+        # run setup
+        self.setup()
+
+        # one merged listing, including a file that lives in both folders
+        self.mock_files.list.return_value = self.mock_request
+        self.mock_request.execute.return_value = {
+            "incompleteSearch": False,
+            "files": [
+                {"id": "456", "name": "nested", "mimeType": self.mock_drive.type_folder, "parents": ["123"]},
+                {"id": "654", "name": "nested_file", "mimeType": "text/plain", "parents": ["123"]},
+                {"id": "321", "name": "shared_file", "mimeType": "text/plain", "parents": ["123", "789"]},
+            ]
+        }
+        listings = GoogleDrive.get_files_and_folders_batched(self.mock_drive, ["123", "789"])
+
+        self.mock_files.list.assert_called_once_with(
+            q="'123' in parents or '789' in parents",
+            fields="nextPageToken, incompleteSearch, files(id,name,mimeType,parents)",
+            pageSize=1000,
+        )
+        self.assertEqual(["456"], [folder["folder_id"] for folder in listings["123"]["folders"]])
+        self.assertEqual(["654", "321"], [file["file_id"] for file in listings["123"]["files"]])
+        self.assertEqual(3, listings["123"]["local_object_count"])
+        self.assertEqual([{"file_id": "321", "file_name": "shared_file"}], listings["789"]["files"])
+        self.assertEqual(1, listings["789"]["local_object_count"])
+
+    def test_take_folder_batch(self):
+        # batches stop at the batch size, and at the query length limit
+        pending = deque({"folder_id": str(i) * 40} for i in range(100))
+        self.assertEqual(5, len(take_folder_batch(pending, 5)))
+        batch = take_folder_batch(pending, 1000)
+        self.assertLessEqual(len(parents_query([folder["folder_id"] for folder in batch])), MAX_PARENTS_QUERY_LENGTH)
+        self.assertGreater(len(pending), 0)
+
     def test_copy_file_fail(self):
         # run setup
         self.setup()
@@ -180,8 +295,11 @@ class TestGoogleDrive(TestCase):
         # run setup
         self.setup()
         # simple successful copy execution
-        self.mock_files.copy.execute.return_value = None
-        self.assertTrue(GoogleDrive.copy_file(self.mock_drive, "test_file_id", "test_file_name", "test_destination_id"))
+        self.mock_files.copy().execute.return_value = {"id": "copied-file-id"}
+        self.assertEqual(
+            "copied-file-id",
+            GoogleDrive.copy_file(self.mock_drive, "test_file_id", "test_file_name", "test_destination_id"),
+        )
 
     def test_copy_folder(self):
         # run setup
@@ -223,6 +341,127 @@ class TestGoogleDrive(TestCase):
         self.mock_drive.copy_nested_items.assert_called_once()
         self.mock_drive.copy_file.assert_called_once()
 
+    @patch("services.google_drive_helpers.time.sleep")
+    def test_execute_batch_retries_failed_requests(self, _):
+        # run setup
+        self.setup()
+        self.mock_drive.batch_attempts = 3
+
+        # a stand in for the client's batch request that fails request "1" with a 429 the first time around
+        sent = []
+
+        def new_batch_http_request(callback):
+            batch = Mock()
+            requests = {}
+            batch.add.side_effect = lambda request, request_id: requests.update({request_id: request})
+
+            def execute():
+                sent.append(sorted(requests))
+                for request_id, request in requests.items():
+                    if request == "request-1" and len(sent) == 1:
+                        callback(request_id, None, GoogleHttpError(httplib2.Response({"status": 429}), b"{}"))
+                    else:
+                        callback(request_id, {"id": f"copy-of-{request}"}, None)
+
+            batch.execute.side_effect = execute
+            return batch
+
+        self.mock_drive.connection.new_batch_http_request.side_effect = new_batch_http_request
+        responses = GoogleDrive.execute_batch(self.mock_drive, ["request-0", "request-1", "request-2"])
+
+        # only the rate limited request gets sent again
+        self.assertEqual([["0", "1", "2"], ["1"]], sent)
+        self.assertEqual(["copy-of-request-0", "copy-of-request-1", "copy-of-request-2"],
+                         [response["id"] for response in responses])
+
+    def test_copy_nested_items_batched(self):
+        # copy a small tree on the fake Drive backend with batch requests
+        fake = FakeDriveHttp()
+        source_id = fake.add_folder("source")
+        build_tree(fake, source_id, depth=2, folders_per_folder=2, files_per_folder=3)
+        google_drive = GoogleDrive(None, {**FAKE_CONFIG, "copy_engine": "batched"}, http=fake)
+        drive_data, _, _ = google_drive.get_nested_objects_concurrent(source_id)
+
+        destination_id = google_drive.copy_nested_items(drive_data)
+
+        # the copy should have exactly the same shape as the source
+        self.assertEqual(shape(fake, source_id), shape(fake, destination_id))
+        # ... and the 6 folders and 21 files should have gone over in one batch per level for each
+        self.assertEqual(5, fake.stats["batches"])
+
+    def test_copy_nested_items_parallel(self):
+        # copy a small tree on the fake Drive backend with the parallel scheduler
+        fake = FakeDriveHttp()
+        source_id = fake.add_folder("source")
+        build_tree(fake, source_id, depth=3, folders_per_folder=2, files_per_folder=2)
+        google_drive = GoogleDrive(None, {**FAKE_CONFIG, "copy_engine": "parallel", "copy_workers": 4}, http=fake)
+        drive_data, _, _ = google_drive.get_nested_objects_concurrent(source_id)
+
+        destination_id = google_drive.copy_nested_items(drive_data)
+
+        # the copy should have exactly the same shape as the source
+        self.assertEqual(shape(fake, source_id), shape(fake, destination_id))
+
+    def test_iter_nested_objects(self):
+        fake = FakeDriveHttp()
+        source_id = fake.add_folder("source")
+        build_tree(fake, source_id, depth=3, folders_per_folder=2, files_per_folder=2)
+        google_drive = GoogleDrive(None, {**FAKE_CONFIG, "traversal_workers": 4}, http=fake)
+
+        seen = {source_id}
+        for parent_id, item in google_drive.iter_nested_objects(source_id):
+            # every folder is handed back before anything in it
+            self.assertIn(parent_id, seen)
+            seen.add(item.get("folder_id") or item["file_id"])
+        self.assertEqual(len(fake.files), len(seen))
+
+    def test_copy_nested_items_streaming(self):
+        # copy a small tree on the fake Drive backend while it is being walked
+        fake = FakeDriveHttp()
+        source_id = fake.add_folder("source")
+        build_tree(fake, source_id, depth=3, folders_per_folder=2, files_per_folder=2)
+        google_drive = GoogleDrive(None, {**FAKE_CONFIG, "copy_engine": "streaming", "copy_workers": 4}, http=fake)
+
+        listings = []
+        destination_id = google_drive.copy_nested_items_streaming(source_id, on_listing=listings.append)
+
+        # the copy should have exactly the same shape as the source
+        self.assertEqual(shape(fake, source_id), shape(fake, destination_id))
+        self.assertEqual(15, len(listings))
+
+    def test_iter_pages_prefetch(self):
+        # a folder of 10 pages, counting the requests the backend has been sent
+        fake = FakeDriveHttp(max_page_size=10)
+        source_id = fake.add_folder("source")
+        for number in range(95):
+            fake.add_file(f"file {number}", source_id)
+        requests, request = [], fake.request
+
+        def counted(*args, **kwargs):
+            requests.append(args[0])
+            return request(*args, **kwargs)
+
+        fake.request = counted
+        listings, overlapped = [], []
+        for prefetch_pages in (False, True):
+            google_drive = GoogleDrive(None, {**FAKE_CONFIG, "prefetch_pages": prefetch_pages}, http=fake)
+            listings.append(google_drive.get_files_and_folders(source_id))
+
+            requests.clear()
+            request_list = google_drive.files.list(q=parents_query([source_id]), pageSize=10)
+            for number, response in enumerate(iter_pages(google_drive.files, request_list, prefetch_pages), start=1):
+                if "nextPageToken" not in response:
+                    continue
+                # while a page is being worked through, see whether the request for the next one goes out
+                deadline = time.monotonic() + (2 if prefetch_pages else 0.05)
+                while len(requests) == number and time.monotonic() < deadline:
+                    time.sleep(0.005)
+                overlapped.append((prefetch_pages, len(requests) > number))
+        self.assertEqual(listings[0], listings[1])
+        self.assertEqual(95, listings[1]["local_object_count"])
+        # the next page is fetched while the current one is worked through, rather than after
+        self.assertEqual([(False, False)] * 9 + [(True, True)] * 9, overlapped)
+
 
 class HttpError(Exception):
     pass
@@ -0,0 +1,110 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from unittest import TestCase
+from unittest.mock import Mock
+
+import httplib2
+
+from services.http_pool import HttpPool
+
+URI = "https://www.googleapis.com/drive/v3/files"
+
+
+def response(status):
+    """
+    a canned (response, content) tuple like httplib2 would give us
+    """
+    return httplib2.Response({"status": status}), b"{}"
+
+
+class TestHttpPool(TestCase):
+    def setup(self):
+        """
+        Run setup of commonly used objects / mocks / expectations
+        :return:
+        """
+        self.credentials = Mock(valid=True, token="token")
+        # every connection the pool opens
+        self.opened = []
+
+        def factory():
+            http = Mock()
+            http.request.return_value = response(200)
+            self.opened.append(http)
+            return http
+
+        self.factory = factory
+
+    def test_request_reuses_connections(self):
+        # run setup
+        self.setup()
+
+        pool = HttpPool(self.credentials, size=4, factory=self.factory)
+        for _ in range(3):
+            resp, _ = pool.request(URI)
+            self.assertEqual(200, resp.status)
+        self.assertEqual(1, len(self.opened))
+        self.assertEqual(3, self.opened[0].request.call_count)
+        self.assertEqual({"connections": 1, "reused": 2, "waited": 0, "refreshes": 0}, pool.counters)
+
+    def test_request_waits_when_full(self):
+        # run setup
+        self.setup()
+
+        pool = HttpPool(self.credentials, size=1, factory=self.factory)
+        http = pool.acquire()
+        thread = threading.Thread(target=pool.request, args=(URI,))
+        thread.start()
+        # no more connections than the pool size, so the request has to wait for ours
+        thread.join(0.1)
+        self.assertTrue(thread.is_alive())
+        pool.release(http)
+        thread.join()
+        self.assertEqual(1, len(self.opened))
+        self.assertEqual(1, pool.counters["waited"])
+
+    def test_request_refreshes_rejected_token(self):
+        # run setup
+        self.setup()
+
+        def refresh(_):
+            self.credentials.token = "new token"
+
+        self.credentials.refresh.side_effect = refresh
+        pool = HttpPool(self.credentials, factory=self.factory)
+        pool.release(pool.acquire())
+        self.opened[0].request.side_effect = [response(401), response(200)]
+
+        resp, _ = pool.request(URI)
+        self.assertEqual(200, resp.status)
+        self.assertEqual(1, self.credentials.refresh.call_count)
+        self.assertEqual(2, self.opened[0].request.call_count)
+
+    def test_expired_credentials_refreshed_once(self):
+        # run setup
+        self.setup()
+
+        def refresh(_):
+            self.credentials.valid = True
+            self.credentials.token = "new token"
+
+        self.credentials.valid = False
+        self.credentials.refresh.side_effect = refresh
+        pool = HttpPool(self.credentials, size=4, factory=self.factory)
+        with ThreadPoolExecutor(8) as executor:
+            list(executor.map(lambda _: pool.request(URI), range(32)))
+        # every thread found the token expired, but only the first one to get the lock refreshed it
+        self.assertEqual(1, self.credentials.refresh.call_count)
+        self.assertLessEqual(len(self.opened), 4)
+
+    def test_close(self):
+        # run setup
+        self.setup()
+
+        pool = HttpPool(self.credentials, factory=self.factory)
+        pool.request(URI)
+        pool.close()
+        self.opened[0].close.assert_called_once()
+        # and it opens a new connection when it's used again
+        pool.request(URI)
+        self.assertEqual(2, len(self.opened))
@@ -0,0 +1,165 @@
+import os
+import tempfile
+from unittest import TestCase
+
+from benchmarks.fake_drive import FakeDriveHttp
+from services.copy_journal import CopyJournal
+from services.diff_copy import prepare_diff_copy
+from services.google_drive_helpers import GoogleDrive
+from services.incremental_sync import recount, sync_drive_data
+from tests import FAKE_CONFIG
+
+
+def names(listing):
+    """
+    the names in a drive data listing, folders and files
+    """
+    return sorted(
+        [folder["folder_name"] for folder in listing["folders"]] + [file["file_name"] for file in listing["files"]]
+    )
+
+
+class TestIncrementalSync(TestCase):
+    def setup(self):
+        """
+        Run setup of commonly used objects / mocks / expectations
+        :return:
+        """
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+
+        # source -> (a -> a.txt, b -> b.txt, root.txt), plus a folder outside the source with something in it
+        self.fake = FakeDriveHttp()
+        self.source_id = self.fake.add_folder("source")
+        self.folder_a = self.fake.add_folder("a", self.source_id)
+        self.folder_b = self.fake.add_folder("b", self.source_id)
+        self.file_a = self.fake.add_file("a.txt", self.folder_a)
+        self.file_b = self.fake.add_file("b.txt", self.folder_b)
+        self.root_file = self.fake.add_file("root.txt", self.source_id)
+        self.outside = self.fake.add_folder("outside")
+        self.fake.add_file("outside.txt", self.outside)
+
+        self.google_drive = GoogleDrive(None, FAKE_CONFIG, http=self.fake)
+        start_page_token = self.google_drive.get_start_page_token()
+        self.drive_data, _, _ = self.google_drive.get_nested_objects_concurrent(self.source_id)
+        self.drive_data["start_page_token"] = start_page_token
+
+    def folder(self, listing, name):
+        return next(folder for folder in listing["folders"] if folder["folder_name"] == name)
+
+    def test_sync_drive_data(self):
+        # run setup
+        self.setup()
+
+        self.fake.add_file("new.txt", self.folder_a)
+        self.fake.update_file(self.folder_b, name="b renamed")
+        self.fake.update_file(self.file_a, add_parents=[self.folder_b], remove_parents=[self.folder_a])
+        self.fake.update_file(self.root_file, trashed=True)
+        self.fake.update_file(self.file_b, md5Checksum="changed")
+        self.fake.update_file(self.outside, add_parents=[self.folder_a], remove_parents=[])
+
+        changed_files = sync_drive_data(self.google_drive, self.drive_data)
+
+        self.assertEqual(["a", "b renamed"], names(self.drive_data))
+        folder_a = self.folder(self.drive_data, "a")
+        self.assertEqual(["new.txt", "outside"], names(folder_a["child_objects"]))
+        # the moved in folder comes with its contents
+        self.assertEqual(["outside.txt"], names(self.folder(folder_a["child_objects"], "outside")["child_objects"]))
+        self.assertEqual(["a.txt", "b.txt"], names(self.folder(self.drive_data, "b renamed")["child_objects"]))
+        self.assertEqual(3, folder_a["nested_object_count"])
+        self.assertEqual((3, 4), recount(self.drive_data))
+        # everything new or changed needs copying, the rename of a folder doesn't
+        outside_file = self.fake.children(self.outside)[0]["id"]
+        self.assertEqual(
+            {self.file_a, self.file_b, outside_file, self.fake.children(self.folder_a)[0]["id"]}, changed_files
+        )
+        # and the next sync picks up from where this one left off
+        self.assertEqual(set(), sync_drive_data(self.google_drive, self.drive_data))
+
+    def test_incremental_copy(self):
+        # run setup
+        self.setup()
+
+        journal = CopyJournal(os.path.join(self.directory.name, "copy_journal.sqlite"))
+        self.google_drive.journal = journal
+        destination_id = self.google_drive.copy_nested_items(self.drive_data)
+
+        self.fake.add_file("new.txt", self.folder_a)
+        self.fake.update_file(self.file_b, md5Checksum="changed")
+        changed_files = sync_drive_data(self.google_drive, self.drive_data)
+        for copy_id in journal.forget(changed_files):
+            self.google_drive.trash_file(copy_id)
+        calls = self.fake.stats["calls"]
+        self.assertEqual(destination_id, self.google_drive.copy_nested_items(self.drive_data))
+        journal.close()
+
+        # only the new file and the changed file were copied this time
+        self.assertEqual(2, self.fake.stats["calls"] - calls)
+        copied, _, _ = self.google_drive.get_nested_objects_concurrent(destination_id)
+        self.assertEqual(["a.txt", "new.txt"], names(self.folder(copied, "a")["child_objects"]))
+        # the old copy of the changed file is in the trash, leaving just the new one
+        copies_of_b = [
+            resource
+            for resource in self.fake.files.values()
+            if resource["name"] == "b.txt" and resource["id"] != self.file_b
+        ]
+        self.assertEqual([True, False], [resource["trashed"] for resource in copies_of_b])
+
+    def test_unlisted_folder(self):
+        # run setup
+        self.setup()
+
+        # the folder moved into the tree can't be listed
+        self.fake.update_file(self.outside, add_parents=[self.folder_a], remove_parents=[])
+        self.google_drive.get_nested_objects_concurrent = lambda file_id: ({}, 0, 0)
+        changed_files = sync_drive_data(self.google_drive, self.drive_data)
+        self.assertEqual(set(), changed_files)
+        outside = self.folder(self.folder(self.drive_data, "a")["child_objects"], "outside")
+        self.assertEqual([], names(outside["child_objects"]))
+
+    def test_changes_unavailable(self):
+        # run setup
+        self.setup()
+
+        self.google_drive.get_changes = lambda page_token: ([], None)
+        start_page_token = self.drive_data["start_page_token"]
+        self.assertIsNone(sync_drive_data(self.google_drive, self.drive_data))
+        self.assertEqual(start_page_token, self.drive_data["start_page_token"])
+
+    def test_incremental_diff_copy(self):
+        # run setup
+        self.setup()
+
+        # with diff copy on, changes come with the checksums and modified times the listing has
+        google_drive = GoogleDrive(None, {**FAKE_CONFIG, "diff_copy": True}, http=self.fake)
+        journal = CopyJournal(os.path.join(self.directory.name, "copy_journal.sqlite"))
+        self.addCleanup(journal.close)
+        google_drive.journal = journal
+        report = self.fake.add_file("report.pdf", self.source_id, "application/pdf", md5Checksum="abc", size="3")
+        drive_data, _, _ = google_drive.get_nested_objects_concurrent(self.source_id)
+        drive_data["start_page_token"] = google_drive.get_start_page_token()
+        destination_id = google_drive.copy_nested_items(drive_data)
+
+        # a file with a checksum that is only renamed isn't copied again, a changed one is
+        self.fake.update_file(report, name="renamed.pdf")
+        self.fake.update_file(self.file_b, md5Checksum="changed")
+        renamed = {}
+        self.assertEqual({self.file_b}, sync_drive_data(google_drive, drive_data, renamed))
+        self.assertEqual({report: "renamed.pdf"}, renamed)
+        self.assertEqual("changed", self.folder(drive_data, "b")["child_objects"]["files"][0]["md5_checksum"])
+
+        for copy_id in journal.forget([self.file_b]):
+            google_drive.trash_file(copy_id)
+        for copy_id in journal.copies(report):
+            google_drive.rename_file(copy_id, "renamed.pdf")
+        calls = self.fake.stats["calls"]
+        google_drive.copy_nested_items(drive_data)
+        self.assertEqual(1, self.fake.stats["calls"] - calls)
+
+        # and a diff against the copy finds nothing out of date
+        journal.clear()
+        drive_data, _, _ = google_drive.get_nested_objects_concurrent(self.source_id)
+        prepare_diff_copy(google_drive, drive_data, destination_id, journal)
+        calls = self.fake.stats["calls"]
+        google_drive.copy_nested_items(drive_data, destination_id)
+        self.assertEqual(0, self.fake.stats["calls"] - calls)
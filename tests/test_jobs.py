@@ -0,0 +1,105 @@
+import json
+import os
+import tempfile
+import threading
+from unittest import TestCase
+
+from benchmarks.fake_drive import FakeDriveHttp, build_tree
+from services import jobs
+from services.google_drive_helpers import GoogleDrive
+from tests import FAKE_CONFIG
+
+
+class TestJobs(TestCase):
+    def setup(self):
+        """
+        Run setup of commonly used objects / mocks / expectations
+        :return:
+        """
+        # the jobs report is written relative to where they are run from
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        os.mkdir(os.path.join(self.directory.name, "reports"))
+        self.addCleanup(os.chdir, os.getcwd())
+        os.chdir(self.directory.name)
+
+        # a big source with a small source inside it, and a source of its own
+        self.fake = FakeDriveHttp()
+        self.big_source = self.fake.add_folder("big")
+        build_tree(self.fake, self.big_source, depth=3, folders_per_folder=2, files_per_folder=2)
+        children = self.fake.children(self.big_source)
+        self.inner_source = [item["id"] for item in children if item["name"].startswith("folder")][0]
+        self.small_source = self.fake.add_folder("small")
+        build_tree(self.fake, self.small_source, depth=1, folders_per_folder=1, files_per_folder=1)
+        self.destinations = [self.fake.add_folder(f"destination {number}") for number in range(3)]
+        self.config = {
+            **FAKE_CONFIG,
+            "copy_engine": "parallel",
+            "job_workers": 2,
+            "tree_store": os.path.join(self.directory.name, "drive_data.sqlite"),
+            "copy_journal": os.path.join(self.directory.name, "copy_journal.sqlite"),
+        }
+
+    def test_load_jobs(self):
+        # run setup
+        self.setup()
+
+        with open("jobs.csv", "w") as f:
+            f.write("source,destination\na,b\nc,\n")
+        with open("jobs.yaml", "w") as f:
+            f.write("jobs:\n  - source: a\n    destination: b\n  - source: c\n")
+        expected = [{"source": "a", "destination": "b"}, {"source": "c", "destination": None}]
+        self.assertEqual(expected, jobs.load_jobs("jobs.csv"))
+        self.assertEqual(expected, jobs.load_jobs("jobs.yaml"))
+
+        with open("broken.yaml", "w") as f:
+            f.write("- destination: b\n")
+        self.assertRaises(ValueError, jobs.load_jobs, "broken.yaml")
+        # two copies of the same source with no destination would both resume into the same new folder
+        with open("duplicate.csv", "w") as f:
+            f.write("source,destination\na,b\nc,\na,\nc,\n")
+        self.assertRaisesRegex(ValueError, "job 4 .* same as job 2", jobs.load_jobs, "duplicate.csv")
+
+    def test_run_jobs(self):
+        # run setup
+        self.setup()
+
+        job_list = [
+            {"source": self.small_source, "destination": self.destinations[0]},
+            {"source": self.big_source, "destination": self.destinations[1]},
+            {"source": self.inner_source, "destination": self.destinations[2]},
+            {"source": self.big_source, "destination": None},
+        ]
+        google_drive = GoogleDrive(None, self.config, http=self.fake)
+        finished = jobs.run_jobs(google_drive, job_list)
+        self.assertEqual(["done"] * 4, [job["status"] for job in finished])
+        self.assertEqual([3, 44, 20, 44], [job["total_objects"] for job in finished])
+        # each folder was listed once: the big source and the small one, but not the inner one again
+        self.assertEqual(15 + 2, self.fake.stats["list_pages"])
+
+        for job in finished:
+            copied, total_folders, total_files = google_drive.get_nested_objects_concurrent(job["copy_source_id"])
+            self.assertEqual(job["total_objects"], total_folders + total_files)
+        # the job with no destination got a new folder
+        self.assertNotIn(finished[3]["copy_source_id"], self.destinations)
+        with open("reports/jobs_report.json") as f:
+            self.assertEqual(finished, json.load(f)["jobs"])
+
+    def test_shared_copy_pool(self):
+        # run setup
+        self.setup()
+
+        google_drive = GoogleDrive(None, {**self.config, "copy_workers": 3}, http=self.fake)
+        copy_file_object, threads = google_drive.copy_file_object, set()
+
+        def record_thread(*args):
+            threads.add(threading.current_thread())
+            return copy_file_object(*args)
+
+        google_drive.copy_file_object = record_thread
+        job_list = [{"source": self.big_source, "destination": destination} for destination in self.destinations]
+        finished = jobs.run_jobs(google_drive, job_list)
+        self.assertEqual(["done"] * 3, [job["status"] for job in finished])
+        # three jobs at a time between them only ever copied on the one pool of copy_workers threads
+        self.assertLessEqual(len(threads), 3)
+        self.assertIsNone(google_drive.copy_executor)
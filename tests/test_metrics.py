@@ -0,0 +1,105 @@
+import json
+import os
+import tempfile
+from unittest import TestCase
+from unittest.mock import patch
+
+from benchmarks.fake_drive import FakeDriveHttp, build_tree
+from services.google_drive_helpers import GoogleDrive
+from services.metrics import Histogram, Metrics, operation_name
+from tests import FAKE_CONFIG
+
+
+class TestMetrics(TestCase):
+    def setup(self):
+        """
+        Run setup of commonly used objects / mocks / expectations
+        :return:
+        """
+        self.fake = FakeDriveHttp()
+        self.source_id = self.fake.add_folder("source")
+        # 6 folders and 21 files
+        build_tree(self.fake, self.source_id, depth=2, folders_per_folder=2, files_per_folder=3)
+
+    def test_operation_name(self):
+        base = "https://www.googleapis.com/drive/v3"
+        self.assertEqual("files.list", operation_name("GET", f"{base}/files?q=x"))
+        self.assertEqual("files.get", operation_name("GET", f"{base}/files/abc?fields=id"))
+        self.assertEqual("files.copy", operation_name("POST", f"{base}/files/abc/copy"))
+        self.assertEqual("files.create", operation_name("POST", f"{base}/files"))
+        self.assertEqual("files.update", operation_name("PATCH", f"{base}/files/abc"))
+        self.assertEqual("changes.list", operation_name("GET", f"{base}/changes?pageToken=1"))
+        self.assertEqual("changes.getStartPageToken", operation_name("GET", f"{base}/changes/startPageToken"))
+        self.assertEqual("batch", operation_name("POST", "https://www.googleapis.com/batch/drive/v3"))
+
+    def test_histogram(self):
+        histogram = Histogram()
+        for value in (0.001, 0.02, 0.02, 0.3, 20):
+            histogram.observe(value)
+        self.assertEqual(5, histogram.count)
+        self.assertEqual(0.025, histogram.quantile(0.5))
+        self.assertEqual(float("inf"), histogram.quantile(1))
+        buckets = dict(histogram.cumulative())
+        self.assertEqual((1, 3, 4, 5), (buckets["0.005"], buckets["0.025"], buckets["0.5"], buckets["+Inf"]))
+
+    def test_walk_and_copy(self):
+        # run setup
+        self.setup()
+
+        google_drive = GoogleDrive(None, {**FAKE_CONFIG, "copy_engine": "parallel"}, http=self.fake)
+        drive_data, _, _ = google_drive.get_nested_objects_concurrent(self.source_id)
+        google_drive.copy_nested_items(drive_data)
+        snapshot = google_drive.metrics.snapshot()
+
+        # every request the fake saw, by what it was
+        requests = snapshot["requests"]
+        self.assertEqual(7, snapshot["list_pages"])
+        counts = tuple(requests[operation]["count"] for operation in ("files.get", "files.create", "files.copy"))
+        self.assertEqual((1, 7, 21), counts)
+        self.assertEqual(self.fake.stats["calls"], sum(stats["count"] for stats in requests.values()))
+        self.assertEqual(self.fake.stats["bytes"], sum(stats["bytes_received"] for stats in requests.values()))
+        self.assertEqual({"200": 21}, requests["files.copy"]["statuses"])
+        # and how long each phase took, one span per folder listed, folder created and file copied
+        spans = tuple(snapshot["spans"][name]["count"] for name in ("listing", "folder_creation", "file_copy"))
+        self.assertEqual((7, 7, 21), spans)
+
+        google_drive.metrics.reset()
+        self.assertEqual({}, google_drive.metrics.snapshot()["requests"])
+
+    @patch("services.rate_limiter.time.sleep")
+    def test_retries(self, _):
+        fake = FakeDriveHttp(error_rate=0.3, seed=1)
+        build_tree(fake, fake.add_folder("source"), depth=2, folders_per_folder=2, files_per_folder=3)
+        google_drive = GoogleDrive(None, {**FAKE_CONFIG, "max_request_attempts": 10}, http=fake)
+        google_drive.get_nested_objects_concurrent("fake-00000000")
+
+        requests = google_drive.metrics.snapshot()["requests"]
+        # each failure the fake injected was retried, and the request counted once
+        self.assertEqual(fake.stats["errors"], requests["files.list"]["retries"])
+        self.assertEqual(7, requests["files.list"]["count"])
+
+    def test_write(self):
+        # run setup
+        self.setup()
+
+        google_drive = GoogleDrive(None, FAKE_CONFIG, http=self.fake)
+        google_drive.get_nested_objects_concurrent(self.source_id)
+        with tempfile.TemporaryDirectory() as directory:
+            path = google_drive.metrics.write(os.path.join(directory, "metrics"), "json")
+            with open(path) as f:
+                self.assertEqual(7, json.load(f)["list_pages"])
+
+            path = google_drive.metrics.write(os.path.join(directory, "metrics"), "prometheus")
+            self.assertTrue(path.endswith(".prom"))
+            with open(path) as f:
+                text = f.read()
+        self.assertIn('drive_requests_total{operation="files.list",status="200"} 7', text)
+        self.assertIn('drive_request_duration_seconds_count{operation="files.list"} 7', text)
+        self.assertIn('drive_span_duration_seconds_bucket{span="listing",le="+Inf"} 7', text)
+
+    def test_empty(self):
+        # nothing recorded yet shouldn't trip anything up
+        metrics = Metrics()
+        self.assertEqual("", metrics.summary())
+        self.assertEqual(0, metrics.snapshot()["list_pages"])
+        self.assertIn("# TYPE drive_requests_total counter", metrics.to_prometheus())
@@ -0,0 +1,66 @@
+from unittest import TestCase
+
+from benchmarks.fake_drive import FakeDriveHttp
+from services.google_drive_helpers import GoogleDrive
+from services.partitions import format_time, parse_time, partition_query, split_partition, time_partitions
+from tests import FAKE_CONFIG
+
+
+class TestPartitions(TestCase):
+    def setup(self, **fake_options):
+        """
+        Run setup of commonly used objects / mocks / expectations
+        :return:
+        """
+        # a folder of 10 folders and 190 files, each modified a second after the last
+        self.fake = FakeDriveHttp(**fake_options)
+        self.source_id = self.fake.add_folder("source")
+        for index in range(200):
+            if index % 20 == 0:
+                self.fake.add_folder(f"folder {index}", self.source_id)
+            else:
+                self.fake.add_file(f"file {index}", self.source_id)
+        self.expected_ids = sorted(item["id"] for item in self.fake.children(self.source_id))
+
+    def listed_ids(self, listing: dict) -> list:
+        return sorted([folder["folder_id"] for folder in listing["folders"]] + [f["file_id"] for f in listing["files"]])
+
+    def test_time_partitions(self):
+        self.assertEqual("2024-01-01T00:00:01.500Z", format_time(parse_time("2024-01-01T00:00:01.500Z")))
+        self.assertEqual([("c", None, 10), ("c", 10, 20), ("c", 20, None)], time_partitions("c", 0, 30, 3))
+        # everything modified at the same time can't be split up
+        self.assertEqual([("c", None, None)], time_partitions("c", 5, 5, 3))
+        self.assertEqual([("c", None, 15), ("c", 15, None)], split_partition(("c", None, None), 0, 30))
+        self.assertEqual([], split_partition(("c", 10, 10.001), 0, 30))
+        self.assertEqual(
+            "'a' in parents and c and modifiedTime >= '1970-01-01T00:00:10.000Z'",
+            partition_query("'a' in parents", ("c", 10, None)),
+        )
+
+    def test_incomplete_search(self):
+        # Drive gives up on anything matching more than 30 files, so partitions have to be split again
+        self.setup(incomplete_search_over=30)
+
+        google_drive = GoogleDrive(None, {**FAKE_CONFIG, "listing_partitions": 4}, http=self.fake)
+        listing = google_drive.get_files_and_folders(self.source_id)
+        self.assertEqual(self.expected_ids, self.listed_ids(listing))
+        self.assertEqual((10, 190), (len(listing["folders"]), len(listing["files"])))
+        self.assertEqual(200, listing["local_object_count"])
+
+    def test_large_folder(self):
+        # ten files a page, and partitioning anything that goes past two pages
+        self.setup(max_page_size=10)
+
+        config = {**FAKE_CONFIG, "partition_after_pages": 2, "listing_partitions": 4}
+        listing = GoogleDrive(None, config, http=self.fake).get_files_and_folders(self.source_id)
+        self.assertEqual(self.expected_ids, self.listed_ids(listing))
+        # the two pages, the oldest and newest modified times and then the partitions, rather than 20 pages in a row
+        partitioned_pages = self.fake.stats["list_pages"]
+        self.assertLess(partitioned_pages, 2 + 2 + 1 + 19 + 4)
+
+        # and without partitioning, a page at a time
+        self.setup(max_page_size=10)
+        config = {**FAKE_CONFIG, "partition_after_pages": 0}
+        listing = GoogleDrive(None, config, http=self.fake).get_files_and_folders(self.source_id)
+        self.assertEqual(self.expected_ids, self.listed_ids(listing))
+        self.assertEqual(20, self.fake.stats["list_pages"])
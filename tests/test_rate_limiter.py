@@ -0,0 +1,119 @@
+import json
+from unittest import TestCase
+from unittest.mock import Mock, patch
+
+import httplib2
+
+from benchmarks.fake_drive import FakeDriveHttp, build_tree
+from services.google_drive_helpers import GoogleDrive
+from services.rate_limiter import RateLimiter, ThrottledHttp, is_retryable_response
+
+
+def response(status, reason=None):
+    """
+    a canned (response, content) tuple like httplib2 would give us
+    """
+    content = json.dumps({"error": {"errors": [{"reason": reason}]}} if reason else {}).encode("utf-8")
+    return httplib2.Response({"status": status}), content
+
+
+@patch("services.rate_limiter.time.sleep")
+class TestRateLimiter(TestCase):
+    def setup(self):
+        """
+        Run setup of commonly used objects / mocks / expectations
+        :return:
+        """
+        self.rate_limiter = RateLimiter(rate=10, max_rate=20)
+        self.mock_http = Mock()
+
+    def test_is_retryable_response(self, _):
+        def retryable(status, reason=None):
+            resp, content = response(status, reason)
+            return is_retryable_response(resp.status, content)
+
+        self.assertTrue(retryable(429))
+        self.assertTrue(retryable(503))
+        self.assertTrue(retryable(403, "userRateLimitExceeded"))
+        # a plain permissions failure won't get better by trying again
+        self.assertFalse(retryable(403, "insufficientFilePermissions"))
+        self.assertFalse(retryable(404, "notFound"))
+
+    def test_request_retries_until_success(self, mock_sleep):
+        # run setup
+        self.setup()
+
+        self.mock_http.request.side_effect = [response(429, "rateLimitExceeded"), response(503), response(200)]
+        http = ThrottledHttp(self.mock_http, self.rate_limiter)
+
+        resp, _ = http.request("https://www.googleapis.com/drive/v3/files")
+        self.assertEqual(200, resp.status)
+        self.assertEqual(3, self.mock_http.request.call_count)
+        # only the 429 should have slowed us down, both failures are retried
+        stats = self.rate_limiter.stats()
+        self.assertEqual(1, stats["throttles"])
+        self.assertEqual(2, stats["retries"])
+        self.assertEqual(0, stats["failures"])
+
+    def test_request_does_not_retry_other_errors(self, _):
+        # run setup
+        self.setup()
+
+        self.mock_http.request.return_value = response(404, "notFound")
+        resp, _ = ThrottledHttp(self.mock_http, self.rate_limiter).request("https://www.googleapis.com/drive/v3/files")
+        self.assertEqual(404, resp.status)
+        self.mock_http.request.assert_called_once()
+
+    def test_request_gives_up(self, _):
+        # run setup
+        self.setup()
+
+        self.mock_http.request.return_value = response(429, "rateLimitExceeded")
+        http = ThrottledHttp(self.mock_http, self.rate_limiter, max_attempts=3)
+        resp, _ = http.request("https://www.googleapis.com/drive/v3/files")
+        # hand the failure back so the caller sees the HttpError
+        self.assertEqual(429, resp.status)
+        self.assertEqual(3, self.mock_http.request.call_count)
+        self.assertEqual(1, self.rate_limiter.stats()["failures"])
+
+    def test_rate_adapts(self, _):
+        # run setup
+        self.setup()
+
+        # additive increase while things go well
+        for _ in range(10):
+            self.rate_limiter.on_success()
+        self.assertGreater(self.rate_limiter.rate, 10)
+        increased_rate = self.rate_limiter.rate
+        # multiplicative decrease when throttled, but only once for a burst of throttles
+        self.rate_limiter.last_decrease -= 5
+        self.rate_limiter.on_throttle()
+        self.rate_limiter.on_throttle()
+        self.assertEqual(increased_rate / 2, self.rate_limiter.rate)
+        self.assertEqual(2, self.rate_limiter.stats()["throttles"])
+
+    def test_walk_and_copy_with_injected_errors(self, _):
+        # a fake Drive that fails a third of all requests with 429s and 503s
+        fake = FakeDriveHttp(error_rate=0.3, seed=1)
+        source_id = fake.add_folder("source")
+        build_tree(fake, source_id, depth=2, folders_per_folder=3, files_per_folder=4)
+        config = {
+            "copy_exact_filename": True,
+            "copy_engine": "batched",
+            "max_request_attempts": 10,
+            "rate_limit_qps": 10000,
+            "rate_limit_max_qps": 10000,
+        }
+        google_drive = GoogleDrive(None, config, http=fake)
+
+        # nothing is lost to the injected errors
+        drive_data, total_folders, total_files = google_drive.get_nested_objects_concurrent(source_id)
+        self.assertEqual(12, total_folders)
+        self.assertEqual(52, total_files)
+        destination_id = google_drive.copy_nested_items(drive_data)
+        self.assertEqual((12, 52), google_drive.get_nested_objects_concurrent(destination_id)[1:])
+
+        stats = google_drive.rate_limiter.stats()
+        self.assertGreater(fake.stats["errors"], 0)
+        self.assertGreater(stats["retries"], 0)
+        self.assertEqual(0, stats["failures"])
@@ -0,0 +1,132 @@
+import os
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from unittest import TestCase
+
+from benchmarks.fake_drive import FakeDriveHttp, build_tree
+from services.copy_journal import CopyJournal
+from services.google_drive_helpers import GoogleDrive
+from services.sharding import ShardQueue, make_shards, run_shard_worker
+from services.tree_store import TreeStore
+from tests import FAKE_CONFIG
+
+
+class TestSharding(TestCase):
+    def setup(self):
+        """
+        Run setup of commonly used objects / mocks / expectations
+        :return:
+        """
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        self.fake = FakeDriveHttp()
+        self.source_id = self.fake.add_folder("source")
+        build_tree(self.fake, self.source_id, depth=3, folders_per_folder=3, files_per_folder=2)
+        self.destination_id = self.fake.add_folder("destination")
+        self.config = {
+            **FAKE_CONFIG,
+            "tree_store": os.path.join(self.directory.name, "drive_data.sqlite"),
+            "copy_journal": os.path.join(self.directory.name, "copy_journal.sqlite"),
+            "shard_queue": os.path.join(self.directory.name, "shard_queue.sqlite"),
+        }
+
+    def test_make_shards(self):
+        drive_data = {
+            "folders": [
+                {"folder_id": "a", "nested_object_count": 9},
+                {"folder_id": "b", "nested_object_count": 4},
+                {"folder_id": "c", "nested_object_count": 4},
+            ],
+            "files": [{"file_id": "d"}, {"file_id": "e"}],
+        }
+        # biggest first, each onto whichever shard is smallest
+        self.assertEqual([(["a"], 10), (["b", "d"], 6), (["c", "e"], 6)], make_shards(drive_data, 3))
+        self.assertEqual([(["a", "b", "c", "d", "e"], 22)], make_shards(drive_data, 1))
+
+    def test_queue(self):
+        # run setup
+        self.setup()
+
+        queue = ShardQueue(self.config["shard_queue"])
+        queue.plan("source", "destination", [(["a"], 10), (["b", "c"], 8)])
+        self.assertEqual(("source", "destination"), queue.copy())
+        self.assertEqual((0, ["a"]), queue.claim("worker 1"))
+        self.assertEqual((1, ["b", "c"]), queue.claim("worker 2"))
+        self.assertIsNone(queue.claim("worker 1"))
+        queue.finish(0)
+        self.assertEqual({"done": 1, "copying": 1}, queue.statuses())
+
+        # resuming hands out again whatever a worker that was killed had claimed, but not what was done
+        queue.plan("source", "destination", [(["a"], 10), (["b", "c"], 8)], resume=True)
+        self.assertEqual((1, ["b", "c"]), queue.claim("worker 3"))
+        # and a new copy starts again from scratch
+        queue.plan("source", "elsewhere", [(["a", "b", "c"], 18)], resume=True)
+        self.assertEqual({"pending": 1}, queue.statuses())
+        queue.close()
+
+    def test_sharded_copy(self):
+        # run setup
+        self.setup()
+
+        # the coordinator walks the source into the tree store and queues its shards
+        google_drive = GoogleDrive(None, self.config, http=self.fake)
+        tree_store = TreeStore(self.config["tree_store"])
+        drive_data, total_folders, total_files = google_drive.get_nested_objects_concurrent(
+            self.source_id, on_listing=tree_store.write_listing
+        )
+        tree_store.finish_source(self.source_id)
+        tree_store.close()
+        queue = ShardQueue(self.config["shard_queue"])
+        queue.plan(self.source_id, self.destination_id, make_shards(drive_data, 4))
+
+        # three workers, each with a connection of its own, share the shards out between them
+        workers = [GoogleDrive(None, {**self.config, "copy_engine": "parallel"}, http=self.fake) for _ in range(3)]
+        with ThreadPoolExecutor(max_workers=3) as executor:
+            copied = list(executor.map(run_shard_worker, workers, [self.config["shard_queue"]] * 3, ["1", "2", "3"]))
+        self.assertEqual(4, sum(copied))
+        self.assertEqual({"done": 4}, queue.statuses())
+        queue.close()
+
+        _, copied_folders, copied_files = google_drive.get_nested_objects_concurrent(self.destination_id)
+        self.assertEqual((total_folders, total_files), (copied_folders, copied_files))
+        # and everything they copied is in the one journal
+        journal = CopyJournal(self.config["copy_journal"])
+        self.assertEqual(total_folders + total_files, len(journal.entries))
+        journal.close()
+
+    def test_failed_shard(self):
+        # run setup
+        self.setup()
+
+        google_drive = GoogleDrive(None, self.config, http=self.fake)
+        tree_store = TreeStore(self.config["tree_store"])
+        drive_data, total_folders, total_files = google_drive.get_nested_objects_concurrent(
+            self.source_id, on_listing=tree_store.write_listing
+        )
+        tree_store.finish_source(self.source_id)
+        tree_store.close()
+        queue = ShardQueue(self.config["shard_queue"])
+        queue.plan(self.source_id, self.destination_id, make_shards(drive_data, 2))
+
+        # one file deep in the tree can't be copied, which the copy engine only logs
+        broken = drive_data["folders"][0]["child_objects"]["files"][0]["file_id"]
+        worker = GoogleDrive(None, {**self.config, "copy_engine": "parallel"}, http=self.fake)
+        copy_file_object = worker.copy_file_object
+
+        def copy_all_but_broken(file, destination_folder_id):
+            return None if file["file_id"] == broken else copy_file_object(file, destination_folder_id)
+
+        worker.copy_file_object = copy_all_but_broken
+        self.assertEqual(1, run_shard_worker(worker, self.config["shard_queue"], "1"))
+        self.assertEqual({"done": 1, "failed": 1}, queue.statuses())
+
+        # resuming copies just what was missing
+        queue.plan(self.source_id, self.destination_id, make_shards(drive_data, 2), resume=True)
+        worker = GoogleDrive(None, {**self.config, "copy_engine": "parallel"}, http=self.fake)
+        calls = self.fake.stats["calls"]
+        self.assertEqual(1, run_shard_worker(worker, self.config["shard_queue"], "1"))
+        self.assertEqual(1, self.fake.stats["calls"] - calls)
+        self.assertEqual({"done": 2}, queue.statuses())
+        queue.close()
+        _, copied_folders, copied_files = google_drive.get_nested_objects_concurrent(self.destination_id)
+        self.assertEqual((total_folders, total_files), (copied_folders, copied_files))
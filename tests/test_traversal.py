@@ -0,0 +1,100 @@
+from unittest import TestCase
+
+from benchmarks.fake_drive import FakeDriveHttp
+from services.google_drive_helpers import GoogleDrive, TYPE_SHORTCUT
+from services.traversal import VisitedIndex
+from tests import FAKE_CONFIG
+
+
+class TestTraversal(TestCase):
+    def setup(self):
+        """
+        Run setup of commonly used objects / mocks / expectations
+        :return:
+        """
+        # source -> a, b. shared is in both a and b, shared file in both shared and a, and loop puts shared in itself
+        self.fake = FakeDriveHttp()
+        self.source_id = self.fake.add_folder("source")
+        self.folder_a = self.fake.add_folder("a", self.source_id)
+        self.folder_b = self.fake.add_folder("b", self.source_id)
+        self.shared = self.fake.add_folder("shared", self.folder_a)
+        self.fake.update_file(self.shared, add_parents=[self.folder_b])
+        self.shared_file = self.fake.add_file("shared file", self.shared)
+        self.fake.update_file(self.shared_file, add_parents=[self.folder_a])
+        self.fake.add_file("file", self.folder_b)
+        self.loop = self.fake.add_folder("loop", self.shared)
+        self.fake.update_file(self.shared, add_parents=[self.loop])
+
+    def google_drive(self, policy: str) -> GoogleDrive:
+        # one worker, so a and b are always listed in order
+        config = {**FAKE_CONFIG, "multi_parent_policy": policy, "traversal_workers": 1, "copy_engine": "parallel"}
+        return GoogleDrive(None, config, http=self.fake)
+
+    def test_copy_once(self):
+        # run setup
+        self.setup()
+
+        google_drive = self.google_drive("copy_once")
+        drive_data, total_folders, total_files = google_drive.get_nested_objects_concurrent(self.source_id)
+        # every folder listed once, the loop back to shared is never followed
+        self.assertEqual(5, self.fake.stats["list_pages"])
+        self.assertEqual((4, 2), (total_folders, total_files))
+        folder_a, folder_b = drive_data["folders"]
+        self.assertEqual(["shared"], [folder["folder_name"] for folder in folder_a["child_objects"]["folders"]])
+        self.assertEqual(["shared file"], [file["file_name"] for file in folder_a["child_objects"]["files"]])
+        self.assertEqual({"folders": [], "files": ["file"]}, {
+            "folders": folder_b["child_objects"]["folders"],
+            "files": [file["file_name"] for file in folder_b["child_objects"]["files"]],
+        })
+        counters = google_drive.metrics.snapshot()["counters"]
+        self.assertEqual({"cycles": 1, "multi_parent_files": 1, "multi_parent_folders": 1}, counters)
+
+        # the depth first walk finds everything first in the same place
+        self.assertEqual(
+            (drive_data, total_folders, total_files), self.google_drive("copy_once").get_nested_objects(self.source_id)
+        )
+
+    def test_copy_per_parent(self):
+        # run setup
+        self.setup()
+
+        google_drive = self.google_drive("copy_per_parent")
+        drive_data, total_folders, total_files = google_drive.get_nested_objects_concurrent(self.source_id)
+        # shared and loop are handed back under both a and b, but still only listed once
+        self.assertEqual(5, self.fake.stats["list_pages"])
+        self.assertEqual((6, 4), (total_folders, total_files))
+        self.assertEqual([4, 4], [folder["nested_object_count"] for folder in drive_data["folders"]])
+
+        files_before = len(self.fake.files)
+        google_drive.copy_nested_items(drive_data)
+        # the source folder, then everything walked
+        self.assertEqual(1 + 6 + 4, len(self.fake.files) - files_before)
+
+    def test_link(self):
+        # run setup
+        self.setup()
+
+        google_drive = self.google_drive("link")
+        drive_data, total_folders, total_files = google_drive.get_nested_objects_concurrent(self.source_id)
+        # shared in b, and the shared file in shared, are shortcuts to the first ones
+        self.assertEqual((4, 4), (total_folders, total_files))
+        shortcut = drive_data["folders"][1]["child_objects"]["files"][0]
+        self.assertEqual({"file_id": self.shared, "file_name": "shared", "shortcut": True}, shortcut)
+
+        destination_id = google_drive.copy_nested_items(drive_data)
+        copy_of_b = [item for item in self.fake.children(destination_id) if item["name"] == "b"][0]
+        shortcuts = [item for item in self.fake.children(copy_of_b["id"]) if item["mimeType"] == TYPE_SHORTCUT]
+        self.assertEqual([{"targetId": self.shared}], [item["shortcutDetails"] for item in shortcuts])
+
+    def test_deep_tree(self):
+        # far deeper than python would let us recurse
+        fake = FakeDriveHttp()
+        source_id = parent_id = fake.add_folder("source")
+        for depth in range(2000):
+            parent_id = fake.add_folder(f"folder {depth}", parent_id)
+        google_drive = GoogleDrive(None, FAKE_CONFIG, http=fake)
+        _, total_folders, _ = google_drive.get_nested_objects(source_id)
+        self.assertEqual(2000, total_folders)
+
+    def test_unknown_policy(self):
+        self.assertRaises(ValueError, VisitedIndex, "source", "copy_twice")
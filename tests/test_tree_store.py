@@ -0,0 +1,126 @@
+import os
+import tempfile
+from unittest import TestCase
+from unittest.mock import patch
+
+from benchmarks.fake_drive import FakeDriveHttp, build_tree
+from services.google_drive_helpers import GoogleDrive
+from services.tree_store import TreeStore
+from tests import FAKE_CONFIG
+
+
+class TestTreeStore(TestCase):
+    def setup(self):
+        """
+        Run setup of commonly used objects / mocks / expectations
+        :return:
+        """
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        self.store_path = os.path.join(self.directory.name, "drive_data.sqlite")
+
+        self.fake = FakeDriveHttp()
+        self.source_id = self.fake.add_folder("source")
+        build_tree(self.fake, self.source_id, depth=2, folders_per_folder=2, files_per_folder=3)
+        self.google_drive = GoogleDrive(None, FAKE_CONFIG, http=self.fake)
+
+        # walk the source into the store
+        self.tree_store = TreeStore(self.store_path)
+        self.addCleanup(self.tree_store.close)
+        self.drive_data, self.total_folders, self.total_files = self.google_drive.get_nested_objects_concurrent(
+            self.source_id, on_listing=self.tree_store.write_listing
+        )
+        self.drive_data["start_page_token"] = "page-token"
+        # the store works out the same counts from what it was given
+        self.assertEqual(
+            (self.total_folders, self.total_files), self.tree_store.finish_source(self.source_id, "page-token")
+        )
+
+    def test_load_tree(self):
+        # run setup
+        self.setup()
+
+        tree_store = TreeStore(self.store_path)
+        self.assertEqual(self.drive_data, tree_store.load_tree(self.source_id, lazy=False))
+
+        drive_data = tree_store.load_tree(self.source_id)
+        folder = drive_data["folders"][0]
+        # nothing under the top level is loaded until something asks for it
+        self.assertNotIn("child_objects", folder)
+        expected = self.drive_data["folders"][0]
+        self.assertEqual(expected["nested_object_count"], folder["nested_object_count"])
+        self.assertEqual(expected["child_objects"]["files"], folder["child_objects"]["files"])
+        self.assertIn("child_objects", folder)
+        tree_store.close()
+
+    def test_get_source(self):
+        # run setup
+        self.setup()
+
+        source = self.tree_store.get_source(self.source_id)
+        self.assertEqual(("page-token", 6, 21), (
+            source["start_page_token"], source["total_nested_folders"], source["total_nested_files"]
+        ))
+        self.assertIsNone(self.tree_store.get_source("some-other-folder"))
+        # too old
+        with patch("services.tree_store.time.time", return_value=source["walked_at"] + 61):
+            self.assertIsNone(self.tree_store.get_source(self.source_id, max_age=60))
+            self.assertIsNotNone(self.tree_store.get_source(self.source_id, max_age=120))
+        # walked with another multi parent policy
+        self.assertIsNotNone(self.tree_store.get_source(self.source_id, multi_parent_policy="copy_once"))
+        self.assertIsNone(self.tree_store.get_source(self.source_id, multi_parent_policy="link"))
+
+    def test_shortcuts(self):
+        # run setup
+        self.setup()
+
+        listing = {
+            "folder_id": "folder",
+            "folders": [],
+            "files": [{"file_id": "target", "file_name": "link", "shortcut": True}],
+            "local_object_count": 1,
+        }
+        self.tree_store.write_listing(listing)
+        self.assertEqual(listing, self.tree_store.load_listing("folder"))
+
+    def test_copy_from_lazy_tree(self):
+        # run setup
+        self.setup()
+
+        destination_id = self.google_drive.copy_nested_items(self.tree_store.load_tree(self.source_id))
+        copied, total_folders, total_files = self.google_drive.get_nested_objects_concurrent(destination_id)
+        self.assertEqual((self.total_folders, self.total_files), (total_folders, total_files))
+
+    def test_load_compact_tree(self):
+        # run setup
+        self.setup()
+
+        tree = self.tree_store.load_compact_tree(self.source_id)
+        self.assertEqual((self.total_folders, self.total_files), tree.totals())
+        self.assertEqual(self.tree_store.load_tree(self.source_id, lazy=False), {
+            **tree.to_drive_data(), "start_page_token": "page-token"
+        })
+
+        drive_data = self.tree_store.load_tree(self.source_id, compact=True)
+        self.assertEqual("page-token", drive_data["start_page_token"])
+        destination_id = self.google_drive.copy_nested_items(drive_data)
+        _, total_folders, total_files = self.google_drive.get_nested_objects_concurrent(destination_id)
+        self.assertEqual((self.total_folders, self.total_files), (total_folders, total_files))
+
+    def test_save_tree(self):
+        # run setup
+        self.setup()
+
+        # a file goes away and a folder is emptied, like an incremental sync might do
+        del self.drive_data["files"][0]
+        emptied = self.drive_data["folders"][0]
+        emptied["child_objects"] = {
+            "folder_id": emptied["folder_id"], "folders": [], "files": [], "local_object_count": 0
+        }
+        self.tree_store.save_tree(self.drive_data)
+
+        drive_data = self.tree_store.load_tree(self.source_id, lazy=False)
+        self.assertEqual([], drive_data["folders"][0]["child_objects"]["files"])
+        self.assertEqual(0, drive_data["folders"][0]["nested_object_count"])
+        self.assertEqual(len(self.drive_data["files"]), len(drive_data["files"]))
+        self.assertEqual(self.total_files - 1 - 3 - 6, self.tree_store.get_source(self.source_id)["total_nested_files"])